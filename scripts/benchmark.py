@@ -0,0 +1,113 @@
+"""Benchmark pipeline stages on synthetic suite2p data.
+
+Generates a synthetic acquisition (`external.suite2p.synthetic`) of the requested size, then
+times each stage of `scripts/pipeline.py` w/ `ryeutils.profiling`, and reports wall/CPU
+time, peak RSS, output size and throughput (cell-frames per second).
+
+Examples:
+    python scripts/benchmark.py --cells 2000 --frames 10000 --trials 51
+    python scripts/benchmark.py --cells 1000 --planes 4 --log bench.jsonl
+"""
+
+import argparse
+import tempfile
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+import external
+import ryeutils
+import xrsa
+from external.suite2p.synthetic import make_synthetic_suite2p
+from ryeutils.profiling import profile_stage
+
+
+def run_benchmark(out_dir, n_cells=500, n_frames=6000, n_planes=1, n_trials=51, n_stim=17,
+                  data_var='Fc_zscore', seed=0):
+    """Runs all stages once; returns a DataFrame w/ one row per stage."""
+    records = []
+    tags = dict(n_cells=n_cells, n_frames=n_frames, n_planes=n_planes, n_trials=n_trials)
+    n_cell_frames = n_cells * n_planes * n_frames
+
+    with profile_stage('make_synthetic_suite2p', **tags) as record:
+        syn = make_synthetic_suite2p(out_dir, n_cells=n_cells, n_frames=n_frames,
+                                     n_planes=n_planes, n_trials=n_trials, n_stim=n_stim,
+                                     seed=seed)
+    records.append(record)
+    timestamps = syn.load_timestamps()
+
+    with profile_stage('outputs_2_xarray', **tags) as record:
+        if n_planes > 1:
+            ds = external.suite2p.convert.outputs_2_xarray_multiplane(syn.stat_file)
+        else:
+            ds = external.suite2p.convert.outputs_2_xarray_base(syn.stat_file)
+        record['result'] = ds
+    records.append(record)
+
+    ds = xrsa.timeseries.add_timestamps_to_suite2p_outputs(
+            ds, timestamps=timestamps['stack_times'])
+
+    with profile_stage('timeseries_2_trials', **tags) as record:
+        ds_trials = xrsa.trials.timeseries_2_trials(ds,
+                                                    stim_ict=timestamps['olf_ict'],
+                                                    stim_list=syn.stim_list,
+                                                    trial_ts=np.arange(-5, 20, 0.05).round(3),
+                                                    index_stimuli=True,
+                                                    stimulus_index_keys=['stim', 'stim_occ',
+                                                                         'trial_idx'])
+        record['result'] = ds_trials
+    records.append(record)
+
+    with profile_stage('baseline_correct_trials', **tags) as record:
+        ds_bc_trials = xrsa.trials.baseline_correct_trials(ds_trials, baseline_win=(-5, 0),
+                                                           baseline_method='quantile')
+        record['result'] = ds_bc_trials
+    records.append(record)
+
+    with profile_stage('compute_trial_respvec_rdm', **tags) as record:
+        record['result'] = xrsa.rdm.compute_trial_respvec_rdm(ds_bc_trials[[data_var]])
+    records.append(record)
+
+    with profile_stage('compute_time_resolved_rdm', **tags) as record:
+        record['result'] = xrsa.rdm.compute_time_resolved_rdm(ds_bc_trials[[data_var]],
+                                                              window_width=0.5,
+                                                              window_stride=0.25)
+    records.append(record)
+
+    df = pd.DataFrame(records)
+    df['cell_frames_per_s'] = n_cell_frames / df['wall_s']
+    return df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cells', type=int, default=500, help="# of ROIs per plane")
+    parser.add_argument('--frames', type=int, default=6000, help="# of frames")
+    parser.add_argument('--planes', type=int, default=1, help="# of planes")
+    parser.add_argument('--trials', type=int, default=51, help="# of trials")
+    parser.add_argument('--stim', type=int, default=17, help="# of distinct stimuli")
+    parser.add_argument('--data-var', default='Fc_zscore', help="data variable for RDMs")
+    parser.add_argument('--out-dir', type=Path, default=None,
+                        help="where to write synthetic data (default: temporary folder)")
+    parser.add_argument('--log', type=Path, default=None,
+                        help="append stage records to this .jsonl file")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    ryeutils.profiling.enable_profiling(log_file=args.log)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        out_dir = args.out_dir if args.out_dir is not None else Path(tmp_dir)
+        df = run_benchmark(out_dir, n_cells=args.cells, n_frames=args.frames,
+                           n_planes=args.planes, n_trials=args.trials, n_stim=args.stim,
+                           data_var=args.data_var, seed=args.seed)
+
+    with pd.option_context('display.width', 200, 'display.max_columns', 20,
+                           'display.float_format', '{:.3g}'.format):
+        print(df[['stage', 'wall_s', 'cpu_s', 'peak_rss_mb', 'rss_increase_mb', 'result_mb',
+                  'cell_frames_per_s']].to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
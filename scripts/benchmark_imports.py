@@ -0,0 +1,55 @@
+"""Benchmark package import times, each in fresh interpreters.
+
+Reports the median wall time of `import {package}` (in a new process, so nothing is cached
+in `sys.modules`), and which heavy optional dependencies were imported as a side effect.
+
+Examples:
+    python scripts/benchmark_imports.py
+    python scripts/benchmark_imports.py --repeats 10 xrsa external.rastermap
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+import pandas as pd
+
+DEFAULT_PACKAGES = ('xrsa', 'xrsa.vis', 'external', 'external.rastermap', 'stimuli', 'ryeutils')
+HEAVY_MODULES = ('xarray', 'pandas', 'sklearn', 'matplotlib', 'seaborn', 'tifffile', 'scipy')
+
+_TIMER = """
+import json, sys, time
+t0 = time.perf_counter()
+import {package}
+dt = time.perf_counter() - t0
+print(json.dumps(dict(import_s=dt, loaded=[m for m in {heavy!r} if m in sys.modules])))
+"""
+
+
+def time_import(package, repeats=5):
+    """Median import time of `package` over `repeats` fresh interpreters."""
+    results = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, '-c',
+                              _TIMER.format(package=package, heavy=HEAVY_MODULES)],
+                             capture_output=True, text=True, check=True).stdout
+        results.append(json.loads(out.strip().splitlines()[-1]))
+    return dict(package=package,
+                import_s=float(pd.Series([r['import_s'] for r in results]).median()),
+                heavy_loaded=", ".join(results[-1]['loaded']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('packages', nargs='*', default=DEFAULT_PACKAGES)
+    parser.add_argument('--repeats', type=int, default=5)
+    args = parser.parse_args()
+
+    df = pd.DataFrame([time_import(p, repeats=args.repeats) for p in args.packages])
+    with pd.option_context('display.width', 200, 'display.max_colwidth', 80):
+        print(df.to_string(index=False, float_format='{:.3f}'.format))
+
+
+if __name__ == "__main__":
+    main()
@@ -8,6 +8,7 @@ from attrs import define, field
 from typing import List, Union
 
 import external
+import ryeutils
 from expt.acquisition import Acquisition
 import xrsa
 import matplotlib.pyplot as plt
@@ -24,44 +25,54 @@ if __name__ == "__main__":
     acq.load_timestamps()
     acq.load_stim_list()
 
-    # %% make cells x time dataset (timeseries)
-
-    ds_suite2p_outputs = external.suite2p.convert.outputs_2_xarray_base(stat_file)
-
-    # add timestamps, where `timestamps` is a 1-D numpy array
-    ds_suite2p_outputs = xrsa.timeseries.add_timestamps_to_suite2p_outputs(
-            ds_suite2p_outputs, timestamps=acq.timestamps['stack_times'])
-
-    # drop cells where `iscell=0`
-    ds_suite2p_outputs = ds_suite2p_outputs.where(ds_suite2p_outputs.iscell == 1, drop=True)
-
-    # %% Convert timeseries (cells x time) to trials (trials x cells x time) and baseline correct
-
-    # ds_suite2p_outputs = xr.load_dataset(
-    #         "/local/matrix/Remy-Data/projects/odor_space_collab/processed_data/2023-05-10/3"
-    #         "/megamat1_calyx/source_extraction_s2p/suite2p/plane0/iscell_calyx"
-    #         "/xrds_suite2p_outputs.nc")
-
-    ds_trials = xrsa.trials.timeseries_2_trials(ds_suite2p_outputs,
-                                                stim_ict=acq.timestamps['olf_ict'],
-                                                stim_list=acq.stim_list,
-                                                trial_ts=np.arange(-5, 20, 0.05).round(3),
-                                                index_stimuli=True,
-                                                stimulus_index_keys=['stim', 'stim_occ',
-                                                                     'trial_idx'])
-
-    # baseline-correct traces
-    #   for PN boutons/KC claws, use baseline_method='quantile')
-    #   for KC soma, use baseline_method = 'mean', baseline_quantile is ignored
-
-    ds_bc_trials = xrsa.trials.baseline_correct_trials(ds_trials,
-                                                       baseline_win=(-5, 0),
-                                                       baseline_method='quantile',
-                                                       baseline_quantile=0.5
-                                                       )
-
-    # %% compute RDM
-    ds_rdm = xrsa.rdm.compute_trial_respvec_rdm(ds_bc_trials, metric='correlation')
+    # %% run pipeline stages (profiled if RYEUTILS_PROFILE_LOG is set, see ryeutils.profiling)
+
+    with ryeutils.profiling.profiling_context(acq=str(stat_file.parent)):
+        # %% make cells x time dataset (timeseries)
+
+        ds_suite2p_outputs = external.suite2p.convert.outputs_2_xarray_base(stat_file)
+
+        # add timestamps, where `timestamps` is a 1-D numpy array
+        ds_suite2p_outputs = xrsa.timeseries.add_timestamps_to_suite2p_outputs(
+                ds_suite2p_outputs, timestamps=acq.timestamps['stack_times'])
+
+        # drop cells where `iscell=0` (positions computed once, then `isel`)
+        iscell = np.load(stat_file.with_name('iscell.npy'), allow_pickle=True)[:, 0]
+        ds_suite2p_outputs = ds_suite2p_outputs.assign_coords(
+                iscell=('cells', iscell.astype('int')))
+        ds_suite2p_outputs = xrsa.respvec.filter_cells_by_coord(ds_suite2p_outputs,
+                                                                filters={'iscell': 1})
+
+        # %% Convert timeseries (cells x time) to trials (trials x cells x time) and baseline correct
+
+        # ds_suite2p_outputs = xr.load_dataset(
+        #         "/local/matrix/Remy-Data/projects/odor_space_collab/processed_data/2023-05-10/3"
+        #         "/megamat1_calyx/source_extraction_s2p/suite2p/plane0/iscell_calyx"
+        #         "/xrds_suite2p_outputs.nc")
+
+        ds_trials = xrsa.trials.timeseries_2_trials(ds_suite2p_outputs,
+                                                    stim_ict=acq.timestamps['olf_ict'],
+                                                    stim_list=acq.stim_list,
+                                                    trial_ts=np.arange(-5, 20, 0.05).round(3),
+                                                    index_stimuli=True,
+                                                    stimulus_index_keys=['stim', 'stim_occ',
+                                                                         'trial_idx'],
+                                                    # only carry the variable used for RDMs
+                                                    data_vars=['Fc_zscore'],
+                                                    dtype=np.float32)
+
+        # baseline-correct traces
+        #   for PN boutons/KC claws, use baseline_method='quantile')
+        #   for KC soma, use baseline_method = 'mean', baseline_quantile is ignored
+
+        ds_bc_trials = xrsa.trials.baseline_correct_trials(ds_trials,
+                                                           baseline_win=(-5, 0),
+                                                           baseline_method='quantile',
+                                                           baseline_quantile=0.5
+                                                           )
+
+        # %% compute RDM
+        ds_rdm = xrsa.rdm.compute_trial_respvec_rdm(ds_bc_trials, metric='correlation')
 
     # %%
     ds_rdm_sorted = \
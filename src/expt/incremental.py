@@ -0,0 +1,453 @@
+"""Incremental re-runs of per-acquisition pipelines, driven by file and parameter changes.
+
+Each derived artifact (suite2p dataset, trials, response vectors, RDMs, cluster labels) is a
+`Step` w/ source files, upstream steps and parameters. A step's fingerprint combines
+
+  - (path, size, mtime) of its source files (e.g. `F.npy`, `iscell_*.npy`, rastermap
+    embeddings, `timestamps.npy`),
+  - a hash of its parameters,
+  - the fingerprints of its upstream steps,
+
+and is stored in a JSON manifest next to the outputs when the step is built. On re-runs,
+only steps whose fingerprint changed (or whose output is missing) are recomputed, so after a
+curator updates `iscell_*.npy`, everything downstream of the suite2p dataset is rebuilt, and
+acquisitions w/ no changes are not touched at all.
+
+Examples:
+    Refresh all acquisitions in a project::
+
+        >>> stat_files = sorted(proj_dir.rglob('suite2p/plane0/stat.npy'))
+        >>> df_refresh = refresh_acquisitions(stat_files, iscell_file='iscell_good_xid0.npy',
+        ...                                   peak_win=(0, 5))
+"""
+
+import hashlib
+import json
+import pickle
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, List, Union
+import numpy as np
+import pandas as pd
+import xarray as xr
+from attrs import define, field
+
+MANIFEST_NAME = 'incremental_manifest.json'
+JSON_ATTR_PREFIX = 'json:'
+
+
+def file_fingerprint(path):
+    """(path, size, mtime_ns) of a file, w/ size and mtime None if the file doesn't exist."""
+    path = Path(path)
+    if not path.is_file():
+        return [str(path), None, None]
+    st = path.stat()
+    return [str(path), st.st_size, st.st_mtime_ns]
+
+
+def params_fingerprint(params):
+    """Hash of a parameter dict (JSON, w/ arrays and paths converted to lists/strings)."""
+    def default(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return str(obj)
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=default).encode()).hexdigest()
+
+
+def _is_netcdf_attr(value):
+    """True if `value` can be written as a netCDF attribute by every backend."""
+    if isinstance(value, (bool, np.bool_)):
+        return False
+    if isinstance(value, (str, int, float, np.number)):
+        return True
+    if isinstance(value, (list, tuple, np.ndarray)):
+        arr = np.asarray(value)
+        return arr.ndim == 1 and arr.size > 0 and arr.dtype.kind in 'iuf'
+    return False
+
+
+def _encode_attrs(attrs):
+    """Attrs w/ values netCDF can't store (e.g. lists of strings) JSON-encoded as strings."""
+    def default(obj):
+        if isinstance(obj, np.ndarray):
+            return obj.tolist()
+        if isinstance(obj, np.generic):
+            return obj.item()
+        return str(obj)
+    return {k: v if _is_netcdf_attr(v) else JSON_ATTR_PREFIX + json.dumps(v, default=default)
+            for k, v in attrs.items()}
+
+
+def _decode_attrs(attrs):
+    """Inverse of `_encode_attrs`."""
+    return {k: json.loads(v[len(JSON_ATTR_PREFIX):])
+            if isinstance(v, str) and v.startswith(JSON_ATTR_PREFIX) else v
+            for k, v in attrs.items()}
+
+
+def save_artifact(obj, path):
+    """Saves a step output, by file suffix (.nc: xarray, .npy: numpy array, .pkl: pickle).
+
+    MultiIndex dimensions of xarray objects are reset before saving, and restored by
+    `load_artifact`. Attributes netCDF can't store (lists of strings, dicts, bools, None)
+    are saved as JSON strings, and decoded by `load_artifact`. netCDF files are written to a
+    temporary file first, which is removed if writing fails.
+    """
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+
+    if path.suffix == '.nc':
+        multi_dims = [d for d in obj.dims if d in obj.indexes and obj.indexes.is_multi(d)]
+        ds = obj.to_dataset() if isinstance(obj, xr.DataArray) else obj
+        ds = ds.copy()
+        for dim in multi_dims:
+            ds.attrs[f"incremental.multiindex.{dim}"] = list(obj.indexes[dim].names)
+        if multi_dims:
+            ds = ds.reset_index(multi_dims)
+        ds.attrs = _encode_attrs(ds.attrs)
+        for name in ds.variables:
+            ds[name].attrs = _encode_attrs(ds[name].attrs)
+
+        tmp_file = path.with_name(f".{path.name}.tmp")
+        try:
+            ds.to_netcdf(tmp_file)
+            tmp_file.replace(path)
+        except BaseException:
+            tmp_file.unlink(missing_ok=True)
+            raise
+    elif path.suffix == '.npy':
+        np.save(path, obj, allow_pickle=True)
+    elif path.suffix == '.pkl':
+        with open(path, 'wb') as f:
+            pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL)
+    else:
+        raise ValueError(f"Unsupported artifact type: {path.suffix}")
+
+
+def load_artifact(path):
+    """Loads a step output saved w/ `save_artifact`."""
+    path = Path(path)
+    if path.suffix == '.nc':
+        ds = xr.load_dataset(path)
+        ds.attrs = _decode_attrs(ds.attrs)
+        for name in ds.variables:
+            ds[name].attrs = _decode_attrs(ds[name].attrs)
+        for key in [k for k in ds.attrs if k.startswith('incremental.multiindex.')]:
+            dim = key.rsplit('.', 1)[-1]
+            ds = ds.set_index({dim: list(ds.attrs.pop(key))})
+        return ds
+    if path.suffix == '.pkl':
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    arr = np.load(path, allow_pickle=True)
+    return arr.item() if arr.dtype == object and arr.ndim == 0 else arr
+
+
+@define(kw_only=True)
+class Step:
+    """A derived artifact, and how to compute it.
+
+    Args:
+        name (str): step name
+        output_file (Path): where the output is saved (.nc, .npy or .pkl)
+        compute (Callable): `compute(inputs, **params)`, where `inputs` maps upstream step
+          names to their (loaded) outputs; returns the output
+        sources (Union[List[Path], Callable]): source files, or a function returning them
+          (evaluated at every run, so newly created files, e.g. rastermap embeddings, are
+          picked up)
+        deps (List[str]): names of upstream steps
+        params (dict): keyword arguments passed to `compute`
+    """
+    name: str
+    output_file: Path = field(converter=Path)
+    compute: Callable = field(repr=False)
+    sources: Union[List[Path], Callable] = field(factory=list, repr=False)
+    deps: List[str] = field(factory=list)
+    params: dict = field(factory=dict)
+
+    def source_files(self):
+        sources = self.sources() if callable(self.sources) else self.sources
+        return sorted(Path(f) for f in sources)
+
+
+@define
+class IncrementalRunner:
+    """Runs steps in dependency order, recomputing only stale steps.
+
+    Args:
+        out_dir (Path): folder holding the manifest (`incremental_manifest.json`)
+        steps (Dict[str, Step]): steps, keyed by name
+    """
+    out_dir: Path = field(converter=Path)
+    steps: Dict[str, Step] = field(factory=dict)
+    _fingerprints: dict = field(init=False, factory=dict, repr=False)
+
+    @property
+    def manifest_file(self):
+        return self.out_dir.joinpath(MANIFEST_NAME)
+
+    def add(self, step):
+        unknown = set(step.deps) - set(self.steps)
+        if unknown:
+            raise ValueError(f"Step '{step.name}' depends on unknown steps: {unknown}")
+        self.steps[step.name] = step
+        return step
+
+    def load_manifest(self):
+        if not self.manifest_file.is_file():
+            return {}
+        with open(self.manifest_file, 'r') as f:
+            return json.load(f)
+
+    def _write_manifest(self, manifest):
+        self.out_dir.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.manifest_file.with_name(f".{MANIFEST_NAME}.tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(manifest, f, indent=2)
+        tmp_file.replace(self.manifest_file)
+
+    def fingerprint(self, name):
+        """Current fingerprint of a step (sources + params + upstream fingerprints)."""
+        if name not in self._fingerprints:
+            step = self.steps[name]
+            content = dict(sources=[file_fingerprint(f) for f in step.source_files()],
+                           params=params_fingerprint(step.params),
+                           deps={d: self.fingerprint(d) for d in step.deps})
+            self._fingerprints[name] = params_fingerprint(content)
+        return self._fingerprints[name]
+
+    def stale_steps(self, targets=None):
+        """Names of steps (needed for `targets`) that would be recomputed, in run order."""
+        manifest = self.load_manifest()
+        self._fingerprints = {}
+        return [name for name in self._run_order(targets)
+                if not self.steps[name].output_file.is_file()
+                or manifest.get(name, {}).get('fingerprint') != self.fingerprint(name)]
+
+    def _run_order(self, targets=None):
+        """Steps needed for `targets` (default: all), upstream first."""
+        order = []
+
+        def visit(name):
+            if name in order:
+                return
+            for dep in self.steps[name].deps:
+                visit(dep)
+            order.append(name)
+
+        for name in (targets if targets is not None else self.steps):
+            visit(name)
+        return order
+
+    def run(self, targets=None, force=False):
+        """Recomputes stale steps (or all, if `force`), and updates the manifest.
+
+        Args:
+            targets (List[str]): steps to bring up to date (default: all), plus their
+              upstream steps
+            force (bool): recompute everything
+
+        Returns:
+            (List[str]): names of recomputed steps
+        """
+        self._fingerprints = {}
+        stale = self._run_order(targets) if force else self.stale_steps(targets)
+        manifest = self.load_manifest()
+        outputs = {}
+
+        def get_output(name):
+            if name not in outputs:
+                outputs[name] = load_artifact(self.steps[name].output_file)
+            return outputs[name]
+
+        for name in stale:
+            step = self.steps[name]
+            inputs = {d: get_output(d) for d in step.deps}
+            outputs[name] = step.compute(inputs, **step.params)
+            save_artifact(outputs[name], step.output_file)
+
+            manifest[name] = dict(fingerprint=self.fingerprint(name),
+                                  output_file=str(step.output_file),
+                                  built_at=datetime.now().isoformat(timespec='seconds'))
+            self._write_manifest(manifest)
+
+        return stale
+
+
+# %% standard per-acquisition pipeline
+
+def _find_mov_file(stat_file, filename):
+    """First parent folder of `stat_file` containing `filename` (e.g. 'timestamps.npy')."""
+    for folder in Path(stat_file).parents:
+        if folder.joinpath(filename).is_file():
+            return folder.joinpath(filename)
+    raise FileNotFoundError(f"No {filename} found above {stat_file}")
+
+
+def _compute_suite2p(inputs, stat_file, iscell_file, attach_rmap):
+    import external
+
+    stat_file = Path(stat_file)
+    ds = external.suite2p.convert.outputs_2_xarray_base(stat_file)
+    if attach_rmap:
+        rmap_by_dir = external.rastermap.batch.ingest_rmap_results(stat_file.parent)
+        ds = external.rastermap.batch.attach_rmap_to_suite2p_dataset(
+                ds, rmap_by_dir.get(stat_file.parent, []))
+    iscell = np.load(stat_file.with_name(iscell_file), mmap_mode='r')[:, 0] == 1
+    ds = ds.assign_coords(iscell=('cells', iscell)).isel(cells=iscell)
+    ds.attrs['incremental.iscell_file'] = iscell_file
+    return ds
+
+
+def _compute_trials(inputs, timestamps_file, stim_list_file, trial_ts, baseline_win,
+                    baseline_method, baseline_quantile, data_vars, dtype):
+    import xrsa
+    from .acquisition import load_stim_list
+
+    timestamps = np.load(timestamps_file, allow_pickle=True).item()
+    ds = xrsa.timeseries.add_timestamps_to_suite2p_outputs(
+            inputs['suite2p'], timestamps=timestamps['stack_times'])
+    ds_trials = xrsa.trials.timeseries_2_trials(ds,
+                                                stim_ict=timestamps['olf_ict'],
+                                                stim_list=load_stim_list(stim_list_file),
+                                                trial_ts=np.asarray(trial_ts),
+                                                index_stimuli=True,
+                                                stimulus_index_keys=['stim', 'stim_occ',
+                                                                     'trial_idx'],
+                                                data_vars=data_vars,
+                                                dtype=None if dtype is None else np.dtype(dtype))
+    return xrsa.trials.baseline_correct_trials(ds_trials, baseline_win=baseline_win,
+                                               baseline_method=baseline_method,
+                                               baseline_quantile=baseline_quantile)
+
+
+def _compute_respvec(inputs, peak_win, peak_method):
+    import xrsa
+    return xrsa.respvec.peak_amp(inputs['trials'], peak_win=peak_win, peak_method=peak_method)
+
+
+def _compute_rdm(inputs, metric):
+    import xrsa
+    return xrsa.rdm.compute_trial_respvec_rdm(inputs['respvec'], metric=metric)
+
+
+def _compute_cluster_labels(inputs, data_var, n_clusters_grid, n_restarts):
+    import xrsa
+    da_stim_respvec = inputs['respvec'][data_var].groupby('stim').mean()
+    return xrsa.cluster.spectral.run_spectral_biclustering(
+            da_stim_respvec, [tuple(n) for n in n_clusters_grid], n_restarts=n_restarts,
+            n_jobs=1)
+
+
+def acquisition_runner(stat_file, iscell_file='iscell.npy', out_dir=None, attach_rmap=True,
+                       trial_ts=tuple(np.arange(-5, 20, 0.05).round(3)),
+                       baseline_win=(-5, 0), baseline_method='quantile',
+                       baseline_quantile=0.5, peak_win=(0, 5), peak_method='mean',
+                       metric='correlation', cluster_data_var='Fc_zscore',
+                       n_clusters_grid=None, n_restarts=5, data_vars=None, dtype=None,
+                       artifact_suffix='.nc'):
+    """Builds the standard pipeline for one acquisition.
+
+    Steps: 'suite2p' (`outputs_2_xarray_base`, filtered by `iscell_file`, w/ rastermap
+    coordinates) -> 'trials' (baseline-corrected) -> 'respvec' (`peak_amp`) -> 'rdm', and
+    'cluster_labels' (`run_spectral_biclustering` on stimulus-averaged response vectors) if
+    `n_clusters_grid` is provided.
+
+    Args:
+        stat_file (Path): suite2p 'stat.npy'
+        iscell_file (str): iscell filename (next to `stat_file`) used to select cells
+        out_dir (Path): output folder (default: `{stat_file.parent}/incremental`)
+        attach_rmap (bool): add rastermap embeddings (`rmap/iscell_*`) as cell coordinates
+        trial_ts, baseline_win, baseline_method, baseline_quantile: see
+          `xrsa.trials.timeseries_2_trials` and `xrsa.trials.baseline_correct_trials`
+        peak_win, peak_method: see `xrsa.respvec.peak_amp`
+        metric (str): RDM distance metric
+        cluster_data_var (str): data variable used for clustering
+        n_clusters_grid (List[Tuple[int, int]]): see `run_spectral_biclustering`
+        n_restarts (int): see `run_spectral_biclustering`
+        data_vars (List[str]): data variables carried from 'trials' on (default: all)
+        dtype (str): dtype of trial tensors, e.g. 'float32' (default: unchanged)
+        artifact_suffix (str): output format, '.nc' (netCDF) or '.pkl' (pickle)
+
+    Returns:
+        IncrementalRunner
+    """
+    import external
+
+    stat_file = Path(stat_file)
+    out_dir = stat_file.with_name('incremental') if out_dir is None else Path(out_dir)
+    suffix = Path(iscell_file).stem
+
+    def suite2p_sources():
+        sources = [stat_file.with_name(f) for f in ('F.npy', 'Fneu.npy', 'spks.npy')]
+        sources.append(stat_file.with_name(iscell_file))
+        if attach_rmap:
+            sources.extend(external.rastermap.batch.find_rmap_embedding_files(stat_file.parent))
+        return sources
+
+    timestamps_file = _find_mov_file(stat_file, 'timestamps.npy')
+    stim_list_file = _find_mov_file(stat_file, 'stim_list.json')
+
+    runner = IncrementalRunner(out_dir)
+    runner.add(Step(name='suite2p',
+                    output_file=out_dir.joinpath(f"xrds_suite2p_outputs__{suffix}{artifact_suffix}"),
+                    compute=_compute_suite2p,
+                    sources=suite2p_sources,
+                    params=dict(stat_file=str(stat_file), iscell_file=iscell_file,
+                                attach_rmap=attach_rmap)))
+    runner.add(Step(name='trials',
+                    output_file=out_dir.joinpath(f"xrds_bc_trials__{suffix}{artifact_suffix}"),
+                    compute=_compute_trials,
+                    sources=[timestamps_file, stim_list_file],
+                    deps=['suite2p'],
+                    params=dict(timestamps_file=str(timestamps_file),
+                                stim_list_file=str(stim_list_file),
+                                trial_ts=list(trial_ts), baseline_win=baseline_win,
+                                baseline_method=baseline_method,
+                                baseline_quantile=baseline_quantile,
+                                data_vars=data_vars,
+                                dtype=None if dtype is None else np.dtype(dtype).name)))
+    runner.add(Step(name='respvec',
+                    output_file=out_dir.joinpath(f"xrds_respvec__{suffix}{artifact_suffix}"),
+                    compute=_compute_respvec,
+                    deps=['trials'],
+                    params=dict(peak_win=peak_win, peak_method=peak_method)))
+    runner.add(Step(name='rdm',
+                    output_file=out_dir.joinpath(f"xrds_rdm__{suffix}{artifact_suffix}"),
+                    compute=_compute_rdm,
+                    deps=['respvec'],
+                    params=dict(metric=metric)))
+    if n_clusters_grid is not None:
+        runner.add(Step(name='cluster_labels',
+                        output_file=out_dir.joinpath(f"xrds_cluster_labels__{suffix}{artifact_suffix}"),
+                        compute=_compute_cluster_labels,
+                        deps=['respvec'],
+                        params=dict(data_var=cluster_data_var,
+                                    n_clusters_grid=[list(n) for n in n_clusters_grid],
+                                    n_restarts=n_restarts)))
+    return runner
+
+
+def refresh_acquisitions(stat_files, targets=None, force=False, **kwargs):
+    """Brings the pipeline of every acquisition up to date (see `acquisition_runner`).
+
+    Args:
+        stat_files (List[Path]): suite2p 'stat.npy' files, one per acquisition
+        targets (List[str]): steps to bring up to date (default: all)
+        force (bool): recompute everything
+        **kwargs: passed to `acquisition_runner`
+
+    Returns:
+        (pd.DataFrame): one row per acquisition, w/ the recomputed steps (or the error)
+    """
+    rows = []
+    for stat_file in stat_files:
+        try:
+            recomputed = acquisition_runner(stat_file, **kwargs).run(targets=targets,
+                                                                     force=force)
+            rows.append(dict(stat_file=str(stat_file), recomputed=recomputed, error=None))
+        except Exception as err:
+            rows.append(dict(stat_file=str(stat_file), recomputed=[], error=repr(err)))
+    return pd.DataFrame(rows)
@@ -1,3 +1,3 @@
-from . import suite2p
-from . import tom
-from . import rastermap
+from ryeutils.lazy import lazy_submodules
+
+__getattr__, __dir__, __all__ = lazy_submodules(__name__, ['suite2p', 'tom', 'rastermap'])
@@ -1,5 +1,3 @@
-from . import core
-from . import embedding
-from . import convert
-from . import io
+from ryeutils.lazy import lazy_submodules
 
+__getattr__, __dir__, __all__ = lazy_submodules(__name__, ['core', 'embedding', 'convert', 'io', 'batch'])
@@ -0,0 +1,173 @@
+"""Bulk ingestion of rastermap embeddings for all `rmap/iscell_*` folders in a project.
+
+Expected layout (see `external.rastermap.io.move_fluorescence_with_iscell`)::
+
+    suite2p/plane0/stat.npy
+    suite2p/plane0/rmap/iscell_{suffix}/iscell_{suffix}.npy
+    suite2p/plane0/rmap/iscell_{suffix}/Fc_zscore_{suffix}_embedding.npy
+"""
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from attrs import define, field
+from ..suite2p.iscells import get_iscell_suffix
+from .core import rmap_cluster_labels
+
+
+@define(kw_only=True)
+class RmapResult:
+    """Rastermap outputs for one iscell variant, expanded to all suite2p ROIs.
+
+    Args:
+        embedding_file (Path): path to '*_embedding.npy'
+        iscell_file (Path): iscell file the embedding was computed on
+        suffix (str): iscell suffix (`iscell_{suffix}.npy`), None for 'iscell.npy'
+        cluster_labels (np.ndarray): (n_total_rois,) int16, 0 = no cluster or not in iscell
+        embedding (np.ndarray): (n_total_rois,) float32, NaN if not in iscell
+    """
+    embedding_file: Path = field(converter=Path)
+    iscell_file: Path = field(converter=Path)
+    suffix: str
+    cluster_labels: np.ndarray = field(repr=False)
+    embedding: np.ndarray = field(repr=False)
+
+    @property
+    def suite2p_dir(self):
+        """Folder containing `stat.npy` (i.e. .../suite2p/plane0)."""
+        return self.embedding_file.parent.parent.parent
+
+
+def find_rmap_embedding_files(root_dir, embedding_glob='*_embedding.npy'):
+    """Finds rastermap embeddings in all `rmap/iscell*` folders under `root_dir`.
+
+    If a folder contains several embeddings, the most recently modified one is used.
+
+    Args:
+        root_dir (Path): project (or single suite2p plane) directory
+        embedding_glob (str): embedding filename pattern
+
+    Returns:
+        (List[Path]): embedding files, sorted
+    """
+    embedding_files = []
+    for rmap_iscell_dir in sorted(Path(root_dir).rglob('rmap/iscell*')):
+        if not rmap_iscell_dir.is_dir():
+            continue
+        files = list(rmap_iscell_dir.glob(embedding_glob))
+        if files:
+            embedding_files.append(max(files, key=lambda f: f.stat().st_mtime))
+    return embedding_files
+
+
+def load_rmap_result(embedding_file):
+    """Loads one rastermap embedding and expands it against its iscell file.
+
+    The iscell copy in the `rmap/iscell_{suffix}` folder is used if present, otherwise
+    `iscell_{suffix}.npy` next to `stat.npy`.
+
+    Args:
+        embedding_file (Path): path to '*_embedding.npy', in a `rmap/iscell_{suffix}` folder
+
+    Returns:
+        RmapResult
+    """
+    embedding_file = Path(embedding_file)
+    iscell_stem = embedding_file.parent.name
+    suffix = get_iscell_suffix(iscell_stem)
+
+    iscell_file = embedding_file.with_name(f"{iscell_stem}.npy")
+    if not iscell_file.is_file():
+        iscell_file = embedding_file.parent.parent.with_name(f"{iscell_stem}.npy")
+
+    emb = np.load(embedding_file, allow_pickle=True).item()
+    good = np.load(iscell_file, mmap_mode='r')[:, 0] == 1
+
+    n_good = int(good.sum())
+    if emb['embedding'].shape[0] != n_good:
+        raise ValueError(f"Rastermap embedding not compatible with iscell: {embedding_file}")
+
+    cluster_labels = np.zeros(good.size, dtype=np.int16)
+    cluster_labels[good] = rmap_cluster_labels(emb, dtype=np.int16)
+
+    embedding = np.full(good.size, np.nan, dtype=np.float32)
+    embedding[good] = emb['embedding'][:, 0]
+
+    return RmapResult(embedding_file=embedding_file, iscell_file=iscell_file, suffix=suffix,
+                      cluster_labels=cluster_labels, embedding=embedding)
+
+
+def load_rmap_results(embedding_files, max_workers=8):
+    """Loads many rastermap embeddings in parallel (thread pool, loading is I/O bound).
+
+    Args:
+        embedding_files (List[Path]): from `find_rmap_embedding_files`
+        max_workers (int): # of threads
+
+    Returns:
+        (List[RmapResult]): in the same order as `embedding_files`
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(load_rmap_result, embedding_files))
+
+
+def rmap_results_to_dataframe(rmap_results):
+    """Summary table of loaded rastermap results (one row per iscell variant)."""
+    return pd.DataFrame([
+        dict(suite2p_dir=str(r.suite2p_dir),
+             suffix=r.suffix,
+             embedding_file=str(r.embedding_file),
+             n_total_rois=r.cluster_labels.size,
+             n_embedded_rois=int(np.isfinite(r.embedding).sum()),
+             n_cluster_rois=int((r.cluster_labels > 0).sum()),
+             n_clusters=int(np.unique(r.cluster_labels[r.cluster_labels > 0]).size))
+        for r in rmap_results])
+
+
+def attach_rmap_to_suite2p_dataset(ds_suite2p_outputs, rmap_results, cell_dim='cells'):
+    """Adds rastermap labels and embeddings as coordinates along `cell_dim`.
+
+    Coordinates are named `rmap_cluster_{suffix}` and `rmap_embedding_{suffix}` (or
+    `rmap_cluster` and `rmap_embedding` for the default 'iscell.npy'). Results
+    must be for the same suite2p folder as `ds_suite2p_outputs` (i.e. same # of ROIs).
+
+    Args:
+        ds_suite2p_outputs (xr.Dataset): from `external.suite2p.convert.outputs_2_xarray_base`
+        rmap_results (List[RmapResult]): rastermap results for this suite2p folder
+        cell_dim (str): cell dimension name
+
+    Returns:
+        (xr.Dataset): dataset w/ rastermap coordinates added
+    """
+    n_cells = ds_suite2p_outputs.sizes[cell_dim]
+    new_coords = {}
+
+    for r in rmap_results:
+        if r.cluster_labels.size != n_cells:
+            raise ValueError(f"{r.embedding_file} has {r.cluster_labels.size} rois, "
+                             f"dataset has {n_cells} cells.")
+        tag = "" if r.suffix is None else f"_{r.suffix}"
+        new_coords[f"rmap_cluster{tag}"] = (cell_dim, r.cluster_labels)
+        new_coords[f"rmap_embedding{tag}"] = (cell_dim, r.embedding)
+
+    return ds_suite2p_outputs.assign_coords(new_coords)
+
+
+def ingest_rmap_results(root_dir, embedding_glob='*_embedding.npy', max_workers=8):
+    """Finds and loads all rastermap results under `root_dir`, grouped by suite2p folder.
+
+    Examples:
+        Re-ingest rastermap results after a curation round::
+
+            rmap_by_dir = ingest_rmap_results(proj_dir)
+            ds = attach_rmap_to_suite2p_dataset(ds_suite2p_outputs,
+                                                rmap_by_dir[stat_file.parent])
+
+    Returns:
+        (Dict[Path, List[RmapResult]]): rastermap results keyed by suite2p folder
+    """
+    files = find_rmap_embedding_files(root_dir, embedding_glob=embedding_glob)
+    rmap_by_dir = {}
+    for r in load_rmap_results(files, max_workers=max_workers):
+        rmap_by_dir.setdefault(r.suite2p_dir, []).append(r)
+    return rmap_by_dir
@@ -1,18 +1,16 @@
 import numpy as np
 from pathlib import Path
 from external.suite2p.iscells import get_iscell_suffix
-from . import embedding
-from scipy.stats import zscore
+from . import core
+from external.suite2p.preprocess import preprocess_fluorescence
 
 
-def make_Fc_zscore_file(stat_file):
-    F = np.load(stat_file.with_name('F.npy'))
-    Fneu = np.load(stat_file.with_name('Fneu.npy'))
+def make_Fc_zscore_file(stat_file, neucoeff=0.7, dtype=np.float32, chunk_size=4096):
+    F = np.load(stat_file.with_name('F.npy'), mmap_mode='r')
+    Fneu = np.load(stat_file.with_name('Fneu.npy'), mmap_mode='r')
 
-    Fc = F - 0.7 * Fneu
-    Fc_zscore = zscore(Fc, axis=1)
-
-    np.save(stat_file.with_name('Fc_zscore.npy'), Fc_zscore)
+    preprocess_fluorescence(F, Fneu, neucoeff=neucoeff, data_vars=['Fc_zscore'], dtype=dtype,
+                            chunk_size=chunk_size, out_dir=stat_file.parent)
 
 
 def prep_fluorescence_for_rastermap(stat_file, data_var, iscell_filename):
@@ -39,7 +37,7 @@ def rmap_2_iscell_simple(rmap_file, iscell_file=None, save_name='iscell_rmap.npy
     if iscell_file is None:
         iscell_file = rmap_file.with_name('iscell.npy')
 
-    iscell_rmap = embedding.rmap_2_rmap_arr(emb)
+    iscell_rmap = core.rmap_2_rmap_arr(emb)
     file = rmap_file.with_name(save_name)
 
     np.save(file, iscell_rmap)
@@ -55,13 +55,34 @@ def rmap_2_rmap_arr(emb):
     rmap_arr = np.zeros((n_rois, 2))
 
     rmap_arr[:, 1] = emb['embedding'][:, 0]
-
-    for iclust, clust in enumerate(emb['user_clusters']):
-        rmap_arr[clust['ids'], 0] = iclust + 1
+    rmap_arr[:, 0] = rmap_cluster_labels(emb)
 
     return rmap_arr
 
 
+def rmap_cluster_labels(emb, dtype=np.int16):
+    """User cluster labels for each roi in a rastermap embedding (vectorized scatter).
+
+    Args:
+        emb (dict): rastermap embedding, loaded from 'Fc_zscore_embedding.npy'
+        dtype (np.dtype): label dtype (default int16)
+
+    Returns:
+        labels (np.ndarray): (n_roi,) cluster labels starting at 1, 0 = not in any cluster.
+          If clusters overlap, the later cluster wins (same as assigning them in order).
+    """
+    n_rois = emb['embedding'].shape[0]
+    labels = np.zeros(n_rois, dtype=dtype)
+
+    user_clusters = emb.get('user_clusters', None) or []
+    if len(user_clusters) > 0:
+        ids = [np.asarray(clust['ids'], dtype=np.int64).ravel() for clust in user_clusters]
+        lengths = [item.size for item in ids]
+        labels[np.concatenate(ids)] = np.repeat(np.arange(1, len(ids) + 1, dtype=dtype),
+                                                lengths)
+    return labels
+
+
 def rmap_2_onehot_cluster(emb):
     n_rois = emb['embedding'].shape[0]
     n_clusters = len(emb['user_clusters'])
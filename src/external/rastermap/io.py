@@ -2,6 +2,9 @@
 from pathlib import Path
 import numpy as np
 from ..suite2p.iscells import get_iscell_suffix
+from ..suite2p.preprocess import neuropil_correct, zscore_rows
+
+COMPUTED_DATA_VARS = ('F', 'Fc', 'F_zscore', 'Fc_zscore')
 
 
 def move_fluorescence_with_iscell(stat_file, F_filename, iscell_filename):
@@ -49,6 +52,104 @@ def move_fluorescence_with_iscell(stat_file, F_filename, iscell_filename):
     return rmap_iscell_dir.joinpath(F_new_filename)
 
 
+def _check_data_var(sources, data_var):
+    if data_var not in sources and data_var not in COMPUTED_DATA_VARS:
+        raise ValueError(f"Unknown data_var `{data_var}`: no {data_var}.npy file, and not one "
+                         f"of {COMPUTED_DATA_VARS}.")
+
+
+def _load_fluorescence_chunk(sources, data_var, rows, neucoeff):
+    """Computes `data_var` for a chunk of rows from memory-mapped suite2p outputs."""
+    _check_data_var(sources, data_var)
+    if data_var in sources:
+        return np.asarray(sources[data_var][rows], dtype=np.float64)
+
+    F = sources['F'][rows]
+    if data_var.startswith('Fc'):
+        F = neuropil_correct(F, sources['Fneu'][rows], neucoeff=neucoeff, dtype=np.float64)
+
+    if data_var.endswith('_zscore'):
+        F = zscore_rows(F, dtype=np.float64)
+    return F
+
+
+def stream_fluorescence_for_rastermap(stat_file, iscell_filenames, data_var='Fc_zscore',
+                                      neucoeff=0.7, chunk_size=1024, dtype=np.float32):
+    """Writes cropped fluorescence files for several iscell variants in a single pass.
+
+    Source arrays are memory-mapped and processed in chunks of rows, so peak memory is about
+    one chunk. If `{data_var}.npy` exists next to `stat_file` it is copied; otherwise
+    'Fc', 'F_zscore' and 'Fc_zscore' are computed on the fly from 'F.npy' and 'Fneu.npy'.
+
+    Outputs have the same layout as `move_fluorescence_with_iscell`, i.e. for each variant:
+
+        rmap/iscell_{{suffix}}/iscell_{{suffix}}.npy
+        rmap/iscell_{{suffix}}/{{data_var}}_{{suffix}}.npy
+
+    Args:
+        stat_file (Path): Path to 'stat.npy' file (suite2p output file)
+        iscell_filenames (List[str]): iscell files in the same directory as `stat_file`
+        data_var (str): 'F', 'Fc', 'F_zscore', 'Fc_zscore', or the stem of any
+          (cells, time) .npy file next to `stat_file`
+        neucoeff (float): neuropil coefficient, Fc = F - neucoeff * Fneu
+        chunk_size (int): # of rows (ROIs) per chunk
+        dtype (np.dtype): output dtype
+
+    Returns:
+        (Dict[str, Path]): output fluorescence file for each iscell filename
+
+    Examples:
+        >>> stream_fluorescence_for_rastermap(stat_file, ['iscell_a.npy', 'iscell_b.npy'])
+    """
+    sources = {}
+    for name in (data_var, 'F', 'Fneu'):
+        file = stat_file.with_name(f"{name}.npy")
+        if file.is_file():
+            sources[name] = np.load(file, mmap_mode='r')
+    _check_data_var(sources, data_var)
+    n_rois, T = sources[data_var if data_var in sources else 'F'].shape
+
+    rmap_dir = stat_file.with_name('rmap')
+    masks, outputs, out_files = {}, {}, {}
+
+    for iscell_filename in iscell_filenames:
+        iscell = np.load(stat_file.with_name(iscell_filename))
+        iscell_stem = Path(iscell_filename).stem
+        suffix = get_iscell_suffix(iscell_filename)
+
+        rmap_iscell_dir = rmap_dir.joinpath(iscell_stem)
+        rmap_iscell_dir.mkdir(parents=True, exist_ok=True)
+        np.save(rmap_iscell_dir.joinpath(iscell_filename), iscell)
+
+        masks[iscell_filename] = iscell[:, 0] == 1
+        out_files[iscell_filename] = rmap_iscell_dir.joinpath(f"{data_var}_{suffix}.npy")
+        outputs[iscell_filename] = np.lib.format.open_memmap(
+                out_files[iscell_filename], mode='w+', dtype=dtype,
+                shape=(int(masks[iscell_filename].sum()), T))
+
+    any_good = np.logical_or.reduce(list(masks.values()))
+    positions = dict.fromkeys(masks, 0)
+
+    for start in range(0, n_rois, chunk_size):
+        stop = min(start + chunk_size, n_rois)
+        rows = np.flatnonzero(any_good[start:stop]) + start
+        if rows.size == 0:
+            continue
+        chunk = _load_fluorescence_chunk(sources, data_var, rows, neucoeff)
+
+        for iscell_filename, mask in masks.items():
+            keep = mask[rows]
+            n_keep = int(keep.sum())
+            pos = positions[iscell_filename]
+            outputs[iscell_filename][pos:pos + n_keep] = chunk[keep]
+            positions[iscell_filename] = pos + n_keep
+
+    for out in outputs.values():
+        out.flush()
+
+    return out_files
+
+
 def load_fluoresence_and_iscell(stat_file, fluorescence_filename, iscell_filename):
     """Load fluorescence and
 
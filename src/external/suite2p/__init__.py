@@ -1,3 +1,3 @@
-from . import convert
-from . import helpers
-from . import iscells
+from ryeutils.lazy import lazy_submodules
+
+__getattr__, __dir__, __all__ = lazy_submodules(__name__, ['convert', 'helpers', 'iscells', 'preprocess', 'synthetic'])
@@ -1,25 +1,40 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 import xarray as xr
-from scipy.stats import zscore
+from ryeutils.profiling import profiled
 from . import helpers
+from . import preprocess
 
 
-def outputs_2_xarray_base(stat_file):
+@profiled
+def outputs_2_xarray_base(stat_file, neucoeff=0.7, dtype=None, chunk_size=4096, out_dir=None):
     """Converts suite2p outputs into an xarray dataset, no extra metadata added.
 
+    `Fc`, `F_zscore` and `Fc_zscore` are computed in chunks of rows by
+    `external.suite2p.preprocess.preprocess_fluorescence` (float64 statistics, values in
+    `dtype`), so no full-size float64 temporaries are created.
+
     Args:
         stat_file (Path): path to stat.npy file in folder holding suite2p outputs.
+        neucoeff (float): neuropil coefficient, Fc = F - neucoeff * Fneu
+        dtype (np.dtype): dtype of computed variables (default: dtype of 'F.npy', float32 for
+          suite2p outputs)
+        chunk_size (int): # of cells per preprocessing chunk
+        out_dir (Path): if provided, F/Fneu/spks are memory-mapped and the computed variables
+          are written to `{out_dir}/{Fc,F_zscore,Fc_zscore}.npy` memmaps, so the dataset is
+          backed by files on disk
     Returns:
         (xr.Dataset): ds_suite2p_outputs
     """
+    mmap_mode = 'r' if out_dir is not None else None
+    F = np.load(stat_file.with_name('F.npy'), mmap_mode=mmap_mode)
+    Fneu = np.load(stat_file.with_name('Fneu.npy'), mmap_mode=mmap_mode)
+    spks = np.load(stat_file.with_name('spks.npy'), mmap_mode=mmap_mode)
 
-    F = np.load(stat_file.with_name('F.npy'), allow_pickle=True)
-    Fneu = np.load(stat_file.with_name('Fneu.npy'), allow_pickle=True)
-    spks = np.load(stat_file.with_name('spks.npy'), allow_pickle=True)
-
-    Fc = F - 0.7 * Fneu
-    n_cells, T = Fc.shape
+    if dtype is None:
+        dtype = F.dtype
+    n_cells, T = F.shape
 
     # if iscell_filename is None:
     #     iscell_filename = 'iscell.npy'
@@ -28,12 +43,12 @@ def outputs_2_xarray_base(stat_file):
     # iscell = iscell.astype('int').squeeze()
     cellprob = cellprob.squeeze()
 
-    stat = np.load(stat_file, allow_pickle=True)
-    ops = np.load(stat_file.with_name('ops.npy'), allow_pickle=True).item()
-
-    # zscore F, Fc
-    F_zscore = zscore(F, axis=1)
-    Fc_zscore = zscore(Fc, axis=1)
+    # neuropil correction, zscore F, Fc
+    derived = preprocess.preprocess_fluorescence(F, Fneu, neucoeff=neucoeff, dtype=dtype,
+                                                 chunk_size=chunk_size, out_dir=out_dir)
+    Fc = derived['Fc']
+    F_zscore = derived['F_zscore']
+    Fc_zscore = derived['Fc_zscore']
 
     data_vars = {'Fc': (["cells", "time"], Fc),
                  'F': (["cells", "time"], F),
@@ -51,5 +66,53 @@ def outputs_2_xarray_base(stat_file):
                     cellprob=('cells', cellprob)
                     )
             )
+    ds_suite2p_outputs.attrs['suite2p.neucoeff'] = neucoeff
 
     return ds_suite2p_outputs
+
+
+def outputs_2_xarray_multiplane(stat_file, planes=None, max_workers=None):
+    """Loads all non-flyback planes of a 3D recording into one (cells, time) dataset.
+
+    Planes are loaded in parallel with `outputs_2_xarray_base` (file reads and z-scoring
+    release the GIL), so loading a volume costs about as much as the slowest plane.
+
+    Args:
+        stat_file (Path): path to '.../suite2p/combined/stat.npy' (or any stat.npy file in the
+          suite2p folder); the combined 'ops.npy' (or plane0's) determines the flyback planes
+        planes (List[int]): planes to load (default: all planes not in 'ignore_flyback')
+        max_workers (int): # of threads (default: one per plane)
+
+    Returns:
+        (xr.Dataset): ds_suite2p_outputs, w/ coords `plane` and `plane_cell` (index of the cell
+          within its plane) along `cells`. If planes have different # of frames, all are
+          cropped to the shortest.
+    """
+    stat_file = Path(stat_file)
+    suite2p_folder = helpers.get_suite2p_folder(stat_file)
+
+    if planes is None:
+        ops_file = stat_file.with_name('ops.npy')
+        if not ops_file.is_file():
+            ops_file = suite2p_folder.joinpath('plane0', 'ops.npy')
+        planes = helpers.get_good_planes(helpers.load_ops(ops_file))
+    planes = list(planes)
+    if not planes:
+        raise ValueError(f"No planes to load in {suite2p_folder} (all planes are flyback "
+                         f"planes, or `planes` is empty).")
+
+    plane_stat_files = [suite2p_folder.joinpath(f"plane{plane}", 'stat.npy') for plane in planes]
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers or len(planes))) as executor:
+        plane_datasets = list(executor.map(outputs_2_xarray_base, plane_stat_files))
+
+    T = min(ds.sizes['time'] for ds in plane_datasets)
+    plane_datasets = [
+        ds.isel(time=slice(0, T))
+        .assign_coords(plane=('cells', np.full(ds.sizes['cells'], plane)),
+                       plane_cell=('cells', ds['cells'].to_numpy()))
+        for plane, ds in zip(planes, plane_datasets)
+        ]
+    ds_multiplane = xr.concat(plane_datasets, dim='cells')
+
+    return ds_multiplane.assign_coords(cells=range(ds_multiplane.sizes['cells']))
@@ -1,13 +1,36 @@
 """Given the filepath to suite2/.../stat.npy, timestamps, and stimuli, load in the registered
 movie, and save the relevant stimulus-aligned movies.
 """
+from functools import lru_cache
 from pathlib import Path
 import re
 import numpy as np
-import tifffile
 from typing import Union, List, Any, Dict
 import xarray as xr
-from scipy.ndimage import percentile_filter
+
+
+@lru_cache(maxsize=256)
+def _load_ops_cached(ops_file, st_mtime_ns):
+    return np.load(ops_file, allow_pickle=True).item()
+
+
+def load_ops(ops_file):
+    """Loads a suite2p 'ops.npy' file, cached per file (reloaded if the file is modified).
+
+    Args:
+        ops_file (Union[str, Path]): path to 'ops.npy'
+
+    Returns:
+        (dict): shallow copy of the cached ops dictionary
+    """
+    ops_file = Path(ops_file)
+    return dict(_load_ops_cached(ops_file, ops_file.stat().st_mtime_ns))
+
+
+def get_good_planes(ops):
+    """Returns plane indices that are not in `ops['ignore_flyback']`."""
+    ignore_flyback = ops.get('ignore_flyback', [])
+    return [plane for plane in range(ops['nplanes']) if plane not in ignore_flyback]
 
 
 def get_suite2p_folder(file):
@@ -81,6 +104,8 @@ def load_single_plane_reg_tiffs_as_array(reg_dir, channel=0):
     tiff_files = sorted(list(reg_dir.joinpath('reg_tif').glob(f"file*_chan{channel}.tif")),
                         key=lambda x: get_reg_tiff_index(x))
 
+    import tifffile
+
     stacks = []
     for file in tiff_files:
         with tifffile.TiffFile(file) as tif:
@@ -132,11 +157,8 @@ def load_single_plane_reg_tiffs(stat_file, channel=0, expand_z_dim=True):
 def load_combined_reg_tiffs(stat_file, channel=0):
     """Load 3d registered movie as xarray, with only good planes (not in 'ignore_flyback')
     included."""
-    ops = np.load(stat_file.with_name('ops.npy'), allow_pickle=True).item()
-
-    nplanes = ops['nplanes']
-    ignore_flyback = ops['ignore_flyback']
-    good_planes = [plane for plane in range(nplanes) if plane not in ignore_flyback]
+    ops = load_ops(stat_file.with_name('ops.npy'))
+    good_planes = get_good_planes(ops)
 
     time, Lz, Ly, Lx = get_dims(stat_file, without_flyback_planes=True)
 
@@ -215,6 +237,8 @@ def create_cell_pix(stats: List[Dict[str, Any]], Ly: int, Lx: int,
     disable with lam_percentile=0.0
 
     """
+    from scipy import ndimage
+
     cell_pix = np.zeros((Ly, Lx))
     lammap = np.zeros((Ly, Lx))
     radii = np.zeros(len(stats))
@@ -226,7 +250,7 @@ def create_cell_pix(stats: List[Dict[str, Any]], Ly: int, Lx: int,
         lammap[ypix, xpix] = np.maximum(lammap[ypix, xpix], lam)
     radius = np.median(radii)
     if lam_percentile > 0.0:
-        filt = percentile_filter(lammap, percentile=lam_percentile, size=int(radius * 5))
+        filt = ndimage.percentile_filter(lammap, percentile=lam_percentile, size=int(radius * 5))
         cell_pix = ~np.logical_or(lammap < filt, lammap == 0)
     else:
         cell_pix = lammap > 0.0
@@ -266,9 +290,8 @@ def get_dims(stat_file, without_flyback_planes=True):
     """
 
     if is_3d(stat_file):
-        ops_3d = np.load(stat_file.with_name('ops.npy'), allow_pickle=True).item()
-        ops_2d = np.load(stat_file.parent.with_name('plane0').joinpath('ops.npy'),
-                         allow_pickle=True).item()
+        ops_3d = load_ops(stat_file.with_name('ops.npy'))
+        ops_2d = load_ops(stat_file.parent.with_name('plane0').joinpath('ops.npy'))
         Ly = ops_2d['Ly']
         Lx = ops_2d['Lx']
 
@@ -276,8 +299,7 @@ def get_dims(stat_file, without_flyback_planes=True):
 
         # Z dimension
         nplanes = ops_3d['nplanes']
-        ignore_flyback = ops_3d['ignore_flyback']
-        good_planes = [plane for plane in range(nplanes) if plane not in ignore_flyback]
+        good_planes = get_good_planes(ops_3d)
 
         if without_flyback_planes:
             Lz = len(good_planes)
@@ -287,7 +309,7 @@ def get_dims(stat_file, without_flyback_planes=True):
         dims = (nframes, Lz, Ly, Lx)
 
     else:
-        ops_2d = np.load(stat_file.with_name('ops.npy'), allow_pickle=True).item()
+        ops_2d = load_ops(stat_file.with_name('ops.npy'))
         Ly = ops_2d['Ly']
         Lx = ops_2d['Lx']
         nframes = ops_2d['nframes']
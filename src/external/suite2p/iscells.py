@@ -1,5 +1,7 @@
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
+import pandas as pd
 from datetime import datetime
 import re
 from attrs import define, field
@@ -23,10 +25,9 @@ class IsCell:
     st_mtime: datetime = field(init=False)
 
     def __attrs_post_init__(self):
-        roi_stats = get_iscell_roistats(self.iscell_file)
         self.iscell = np.load(self.iscell_file)
-        self.n_total_rois = roi_stats['n_total_rois']
-        self.n_iscell_rois = roi_stats['n_iscell_rois']
+        self.n_total_rois = self.iscell.shape[0]
+        self.n_iscell_rois = int(self.iscell[:, 0].sum())
         self.fraction_iscell = self.n_iscell_rois / self.n_total_rois
 
         file_stats = get_iscell_filestats(self.iscell_file)
@@ -63,11 +64,29 @@ def get_iscell_roistats(iscell_file: Path) -> dict:
         dict: has keys 'n_total_rois' and 'n_iscell_rois'
     """
 
-    iscell = np.load(iscell_file)
+    iscell = np.load(iscell_file, mmap_mode='r')
     return {'n_total_rois': iscell.shape[0],
             'n_iscell_rois': int(iscell[:, 0].sum())}
 
 
+def read_npy_header(npy_file: Path) -> dict:
+    """Reads the shape and dtype of a .npy file from its header, without loading the data.
+
+    Args:
+        npy_file (Path): path to .npy file
+
+    Returns:
+        dict: has keys 'shape', 'dtype' and 'fortran_order'
+    """
+    with open(npy_file, 'rb') as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+    return {'shape': shape, 'dtype': dtype, 'fortran_order': fortran_order}
+
+
 def get_iscell_stats(iscell_file: Path) -> dict:
     return {**get_iscell_filestats(iscell_file), **get_iscell_roistats(iscell_file)}
 
@@ -75,7 +94,8 @@ def get_iscell_stats(iscell_file: Path) -> dict:
 def get_iscell_suffix(iscell_filename: str) -> str:
     """Given an iscell*.npy file, get the suffix of the filename.
 
-    If iscell_filename is 'iscell.npy', suffix=None
+    If iscell_filename is 'iscell.npy', or doesn't match 'iscell_{{suffix}}.npy' (e.g.
+    'iscell-old.npy'), suffix=None
 
     Args:
         iscell_filename (str): filename of 'iscell_{{suffix}}.npy' or 'iscell.npy' file
@@ -84,16 +104,16 @@ def get_iscell_suffix(iscell_filename: str) -> str:
         suffix (string): sufffix from `iscell_filename`, where suffix is 'iscell_{{suffix}}.npy'
     """
 
-    pattern = 'iscell_(?P<suffix>.+).npy'
     if iscell_filename == 'iscell.npy' or iscell_filename == 'iscell':
         suffix = None
     else:
         if iscell_filename.endswith('.npy'):
-            pattern = 'iscell_(?P<suffix>.+).npy'
+            pattern = r'iscell_(?P<suffix>.+)\.npy$'
         else:
-            pattern = 'iscell_(?P<suffix>.+)'
+            pattern = r'iscell_(?P<suffix>.+)$'
 
-        suffix = re.search(pattern, iscell_filename).groupdict()['suffix']
+        match = re.search(pattern, iscell_filename)
+        suffix = match.group('suffix') if match is not None else None
 
     return suffix
 
@@ -124,3 +144,53 @@ def all_iscell_stats_from_stat_file(stat_file: Path, astype='list'):
         raise ValueError(astype)
 
     return fstats
+
+
+def _iscell_inventory_row(iscell_file: Path) -> dict:
+    header = read_npy_header(iscell_file)
+    n_total_rois = header['shape'][0]
+
+    # sum column 0 only, from a memory-mapped array
+    iscell = np.load(iscell_file, mmap_mode='r')
+    n_iscell_rois = int(iscell[:, 0].sum()) if n_total_rois > 0 else 0
+
+    return {'suite2p_dir': str(iscell_file.parent),
+            'iscell_filename': iscell_file.name,
+            'suffix': get_iscell_suffix(iscell_file.name),
+            'n_total_rois': n_total_rois,
+            'n_iscell_rois': n_iscell_rois,
+            'fraction_iscell': n_iscell_rois / n_total_rois if n_total_rois > 0 else np.nan,
+            **get_iscell_filestats(iscell_file)}
+
+
+def iscell_inventory(root_dir: Path, include_rmap=False, max_workers=16) -> pd.DataFrame:
+    """Curation status of all 'iscell*.npy' files under `root_dir`, as a single DataFrame.
+
+    ROI counts come from the .npy header and a memory-mapped read of column 0, and files are
+    processed in a thread pool, so auditing thousands of planes only touches a few bytes per
+    ROI.
+
+    Args:
+        root_dir (Path): project directory to search recursively
+        include_rmap (bool): whether to include iscell copies inside `rmap/` folders
+        max_workers (int): # of threads
+
+    Returns:
+        df_inventory (pd.DataFrame): one row per iscell file, w/ columns 'suite2p_dir',
+          'iscell_filename', 'suffix', 'n_total_rois', 'n_iscell_rois', 'fraction_iscell',
+          'st_ctime', 'st_mtime'
+
+    Examples:
+        >>> df_inventory = iscell_inventory(Path("/local/matrix/Remy-Data/projects/"
+        ...                                      "odor_space_collab/processed_data"))
+    """
+    iscell_files = sorted(Path(root_dir).rglob('iscell*.npy'))
+    if not include_rmap:
+        iscell_files = [f for f in iscell_files if 'rmap' not in f.parts]
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        rows = list(executor.map(_iscell_inventory_row, iscell_files))
+
+    return pd.DataFrame(rows, columns=['suite2p_dir', 'iscell_filename', 'suffix',
+                                       'n_total_rois', 'n_iscell_rois', 'fraction_iscell',
+                                       'st_ctime', 'st_mtime'])
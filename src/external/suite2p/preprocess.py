@@ -0,0 +1,87 @@
+"""Streaming neuropil correction and z-scoring of suite2p fluorescence traces.
+
+Traces are processed in chunks of rows (ROIs): values are computed in the output dtype
+(float32 by default), while the per-row mean and standard deviation are accumulated in
+float64. Outputs can be written directly into preallocated `.npy` memmaps.
+"""
+
+from pathlib import Path
+import numpy as np
+
+DERIVED_VARS = ('Fc', 'F_zscore', 'Fc_zscore')
+
+
+def neuropil_correct(F, Fneu, neucoeff=0.7, dtype=np.float32):
+    """Fc = F - neucoeff * Fneu, computed in `dtype`."""
+    Fc = np.array(F, dtype=dtype, copy=True)
+    Fc -= np.dtype(dtype).type(neucoeff) * np.asarray(Fneu, dtype=dtype)
+    return Fc
+
+
+def zscore_rows(X, dtype=np.float32, ddof=0):
+    """Z-scores each row of `X`, w/ float64 mean/std and output in `dtype`.
+
+    Same as `scipy.stats.zscore(X, axis=1, ddof=ddof)`, w/o the float64 temporaries.
+    """
+    mean = X.mean(axis=1, keepdims=True, dtype=np.float64)
+    std = X.std(axis=1, keepdims=True, dtype=np.float64, ddof=ddof)
+    Z = np.array(X, dtype=dtype, copy=True)
+    Z -= mean.astype(dtype)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        Z /= std.astype(dtype)
+    return Z
+
+
+def preprocess_fluorescence(F, Fneu, neucoeff=0.7, data_vars=DERIVED_VARS, dtype=np.float32,
+                            chunk_size=1024, out_dir=None):
+    """Computes neuropil-corrected and z-scored traces in chunks of rows.
+
+    Args:
+        F (np.ndarray): (cells, time) fluorescence, can be memory-mapped
+        Fneu (np.ndarray): (cells, time) neuropil fluorescence, can be memory-mapped
+        neucoeff (float): neuropil coefficient, Fc = F - neucoeff * Fneu
+        data_vars (Sequence[str]): any of 'Fc', 'F_zscore', 'Fc_zscore'
+        dtype (np.dtype): output dtype (default float32)
+        chunk_size (int): # of rows per chunk
+        out_dir (Union[str, Path]): if provided, outputs are written to preallocated
+          `{out_dir}/{data_var}.npy` memmaps (and returned as memmaps)
+
+    Returns:
+        (Dict[str, np.ndarray]): output arrays, keyed by data variable name
+
+    Examples:
+        >>> F = np.load(stat_file.with_name('F.npy'), mmap_mode='r')
+        >>> Fneu = np.load(stat_file.with_name('Fneu.npy'), mmap_mode='r')
+        >>> outputs = preprocess_fluorescence(F, Fneu, out_dir=stat_file.parent)
+    """
+    invalid = set(data_vars) - set(DERIVED_VARS)
+    if invalid:
+        raise ValueError(f"Invalid data_vars: {invalid}")
+
+    n_cells, T = F.shape
+    outputs = {}
+    for name in data_vars:
+        if out_dir is not None:
+            outputs[name] = np.lib.format.open_memmap(Path(out_dir).joinpath(f"{name}.npy"),
+                                                      mode='w+', dtype=dtype,
+                                                      shape=(n_cells, T))
+        else:
+            outputs[name] = np.empty((n_cells, T), dtype=dtype)
+
+    for start in range(0, n_cells, chunk_size):
+        rows = slice(start, min(start + chunk_size, n_cells))
+
+        if 'Fc' in outputs or 'Fc_zscore' in outputs:
+            Fc = neuropil_correct(F[rows], Fneu[rows], neucoeff=neucoeff, dtype=dtype)
+            if 'Fc' in outputs:
+                outputs['Fc'][rows] = Fc
+            if 'Fc_zscore' in outputs:
+                outputs['Fc_zscore'][rows] = zscore_rows(Fc, dtype=dtype)
+        if 'F_zscore' in outputs:
+            outputs['F_zscore'][rows] = zscore_rows(F[rows], dtype=dtype)
+
+    for arr in outputs.values():
+        if isinstance(arr, np.memmap):
+            arr.flush()
+
+    return outputs
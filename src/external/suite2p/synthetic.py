@@ -0,0 +1,166 @@
+"""Synthetic suite2p-like outputs, for benchmarks and testing w/o real data.
+
+Writes the folder layout expected by `expt.acquisition.Acquisition` and
+`external.suite2p.convert`::
+
+    {out_dir}/timestamps.npy                   # {'stack_times', 'olf_ict'}
+    {out_dir}/stim_list.json                   # {'stim_list_flatstr': [...]}
+    {out_dir}/suite2p/plane{k}/stat.npy
+    {out_dir}/suite2p/plane{k}/{F,Fneu,spks,iscell,ops}.npy
+
+Each cell has a random, sparse tuning to stimuli; fluorescence is baseline + tuned
+exponential transients at stimulus onsets + noise, and neuropil is a shared slow trace
+mixed into F.
+"""
+
+import json
+from pathlib import Path
+import numpy as np
+from attrs import define, field
+
+
+@define(kw_only=True)
+class SyntheticSuite2p:
+    """Paths and parameters of a generated synthetic dataset.
+
+    Args:
+        out_dir (Path): movie folder (holds timestamps.npy and stim_list.json)
+        stat_files (List[Path]): 'stat.npy' of each plane
+        n_cells (int): # of cells per plane
+        n_frames (int): # of frames
+        stim_list (List[str]): stimulus of each trial
+    """
+    out_dir: Path = field(converter=Path)
+    stat_files: list
+    n_cells: int
+    n_frames: int
+    stim_list: list = field(repr=False)
+
+    @property
+    def stat_file(self):
+        """'stat.npy' of plane 0."""
+        return self.stat_files[0]
+
+    @property
+    def timestamps_file(self):
+        return self.out_dir.joinpath('timestamps.npy')
+
+    def load_timestamps(self):
+        return np.load(self.timestamps_file, allow_pickle=True).item()
+
+
+def default_stim_list(n_trials, n_stim=17):
+    """Blocked, repeated stimulus list like 'odor{i} @ -3.0' (megamat-style panels)."""
+    n_reps = -(-n_trials // n_stim)
+    stim_ord = [f"odor{i:02d} @ -3.0" for i in range(n_stim)]
+    return (stim_ord * n_reps)[:n_trials]
+
+
+def _make_stat(n_cells, Ly, Lx, plane, rng):
+    """Minimal stat entries (square ROIs at random positions)."""
+    med = np.column_stack([rng.integers(2, Ly - 2, n_cells), rng.integers(2, Lx - 2, n_cells)])
+    dy, dx = np.meshgrid(np.arange(-2, 3), np.arange(-2, 3), indexing='ij')
+    stat = np.empty(n_cells, dtype=object)
+    for i, (y, x) in enumerate(med):
+        stat[i] = dict(ypix=(y + dy).ravel(), xpix=(x + dx).ravel(),
+                       lam=np.ones(dy.size, dtype=np.float32), med=[int(y), int(x)],
+                       npix=dy.size, iplane=plane)
+    return stat
+
+
+def _make_fluorescence(n_cells, stack_times, stim_codes, olf_ict, n_stim, tau, rng,
+                       response_prob=0.2, noise_sd=0.3, dtype=np.float32):
+    """(cells, time) F, Fneu and spks traces."""
+    n_frames = stack_times.size
+    tuning = rng.gamma(2.0, 0.5, size=(n_cells, n_stim)) * \
+        (rng.random((n_cells, n_stim)) < response_prob)
+
+    # stimulus drive (n_stim, time): one exponential transient per trial
+    drive = np.zeros((n_stim, n_frames), dtype=dtype)
+    for code, ict in zip(stim_codes, olf_ict):
+        after = stack_times >= ict
+        drive[code, after] += np.exp(-(stack_times[after] - ict) / tau).astype(dtype)
+
+    neuropil = np.cumsum(rng.normal(0, 0.02, n_frames)).astype(dtype)
+    baseline = rng.uniform(50, 150, size=(n_cells, 1)).astype(dtype)
+
+    signal = (tuning.astype(dtype) @ drive) * baseline
+    Fneu = baseline * (0.5 + 0.1 * neuropil) + rng.normal(0, noise_sd, (n_cells, n_frames))
+    F = signal + 0.7 * Fneu + baseline * 0.2 + \
+        rng.normal(0, noise_sd, (n_cells, n_frames)) * np.sqrt(baseline)
+    spks = np.clip(np.diff(signal, axis=1, prepend=0), 0, None)
+    return F.astype(dtype), Fneu.astype(dtype), spks.astype(dtype)
+
+
+def make_synthetic_suite2p(out_dir, n_cells=500, n_frames=6000, n_planes=1, n_trials=51,
+                           n_stim=17, stim_list=None, fs=20.0, iscell_frac=0.8, tau=1.0,
+                           Ly=256, Lx=256, seed=0):
+    """Generates a synthetic suite2p acquisition (see module docstring for the layout).
+
+    Stimulus onsets are evenly spaced, leaving 5 s before the first and 20 s after the
+    last trial (the default `trial_ts` window of `xrsa.trials.timeseries_2_trials`).
+
+    Args:
+        out_dir (Union[str, Path]): movie folder to write to
+        n_cells (int): # of ROIs per plane
+        n_frames (int): # of frames
+        n_planes (int): # of planes (suite2p/plane{k} folders)
+        n_trials (int): # of stimulus presentations
+        n_stim (int): # of distinct stimuli (ignored if `stim_list` is provided)
+        stim_list (List[str]): stimulus of each trial (default: `default_stim_list`)
+        fs (float): volume rate (Hz)
+        iscell_frac (float): fraction of ROIs w/ iscell=1
+        tau (float): decay time constant of responses (s)
+        Ly (int): field of view height (pixels)
+        Lx (int): field of view width (pixels)
+        seed (int): random seed
+
+    Returns:
+        SyntheticSuite2p
+
+    Examples:
+        >>> syn = make_synthetic_suite2p(tmp_dir, n_cells=2000, n_frames=10000)
+        >>> ds = external.suite2p.convert.outputs_2_xarray_base(syn.stat_file)
+    """
+    out_dir = Path(out_dir)
+    rng = np.random.default_rng(seed)
+
+    if stim_list is None:
+        stim_list = default_stim_list(n_trials, n_stim=n_stim)
+    stim_ord, stim_codes = np.unique(stim_list, return_inverse=True)
+
+    stack_times = np.arange(n_frames) / fs
+    olf_ict = np.linspace(5, stack_times[-1] - 20, len(stim_list))
+    if olf_ict[0] >= olf_ict[-1] and len(stim_list) > 1:
+        raise ValueError(f"{n_frames} frames at {fs} Hz are too short for "
+                         f"{len(stim_list)} trials.")
+
+    out_dir.mkdir(parents=True, exist_ok=True)
+    np.save(out_dir.joinpath('timestamps.npy'),
+            dict(stack_times=stack_times, olf_ict=olf_ict), allow_pickle=True)
+    with open(out_dir.joinpath('stim_list.json'), 'w') as f:
+        json.dump(dict(stim_list_flatstr=list(stim_list)), f)
+
+    stat_files = []
+    for plane in range(n_planes):
+        plane_dir = out_dir.joinpath('suite2p', f"plane{plane}")
+        plane_dir.mkdir(parents=True, exist_ok=True)
+
+        F, Fneu, spks = _make_fluorescence(n_cells, stack_times, stim_codes, olf_ict,
+                                           stim_ord.size, tau, rng)
+        cellprob = rng.random(n_cells)
+        iscell = np.column_stack([cellprob < iscell_frac, cellprob]).astype(np.float64)
+        ops = dict(nplanes=n_planes, ignore_flyback=[], fs=fs, nframes=n_frames, Ly=Ly,
+                   Lx=Lx, save_path=str(plane_dir))
+
+        np.save(plane_dir.joinpath('stat.npy'), _make_stat(n_cells, Ly, Lx, plane, rng),
+                allow_pickle=True)
+        np.save(plane_dir.joinpath('F.npy'), F)
+        np.save(plane_dir.joinpath('Fneu.npy'), Fneu)
+        np.save(plane_dir.joinpath('spks.npy'), spks)
+        np.save(plane_dir.joinpath('iscell.npy'), iscell)
+        np.save(plane_dir.joinpath('ops.npy'), ops, allow_pickle=True)
+        stat_files.append(plane_dir.joinpath('stat.npy'))
+
+    return SyntheticSuite2p(out_dir=out_dir, stat_files=stat_files, n_cells=n_cells,
+                            n_frames=n_frames, stim_list=list(stim_list))
@@ -4,11 +4,8 @@ from typing import List, Union
 import numpy as np
 import pandas as pd
 import xarray as xr
-from sklearn import preprocessing
 import ryeutils
 import xrsa
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_pdf import PdfPages
 
 
 def df_ori_2_dataarray(df_ori):
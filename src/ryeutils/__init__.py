@@ -1,3 +1,6 @@
 # __all__ = [ "main"]
 #
 from .main import occurrence, np_pearson_corr, find_runs, index_stimuli
+from .corr import pearson_corr, standardize_rows, resolve_dtype
+from .lazy import lazy_submodules
+from . import profiling
@@ -0,0 +1,182 @@
+"""Batched, NaN-aware Pearson correlation kernel.
+
+Shared backend for RDMs (trials x cells), cell-cell correlation maps (cells x time) and RDM
+comparisons. All functions correlate **rows** over the last (feature) axis, and broadcast over
+any leading batch dimensions, so stacked inputs with shape `(..., n, features)` are handled
+by a single call to `np.matmul`.
+"""
+
+import numpy as np
+
+
+def resolve_dtype(*arrays, dtype=None):
+    """Floating point dtype to compute in: `dtype` if given, else float32 if all `arrays` are
+    float32, else float64."""
+    if dtype is not None:
+        return np.dtype(dtype)
+    if all(np.asarray(a).dtype == np.float32 for a in arrays):
+        return np.dtype(np.float32)
+    return np.dtype(np.float64)
+
+
+def _feature_chunks(n_features, chunk_size):
+    """Yields slices along the feature axis, of length `chunk_size` (or all features)."""
+    if chunk_size is None or chunk_size >= n_features:
+        yield slice(0, n_features)
+    else:
+        for start in range(0, n_features, chunk_size):
+            yield slice(start, min(start + chunk_size, n_features))
+
+
+def standardize_rows(x, dtype=None, nan_policy='propagate'):
+    """Centers rows of `x` and scales them to unit norm, so that `z @ z.T` is a correlation.
+
+    Args:
+        x (np.ndarray): array with shape (..., n, features)
+        dtype (np.dtype): output dtype (default float64, or float32 if `x` is float32)
+        nan_policy (str): 'propagate' (rows w/ NaNs become all NaN) or 'omit' (NaNs are
+          ignored when computing row statistics, and set to 0 in the output)
+
+    Returns:
+        z (np.ndarray): standardized rows, same shape as `x`
+    """
+    dtype = resolve_dtype(x, dtype=dtype)
+    z = np.array(x, dtype=dtype, copy=True)
+
+    if nan_policy == 'omit':
+        mean = np.nanmean(z, axis=-1, keepdims=True, dtype=np.float64)
+        z -= mean.astype(dtype)
+        np.nan_to_num(z, copy=False, nan=0.0)
+    elif nan_policy == 'propagate':
+        z -= z.mean(axis=-1, keepdims=True, dtype=np.float64).astype(dtype)
+    else:
+        raise ValueError(f"Invalid nan_policy: {nan_policy}")
+
+    norm = np.sqrt(np.einsum('...ij,...ij->...i', z, z, dtype=np.float64))[..., None]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        z /= norm.astype(dtype)
+    return z
+
+
+def pearson_corr(x, y=None, nan_policy='propagate', dtype=None, chunk_size=None):
+    """Computes correlation between the rows of 2 (stacks of) arrays.
+
+    The value at `(..., i, j)` is the correlation between `x[..., i, :]` and `y[..., j, :]`.
+
+    Args:
+        x (np.ndarray): shape (..., n, features)
+        y (np.ndarray): shape (..., m, features), if None then `y = x`
+        nan_policy (str):
+          - 'propagate': any NaN in a row makes its correlations NaN (fastest)
+          - 'pairwise': pairwise-complete correlations, i.e. for each pair of rows only the
+            features that are finite in both rows are used (computed with masked sums)
+        dtype (np.dtype): computation dtype, use `np.float32` for speed/memory. Defaults to
+          float64, unless both inputs are float32.
+        chunk_size (int): if set, accumulate over the feature axis in chunks of this size,
+          so temporaries are bounded by `(..., n, chunk_size)` for very wide inputs.
+
+    Returns:
+        np.ndarray: correlation matrices, shape (..., n, m), bounded to [-1, 1]
+
+    Examples:
+        RDMs for a (time, trials, cells) stack::
+
+            >>> rdm = 1 - pearson_corr(respvec, dtype=np.float32)
+    """
+    x = np.asarray(x)
+    same = y is None
+    y = x if same else np.asarray(y)
+
+    dtype = resolve_dtype(x, y, dtype=dtype)
+
+    if x.shape[-1] != y.shape[-1]:
+        raise ValueError(f"Feature dims do not match: {x.shape[-1]} != {y.shape[-1]}")
+
+    if nan_policy == 'propagate':
+        result = _pearson_corr_dense(x, y, same, dtype, chunk_size)
+    elif nan_policy == 'pairwise':
+        result = _pearson_corr_pairwise(x, y, same, dtype, chunk_size)
+    else:
+        raise ValueError(f"Invalid nan_policy: {nan_policy}")
+
+    # bound the values to -1 to 1 in the event of precision issues
+    return np.clip(result, -1.0, 1.0, out=result)
+
+
+def _pearson_corr_dense(x, y, same, dtype, chunk_size):
+    """Correlation w/o NaN handling; row means/norms computed first, products accumulated."""
+    x_mean = x.mean(axis=-1, keepdims=True, dtype=np.float64).astype(dtype)
+    y_mean = x_mean if same else y.mean(axis=-1, keepdims=True, dtype=np.float64).astype(dtype)
+
+    out_shape = np.broadcast_shapes(x.shape[:-2], y.shape[:-2]) + (x.shape[-2], y.shape[-2])
+    xy = np.zeros(out_shape, dtype=dtype)
+    xss = np.zeros(x.shape[:-1], dtype=np.float64)
+    yss = xss if same else np.zeros(y.shape[:-1], dtype=np.float64)
+
+    for sl in _feature_chunks(x.shape[-1], chunk_size):
+        xv = x[..., sl].astype(dtype) - x_mean
+        yv = xv if same else y[..., sl].astype(dtype) - y_mean
+        xy += np.matmul(xv, np.swapaxes(yv, -1, -2))
+        xss += np.einsum('...ij,...ij->...i', xv, xv, dtype=np.float64)
+        if not same:
+            yss += np.einsum('...ij,...ij->...i', yv, yv, dtype=np.float64)
+
+    denom = np.sqrt(xss[..., :, None] * yss[..., None, :]).astype(dtype)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xy /= denom
+    return xy
+
+
+def _pearson_corr_pairwise(x, y, same, dtype, chunk_size):
+    """Pairwise-complete correlation from masked sums.
+
+    Rows are shifted by their nan-mean first (correlation is shift-invariant, and this keeps
+    the raw-moment formulas well conditioned), then for each pair of rows (i, j):
+
+        n_ij = sum_k mx[i,k] * my[j,k]
+        cov_ij = sum(x*y) - sum(x) * sum(y) / n_ij      (sums over jointly valid features)
+    """
+    with np.errstate(invalid='ignore'):
+        x_mean = np.nanmean(x, axis=-1, keepdims=True, dtype=np.float64).astype(dtype)
+        y_mean = x_mean if same else \
+            np.nanmean(y, axis=-1, keepdims=True, dtype=np.float64).astype(dtype)
+
+    out_shape = np.broadcast_shapes(x.shape[:-2], y.shape[:-2]) + (x.shape[-2], y.shape[-2])
+    n = np.zeros(out_shape, dtype=dtype)
+    sx = np.zeros(out_shape, dtype=dtype)
+    sy = np.zeros(out_shape, dtype=dtype)
+    sxx = np.zeros(out_shape, dtype=dtype)
+    syy = np.zeros(out_shape, dtype=dtype)
+    sxy = np.zeros(out_shape, dtype=dtype)
+
+    for sl in _feature_chunks(x.shape[-1], chunk_size):
+        xv = x[..., sl].astype(dtype) - x_mean
+        mx = np.isfinite(xv)
+        xv[~mx] = 0
+        mx = mx.astype(dtype)
+
+        if same:
+            yv, my = xv, mx
+        else:
+            yv = y[..., sl].astype(dtype) - y_mean
+            my = np.isfinite(yv)
+            yv[~my] = 0
+            my = my.astype(dtype)
+
+        myt = np.swapaxes(my, -1, -2)
+        yvt = np.swapaxes(yv, -1, -2)
+
+        n += np.matmul(mx, myt)
+        sx += np.matmul(xv, myt)
+        sy += np.matmul(mx, yvt)
+        sxx += np.matmul(xv * xv, myt)
+        syy += np.matmul(mx, np.swapaxes(yv * yv, -1, -2))
+        sxy += np.matmul(xv, yvt)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        cov = sxy - sx * sy / n
+        var_x = sxx - sx * sx / n
+        var_y = syy - sy * sy / n
+        result = cov / np.sqrt(var_x * var_y)
+    result[n < 2] = np.nan
+    return result
@@ -0,0 +1,40 @@
+"""Lazy imports of package submodules, w/ module-level `__getattr__` (PEP 562)."""
+
+import importlib
+import sys
+
+
+def lazy_submodules(package, submodules, exports=None):
+    """Module `__getattr__`, `__dir__` and `__all__` for a package w/ lazily imported submodules.
+
+    Submodules (and names re-exported from them) are imported on first attribute access, and
+    then bound in the package namespace, so `__getattr__` is only called once per name.
+
+    Args:
+        package (str): package name (`__name__` of the calling `__init__.py`)
+        submodules (List[str]): submodule names
+        exports (Dict[str, str]): names re-exported from submodules, {name: submodule}
+
+    Returns:
+        (Tuple[Callable, Callable, List[str]]): `__getattr__`, `__dir__`, `__all__`
+
+    Examples:
+        >>> __getattr__, __dir__, __all__ = lazy_submodules(__name__, ['rdm', 'respvec'])
+    """
+    submodules = list(submodules)
+    exports = {} if exports is None else dict(exports)
+    names = submodules + list(exports)
+
+    def __getattr__(name):
+        if name in submodules:
+            return importlib.import_module(f".{name}", package)
+        if name in exports:
+            value = getattr(importlib.import_module(f".{exports[name]}", package), name)
+            setattr(sys.modules[package], name, value)
+            return value
+        raise AttributeError(f"module {package!r} has no attribute {name!r}")
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[package])) | set(names))
+
+    return __getattr__, __dir__, names
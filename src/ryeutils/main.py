@@ -2,29 +2,32 @@ from collections import Counter
 import numpy as np
 from itertools import groupby
 from typing import Union, List
+from .corr import pearson_corr
 
 
 def np_pearson_corr(x, y):
     """ Computes correlation between the rows/columns of 2 arrays.
 
-    Copied from https://cancerdatascience.org/blog/sposts/pearson-correlation/
+    Originally copied from https://cancerdatascience.org/blog/sposts/pearson-correlation/, now
+    a thin wrapper around `ryeutils.corr.pearson_corr` (which correlates rows, supports
+    batching, float32 and NaNs).
 
     Args:
         x (np.ndarray):
         y (np.ndarray):
 
     Returns:
-        np.ndarray: returns 2d array, where the value at (i, j) = correlation(x[i], y[j])
+        np.ndarray: returns 2d float64 array, where the value at (i, j) =
+          correlation(x[:, i], y[:, j]) (1 x 1 for 1-D inputs)
 
     
     """
-    xv = x - x.mean(axis=0)
-    yv = y - y.mean(axis=0)
-    xvss = (xv * xv).sum(axis=0)
-    yvss = (yv * yv).sum(axis=0)
-    result = np.matmul(xv.transpose(), yv) / np.sqrt(np.outer(xvss, yvss))
-    # bound the values to -1 to 1 in the event of precision issues
-    return np.maximum(np.minimum(result, 1.0), -1.0)
+    # 1-D inputs are treated as a single column
+    x = np.asarray(x)
+    y = np.asarray(y)
+    x = x.reshape(x.shape[0], -1)
+    y = y.reshape(y.shape[0], -1)
+    return pearson_corr(x.T, y.T, dtype=np.float64)
 
 
 def occurrence(x):
@@ -0,0 +1,162 @@
+"""Opt-in timing and memory instrumentation of pipeline stages.
+
+Profiling is off by default: decorated functions are called directly, w/ no overhead beyond
+one flag check. When enabled (w/ `enable_profiling`, or by setting the environment variable
+`RYEUTILS_PROFILE_LOG` to a .jsonl file path), each profiled stage records
+
+  - wall time and CPU time (s)
+  - peak resident set size of the process, and its increase during the stage (MB)
+  - bytes of the returned array/dataset (MB)
+
+Records are appended as one JSON line per stage to the log file (if set), and summaries are
+written to the attrs of returned xarray objects as `profile.{stage}.{field}`. Summaries of
+upstream stages, carried over from inputs (e.g. w/ `keep_attrs=True`), are kept, so the attrs
+of a final output summarize every stage that produced it.
+
+Examples:
+    >>> ryeutils.profiling.enable_profiling(log_file='profile.jsonl')
+    >>> with ryeutils.profiling.profiling_context(acq='2022-10-26/2/megamat1'):
+    ...     ds_trials = xrsa.trials.timeseries_2_trials(...)
+    >>> ds_trials.attrs['profile.timeseries_2_trials.wall_s']
+"""
+
+import functools
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+
+try:
+    import resource
+except ImportError:     # not available on Windows
+    resource = None
+
+_STATE = dict(enabled='RYEUTILS_PROFILE_LOG' in os.environ,
+              log_file=os.environ.get('RYEUTILS_PROFILE_LOG'),
+              tags={})
+
+PROFILE_FIELDS = ('wall_s', 'cpu_s', 'peak_rss_mb', 'rss_increase_mb', 'result_mb')
+
+
+def enable_profiling(log_file=None):
+    """Turns on profiling; records are appended to `log_file` (.jsonl) if provided."""
+    _STATE['enabled'] = True
+    _STATE['log_file'] = None if log_file is None else str(log_file)
+
+
+def disable_profiling():
+    _STATE['enabled'] = False
+
+
+def is_profiling_enabled():
+    return _STATE['enabled']
+
+
+@contextmanager
+def profiling_context(**tags):
+    """Adds tags (e.g. `acq=...`) to all records made inside the context."""
+    old_tags = _STATE['tags']
+    _STATE['tags'] = {**old_tags, **tags}
+    try:
+        yield
+    finally:
+        _STATE['tags'] = old_tags
+
+
+def peak_rss_mb():
+    """Peak resident set size of the current process (MB), None if unavailable."""
+    if resource is None:
+        return None
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS, kilobytes on Linux
+    return maxrss / 2 ** 20 if sys.platform == 'darwin' else maxrss / 2 ** 10
+
+
+def nbytes(obj):
+    """Bytes of an array, xarray object, or dict/list/tuple of those (0 for anything else)."""
+    if isinstance(obj, dict):
+        return sum(nbytes(v) for v in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(nbytes(v) for v in obj)
+    return int(getattr(obj, 'nbytes', 0))
+
+
+def _write_record(record):
+    if _STATE['log_file'] is not None:
+        with open(_STATE['log_file'], 'a') as f:
+            f.write(json.dumps(record, default=str) + '\n')
+
+
+@contextmanager
+def profile_stage(stage, **tags):
+    """Profiles the enclosed code as `stage`.
+
+    Yields a record dict (empty if profiling is disabled); set `record['result']` to an
+    array/dataset to have its size recorded. Timings are filled in on exit.
+    """
+    if not _STATE['enabled']:
+        yield {}
+        return
+
+    record = {'stage': stage, **_STATE['tags'], **tags}   # stage tags override context tags
+    rss_start = peak_rss_mb()
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = time.perf_counter() - wall_start
+        record['cpu_s'] = time.process_time() - cpu_start
+        record['peak_rss_mb'] = peak_rss_mb()
+        if rss_start is not None:
+            record['rss_increase_mb'] = record['peak_rss_mb'] - rss_start
+        record['result_mb'] = nbytes(record.pop('result', None)) / 2 ** 20
+        record['timestamp'] = datetime.now().isoformat(timespec='seconds')
+        _write_record(record)
+
+
+def add_profile_attrs(obj, record):
+    """Writes `profile.{stage}.{field}` attrs to an xarray object (in place); attrs of other
+    stages are kept."""
+    if hasattr(obj, 'attrs'):
+        # new dict, in case attrs are shared w/ an input object
+        obj.attrs = dict(obj.attrs)
+        for k in PROFILE_FIELDS:
+            if record.get(k) is not None:
+                obj.attrs[f"profile.{record['stage']}.{k}"] = record[k]
+    return obj
+
+
+def profiled(func=None, *, stage=None):
+    """Decorator profiling each call of `func` (see `profile_stage`), when profiling is on.
+
+    Examples:
+        >>> @profiled
+        ... def timeseries_2_trials(...): ...
+        >>> @profiled(stage='rdm')
+        ... def compute_trial_respvec_rdm(...): ...
+    """
+    if func is None:
+        return functools.partial(profiled, stage=stage)
+
+    stage_name = stage if stage is not None else func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _STATE['enabled']:
+            return func(*args, **kwargs)
+
+        with profile_stage(stage_name) as record:
+            result = func(*args, **kwargs)
+            record['result'] = result
+        return add_profile_attrs(result, record)
+
+    return wrapper
+
+
+def read_profile_log(log_file):
+    """Loads a .jsonl profile log as a DataFrame."""
+    import pandas as pd
+    return pd.read_json(Path(log_file), lines=True)
@@ -1,8 +1,14 @@
 # __all__ = ["main"]
 
-from .main import index_stim_coord, stim2odor, split_stim_list, split_stim_coord
+from ryeutils.lazy import lazy_submodules
+
 # from .ospace import megamat
 # from .ospace import validation2
-from . import natmix
-from . import ospace
-from . import fix
+__getattr__, __dir__, __all__ = lazy_submodules(
+        __name__, ['main', 'vocab', 'natmix', 'ospace', 'fix', 'model_rdm'],
+        # names re-exported from submodules: {name: submodule}
+        exports={'index_stim_coord': 'main',
+                 'stim2odor': 'main',
+                 'split_stim_list': 'main',
+                 'split_stim_coord': 'main',
+                 'StimulusVocabulary': 'vocab'})
@@ -2,6 +2,7 @@
 
 import numpy as np
 from typing import Union, List
+from .vocab import map_unique
 
 
 def convert_conc_2_float(stim_list):
@@ -19,10 +20,11 @@ def convert_conc_2_float(stim_list):
         >>> stimuli.fix.convert_conc_2_float(stim_list)
         Out[7]: ['1-6ol @ -3.0', '1-5ol @ -3.0', 'geos @ -4.0']
     """
-    abbrev, conc = zip(*[item.split(" @ ") for item in stim_list])
-    conc_arr = np.array(conc).astype(float)
+    def _conc_2_float(item):
+        abbrev, conc = item.split(" @ ")
+        return f"{abbrev} @ {float(conc)}"
 
-    stim_list_float = [f"{a} @ {b}" for a, b in zip(abbrev, conc_arr)]
+    stim_list_float = map_unique(_conc_2_float, stim_list)
 
     if isinstance(stim_list, np.ndarray):
         stim_list_float = np.array(stim_list_float)
@@ -41,16 +43,11 @@ def replace_abbrevs(stim_list, abbrev_to_replace):
     Returns:
         fixed_stim_list (Union[List, np.ndarray]): stimuli w/ abbrevs replaced
     """
-    abbrevs, concs = zip(*[item.split(" @ ") for item in stim_list])
+    def _replace_abbrev(item):
+        abbrev, conc = item.split(" @ ")
+        return f"{abbrev_to_replace.get(abbrev, abbrev)} @ {conc}"
 
-    fixed_abbrevs = []
-    for item in abbrevs:
-        if item in abbrev_to_replace.keys():
-            fixed_abbrevs.append(abbrev_to_replace[item])
-        else:
-            fixed_abbrevs.append(item)
-
-    fixed_stim_list = [f"{a} @ {c}" for a, c in zip(fixed_abbrevs, concs)]
+    fixed_stim_list = map_unique(_replace_abbrev, stim_list)
 
     if isinstance(stim_list, np.ndarray):
         fixed_stim_list = np.array(fixed_stim_list)
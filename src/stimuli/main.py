@@ -2,6 +2,7 @@ import numpy as np
 import ryeutils
 import xarray as xr
 import re
+from .vocab import StimulusVocabulary, map_unique
 
 
 def index_stim_coord(ds, coord_name,
@@ -19,7 +20,6 @@ def index_stim_coord(ds, coord_name,
     Returns:
 
     """
-    print(coord_name)
     if len(ds[coord_name].dims) != 1:
         raise ValueError(f"Coord `{coord_name}` must be 1-D.")
 
@@ -28,7 +28,6 @@ def index_stim_coord(ds, coord_name,
 
     stim_dim, = ds[coord_name].dims
     stim_list = ds[coord_name].to_numpy()
-    print(f"stim_dim: {stim_dim}")
 
     # index stimuli
     # -------------
@@ -61,7 +60,7 @@ def stim2odor(stim_list):
         odor_list (Union[List, np.array]): List of odor strings only (concentration dropped)
 
     """
-    odor_list = [item.split(" @ ")[0] for item in stim_list]
+    odor_list = map_unique(lambda item: item.split(" @ ")[0], stim_list)
 
     if isinstance(stim_list, np.ndarray):
         odor_list = np.array(odor_list)
@@ -80,17 +79,20 @@ def split_stim_list(stim_list):
          odor_list (List[str]):
     """
 
-    stim_info = [item.split(" @ ") for item in stim_list]
+    stim_info = map_unique(lambda item: item.split(" @ "), stim_list)
     # odor_list, conc_list = list(zip(*stim_info))
     odor_list, conc_list = zip(*stim_info)
     odor_list = list(odor_list)
-    conc_list = [float(item) for item in conc_list]
+    conc_list = map_unique(float, conc_list)
     return odor_list, conc_list
 
 
 def split_stim_coord(ds, stim_coords, new_coord_names=None, substr_to_replace=None, ):
     """Splits stimulus coordinates like `"{odor} @ {conc}"` to 'abbrev' and 'conc'.
 
+    Stimuli are parsed once per unique value (see `stimuli.vocab.StimulusVocabulary`). For
+    mixtures, 'abbrev' joins the component odors w/ ", " and 'conc' is NaN.
+
     Args:
         ds (Union[xr.DataArray, xr.Dataset]): dataset w/ stimulus coords
         stim_coords (List[str]): must be 1-D coords
@@ -122,12 +124,11 @@ def split_stim_coord(ds, stim_coords, new_coord_names=None, substr_to_replace=No
         dimname, *_ = ds.coords[coord_name].dims
         abbrev_coord_name, conc_coord_name = new_coord_names[coord_name]
 
-        abbrevs, concs = split_stim_list(ds[coord_name].to_numpy())
+        stim_list = ds[coord_name].to_numpy()
+        split = StimulusVocabulary.from_stim(stim_list).split_coord(stim_list)
         # ori coord name : (dimname, abbrevs)
 
-        new_coords[abbrev_coord_name] = (dimname, abbrevs)
-        new_coords[conc_coord_name] = (dimname, concs)
-
-    print(new_coords)
+        new_coords[abbrev_coord_name] = (dimname, split['abbrev'].tolist())
+        new_coords[conc_coord_name] = (dimname, split['conc'].astype(float))
 
     return ds.assign_coords(new_coords)
@@ -0,0 +1,111 @@
+"""Model RDMs built from stimulus structure (mixture components and concentrations).
+
+Model RDMs are computed from the component tables of `stimuli.vocab.StimulusVocabulary` w/
+matrix operations over (stim, odor) arrays (no pairwise Python loops), and are cached per
+panel (stimulus ordering + parameters).
+
+Examples:
+    >>> from stimuli.natmix import kiwi_ea_eb_only
+    >>> ds_model = panel_model_rdms(kiwi_ea_eb_only.grouped_by_ea)
+    >>> ds_model['jaccard']
+"""
+
+from functools import lru_cache
+import numpy as np
+import xarray as xr
+from scipy.spatial.distance import cdist
+from .vocab import StimulusVocabulary
+
+MODEL_RDM_KINDS = ('jaccard', 'conc')
+
+
+def jaccard_distance(presence):
+    """Jaccard distance between the component sets of all pairs of stimuli.
+
+    Args:
+        presence (np.ndarray): (n_stim, n_odors) boolean, from
+          `StimulusVocabulary.presence_matrix`
+
+    Returns:
+        (np.ndarray): (n_stim, n_stim), 0 for two stimuli w/o components (e.g. solvent only)
+    """
+    P = presence.astype(np.float64)
+    n_shared = P @ P.T
+    n_comp = P.sum(axis=1)
+    n_union = n_comp[:, None] + n_comp[None, :] - n_shared
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dist = 1 - n_shared / n_union
+    dist[n_union == 0] = 0
+    return dist
+
+
+def concentration_distance(conc, absent_conc=None):
+    """Euclidean distance between the (log10) concentration vectors of all pairs of stimuli.
+
+    Args:
+        conc (np.ndarray): (n_stim, n_odors), from `StimulusVocabulary.concentration_matrix`
+          (NaN if the odor is absent)
+        absent_conc (float): concentration used for absent odors (default: 1 log unit below
+          the lowest concentration in the panel)
+
+    Returns:
+        (np.ndarray): (n_stim, n_stim)
+    """
+    if absent_conc is None:
+        absent_conc = np.nanmin(conc) - 1 if np.isfinite(conc).any() else 0.0
+    return cdist(np.nan_to_num(conc, nan=absent_conc), np.nan_to_num(conc, nan=absent_conc),
+                 metric='euclidean')
+
+
+@lru_cache(maxsize=64)
+def _model_rdm_values(stim_ord, kind, ignore_odors, absent_conc):
+    """Model RDM values for a panel (cached, read-only)."""
+    vocab = StimulusVocabulary.from_stim(stim_ord)
+    keep = ~vocab.odors.isin(ignore_odors)
+
+    if kind == 'jaccard':
+        values = jaccard_distance(vocab.presence_matrix()[:, keep])
+    elif kind == 'conc':
+        values = concentration_distance(vocab.concentration_matrix()[:, keep],
+                                        absent_conc=absent_conc)
+    else:
+        raise ValueError(f"`kind` must be one of {MODEL_RDM_KINDS}.")
+
+    values = values[np.ix_(vocab.encode(stim_ord), vocab.encode(stim_ord))]
+    values.setflags(write=False)
+    return values
+
+
+def build_model_rdm(stim_ord, kind='jaccard', ignore_odors=('pfo',), absent_conc=None):
+    """Model RDM for a stimulus panel.
+
+    Args:
+        stim_ord (List[str]): stimuli, e.g. `stimuli.natmix.kiwi_ea_eb_only.grouped_by_ea`;
+          repeats are allowed (e.g. the stimuli of all trials)
+        kind (str): 'jaccard' (mixture component overlap) or 'conc' (distance between
+          log10 concentration vectors)
+        ignore_odors (Tuple[str]): odors not counted as components (e.g. the solvent)
+        absent_conc (float): see `concentration_distance`
+
+    Returns:
+        da_model (xr.DataArray): dims ('stim_row', 'stim_col')
+    """
+    stim_ord = tuple(stim_ord)
+    values = _model_rdm_values(stim_ord, kind, tuple(ignore_odors), absent_conc)
+
+    da_model = xr.DataArray(values.copy(),
+                            dims=['stim_row', 'stim_col'],
+                            coords=dict(stim_row=list(stim_ord), stim_col=list(stim_ord)),
+                            name=kind)
+    da_model.attrs['model_rdm.kind'] = kind
+    return da_model
+
+
+def panel_model_rdms(stim_ord, kinds=MODEL_RDM_KINDS, **kwargs):
+    """All model RDMs for a panel, as data variables of one dataset (see `build_model_rdm`)."""
+    return xr.Dataset({kind: build_model_rdm(stim_ord, kind=kind, **kwargs)
+                       for kind in kinds})
+
+
+def clear_model_rdm_cache():
+    _model_rdm_values.cache_clear()
@@ -0,0 +1,154 @@
+"""Categorical stimulus vocabulary: each unique stimulus string is parsed once.
+
+Stimulus strings have the format `"{odor} @ {conc}"`, and mixtures join components w/ ", "
+(e.g. `"ea @ -6.2, eb @ -5.5"`, see `stimuli.natmix`). Trials are mapped to integer codes
+w/ `pd.factorize`, so parsing cost scales w/ the # of unique stimuli, not trials.
+"""
+
+import numpy as np
+import pandas as pd
+from attrs import define, field
+
+COMPONENT_SEP = ", "
+CONC_SEP = " @ "
+
+
+def map_unique(func, values):
+    """Applies `func` to each unique value in `values`, and maps the results back.
+
+    Args:
+        func (Callable): function of a single value
+        values (Union[List, np.ndarray]): values, w/ repeats (e.g. stimuli of all trials)
+
+    Returns:
+        (List): `[func(v) for v in values]`, w/ `func` called once per unique value (and
+          once per type of missing value, e.g. None or NaN)
+    """
+    values = np.asarray(values, dtype=object)
+    codes, uniques = pd.factorize(values)
+    results = [func(v) for v in uniques]
+
+    # missing values get code -1 (and aren't in `uniques`), so call `func` on them directly
+    na_results = {}
+    for i in np.flatnonzero(codes == -1):
+        na_results.setdefault(type(values[i]), func(values[i]))
+    return [results[c] if c >= 0 else na_results[type(v)] for c, v in zip(codes, values)]
+
+
+def parse_stim(stim):
+    """Parses a stimulus string to a list of (odor, conc) components.
+
+    Examples:
+        >>> parse_stim('ea @ -6.2, eb @ -5.5')
+        [('ea', -6.2), ('eb', -5.5)]
+    """
+    components = []
+    for item in stim.split(COMPONENT_SEP):
+        odor, conc = item.split(CONC_SEP)
+        components.append((odor.strip(), float(conc)))
+    return components
+
+
+@define(kw_only=True)
+class StimulusVocabulary:
+    """Unique stimuli, their mixture components, and integer codes.
+
+    Args:
+        stim (np.ndarray): unique stimulus strings; a stimulus' code is its position here
+        components (pd.DataFrame): one row per (stimulus, component), w/ columns
+          'stim_code', 'stim', 'odor', 'odor_code', 'conc'
+        odors (pd.Index): unique odor abbreviations; an odor's code is its position here
+
+    Examples:
+        >>> vocab = StimulusVocabulary.from_stim(ds_trials['stim'].to_numpy())
+        >>> stim_codes = vocab.encode(ds_trials['stim'].to_numpy())
+        >>> vocab.stim_table()
+        >>> vocab.concentration_matrix()        # (n_stim, n_odors), NaN if odor absent
+    """
+    stim: np.ndarray = field(converter=lambda x: np.asarray(x, dtype=object))
+    components: pd.DataFrame = field(repr=False)
+    odors: pd.Index
+
+    @classmethod
+    def from_stim(cls, stim_list):
+        """Builds a vocabulary from stimulus strings (repeats allowed, order of first
+        appearance is kept)."""
+        _, uniques = pd.factorize(np.asarray(stim_list, dtype=object))
+
+        rows = [(code, stim, odor, conc)
+                for code, stim in enumerate(uniques)
+                for odor, conc in parse_stim(stim)]
+        components = pd.DataFrame(rows, columns=['stim_code', 'stim', 'odor', 'conc'])
+
+        odor_codes, odors = pd.factorize(components['odor'])
+        components.insert(3, 'odor_code', odor_codes)
+        return cls(stim=uniques, components=components, odors=pd.Index(odors, name='odor'))
+
+    @property
+    def n_stim(self):
+        return self.stim.size
+
+    @property
+    def n_odors(self):
+        return self.odors.size
+
+    @property
+    def n_components(self):
+        """(n_stim,) # of components in each stimulus."""
+        return np.bincount(self.components['stim_code'], minlength=self.n_stim)
+
+    @property
+    def is_mixture(self):
+        """(n_stim,) True for stimuli w/ more than one component."""
+        return self.n_components > 1
+
+    def encode(self, stim_list):
+        """Integer codes of stimuli in `stim_list` (-1 for stimuli not in the vocabulary)."""
+        return pd.Index(self.stim).get_indexer(np.asarray(stim_list, dtype=object))
+
+    def decode(self, codes):
+        """Stimulus strings from integer codes."""
+        return self.stim[np.asarray(codes)]
+
+    def presence_matrix(self):
+        """(n_stim, n_odors) boolean matrix, True if the odor is a component of the stimulus."""
+        presence = np.zeros((self.n_stim, self.n_odors), dtype=bool)
+        presence[self.components['stim_code'], self.components['odor_code']] = True
+        return presence
+
+    def concentration_matrix(self):
+        """(n_stim, n_odors) float matrix of log10 concentrations, NaN if odor is absent."""
+        conc = np.full((self.n_stim, self.n_odors), np.nan)
+        conc[self.components['stim_code'], self.components['odor_code']] = \
+            self.components['conc']
+        return conc
+
+    def stim_table(self):
+        """Table of unique stimuli, indexed by stimulus code.
+
+        Columns are 'stim', 'abbrev' (component odors joined w/ ", "), 'conc' (NaN for
+        mixtures), 'n_components' and 'is_mixture'.
+        """
+        grouped = self.components.groupby('stim_code', sort=True)
+        n_components = self.n_components
+        conc = grouped['conc'].first().to_numpy(dtype=float, copy=True)
+        conc[n_components > 1] = np.nan
+
+        return pd.DataFrame(dict(stim=self.stim,
+                                 abbrev=grouped['odor'].agg(COMPONENT_SEP.join).to_numpy(),
+                                 conc=conc,
+                                 n_components=n_components,
+                                 is_mixture=n_components > 1),
+                            index=pd.RangeIndex(self.n_stim, name='stim_code'))
+
+    def split_coord(self, stim_list, fields=('abbrev', 'conc')):
+        """Columns of `stim_table` for every element of `stim_list` (e.g. all trials).
+
+        Returns:
+            (Dict[str, np.ndarray]): arrays keyed by field name, same length as `stim_list`
+        """
+        codes = self.encode(stim_list)
+        if (codes < 0).any():
+            raise ValueError("`stim_list` contains stimuli not in the vocabulary.")
+        table = self.stim_table()
+        return {f: table[f].to_numpy()[codes] for f in fields}
@@ -1,6 +1,14 @@
-from . import timeseries
-from . import trials
-from . import respvec
-from . import rdm
-from . import vis
-from . import utils
+"""Submodules are imported on first attribute access (e.g. `xrsa.rdm`).
+
+`import xrsa` sets the global xarray option `keep_attrs=True`, which all submodules rely on to
+carry metadata (e.g. `trials.*`, `baseline.*` attrs) through computations.
+"""
+
+import xarray as xr
+from ryeutils.lazy import lazy_submodules
+
+xr.set_options(keep_attrs=True)
+
+__getattr__, __dir__, __all__ = lazy_submodules(
+        __name__, ['timeseries', 'trials', 'respvec', 'rdm', 'vis', 'utils', 'cellcorr',
+                   'projection', 'decoding', 'cluster'])
@@ -0,0 +1,204 @@
+"""Cell x cell signal and noise correlations from (trials, cells, time) datasets.
+
+- **signal correlation**: correlation between cells of the stimulus-averaged responses
+  (trial-averaged per `stim`, concatenated over stimuli and time)
+- **noise correlation**: correlation between cells of the trial-to-trial residuals, after
+  subtracting the mean response to each stimulus
+
+Correlations are computed with blocked matrix products over rows of cells, so only a
+`(block_size, n_cells)` tile is ever held in memory. The full matrix can be written to a `.npy`
+memmap on disk, or reduced to the top-k partners per cell as a sparse matrix.
+"""
+
+from pathlib import Path
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import sparse
+from ryeutils.corr import standardize_rows
+
+
+def _trial_tensor(da_trials, trial_dim, cell_dim, time_dim, dtype):
+    """Returns (trials, cells, time) numpy array; time is optional."""
+    dims = [trial_dim, cell_dim] + ([time_dim] if time_dim in da_trials.dims else [])
+    arr = da_trials.transpose(*dims).to_numpy()
+    if arr.ndim == 2:
+        arr = arr[..., None]
+    return arr.astype(dtype, copy=False)
+
+
+def _stim_means(arr, stim_codes, n_stim):
+    """Mean response to each stimulus, (stim, cells, time), from (trials, cells, time)."""
+    onehot = np.zeros((n_stim, stim_codes.size), dtype=arr.dtype)
+    onehot[stim_codes, np.arange(stim_codes.size)] = 1
+    onehot /= onehot.sum(axis=1, keepdims=True)
+    return np.tensordot(onehot, arr, axes=(1, 0))
+
+
+def signal_response_matrix(da_trials, stim_coord='stim', trial_dim='trials', cell_dim='cells',
+                           time_dim='time', dtype=np.float32):
+    """Stimulus-averaged responses, reshaped to (cells, stim * time).
+
+    Args:
+        da_trials (xr.DataArray): (trials, cells, time) data, from
+          `xrsa.trials.timeseries_2_trials`
+        stim_coord (str): stimulus coordinate along `trial_dim`
+        trial_dim (str): trial dimension name
+        cell_dim (str): cell dimension name
+        time_dim (str): time dimension name (optional, may be missing for response vectors)
+        dtype (np.dtype): computation dtype
+
+    Returns:
+        np.ndarray: (cells, stim * time)
+    """
+    arr = _trial_tensor(da_trials, trial_dim, cell_dim, time_dim, dtype)
+    stim_codes, stim_uniques = pd.factorize(da_trials[stim_coord].to_numpy())
+    stim_mean = _stim_means(arr, stim_codes, stim_uniques.size)
+    return stim_mean.transpose(1, 0, 2).reshape(arr.shape[1], -1)
+
+
+def noise_response_matrix(da_trials, stim_coord='stim', trial_dim='trials', cell_dim='cells',
+                          time_dim='time', dtype=np.float32):
+    """Trial-to-trial residuals (response - mean response to stimulus), as (cells, trials * time).
+
+    Args:
+        da_trials (xr.DataArray): (trials, cells, time) data, from
+          `xrsa.trials.timeseries_2_trials`
+        stim_coord (str): stimulus coordinate along `trial_dim`
+        trial_dim (str): trial dimension name
+        cell_dim (str): cell dimension name
+        time_dim (str): time dimension name (optional, may be missing for response vectors)
+        dtype (np.dtype): computation dtype
+
+    Returns:
+        np.ndarray: (cells, trials * time)
+    """
+    arr = _trial_tensor(da_trials, trial_dim, cell_dim, time_dim, dtype)
+    stim_codes, stim_uniques = pd.factorize(da_trials[stim_coord].to_numpy())
+    resid = arr - _stim_means(arr, stim_codes, stim_uniques.size)[stim_codes]
+    return resid.transpose(1, 0, 2).reshape(arr.shape[1], -1)
+
+
+def blocked_corr(x, block_size=2048, dtype=np.float32, out_file=None, top_k=None,
+                 include_self=False):
+    """Row x row correlation matrix of `x`, computed in blocks of rows.
+
+    Rows are standardized once (NaNs ignored), so each block is a single matrix product
+    `z[block] @ z.T`.
+
+    Args:
+        x (np.ndarray): (n_rows, n_features)
+        block_size (int): # of rows per block; peak memory is ~ `block_size * n_rows` values
+        dtype (np.dtype): computation/output dtype
+        out_file (Union[str, Path]): if provided, the dense (n_rows, n_rows) matrix is written
+          tile-by-tile to this `.npy` file, and returned as a read-only memmap
+        top_k (int): if provided (>= 1), keep only the `top_k` largest correlations per row,
+          and return a `scipy.sparse.csr_matrix`; NaN correlations (e.g. of constant rows)
+          are never kept, so rows may have fewer than `top_k` entries
+        include_self (bool): whether to keep the diagonal when selecting `top_k` partners
+
+    Returns:
+        Union[np.ndarray, np.memmap, sparse.csr_matrix]: correlation matrix
+    """
+    z = standardize_rows(x, dtype=dtype, nan_policy='omit')
+    n_rows = z.shape[0]
+
+    if top_k is not None:
+        if top_k < 1:
+            raise ValueError(f"top_k must be >= 1, got {top_k}.")
+        top_k = min(top_k, n_rows if include_self else n_rows - 1)
+        if top_k < 1:
+            raise ValueError(f"No partners to select for {n_rows} row(s) w/ "
+                             f"include_self=False.")
+
+    out = None
+    if out_file is not None:
+        out = np.lib.format.open_memmap(Path(out_file), mode='w+', dtype=z.dtype,
+                                        shape=(n_rows, n_rows))
+    elif top_k is None:
+        out = np.empty((n_rows, n_rows), dtype=z.dtype)
+
+    if top_k is not None:
+        indices = np.empty((n_rows, top_k), dtype=np.int64)
+        values = np.empty((n_rows, top_k), dtype=z.dtype)
+
+    for start in range(0, n_rows, block_size):
+        stop = min(start + block_size, n_rows)
+        tile = z[start:stop] @ z.T
+        np.clip(tile, -1.0, 1.0, out=tile)
+
+        if out is not None:
+            out[start:stop] = tile
+
+        if top_k is not None:
+            if not include_self:
+                tile[np.arange(stop - start), np.arange(start, stop)] = -np.inf
+            tile[np.isnan(tile)] = -np.inf
+            idx = np.argpartition(tile, -top_k, axis=1)[:, -top_k:]
+            indices[start:stop] = idx
+            values[start:stop] = np.take_along_axis(tile, idx, axis=1)
+
+    if isinstance(out, np.memmap):
+        out.flush()
+        del out
+        out = np.load(out_file, mmap_mode='r')
+
+    if top_k is not None:
+        # drop NaN correlations (stored as -inf for the partition) and the masked diagonal
+        keep = np.isfinite(values)
+        rows = np.broadcast_to(np.arange(n_rows)[:, None], values.shape)
+        return sparse.csr_matrix((values[keep], (rows[keep], indices[keep])),
+                                 shape=(n_rows, n_rows))
+    return out
+
+
+def compute_cell_corr(da_trials, kind='signal', stim_coord='stim', trial_dim='trials',
+                      cell_dim='cells', time_dim='time', dtype=np.float32, block_size=2048,
+                      out_file=None, top_k=None):
+    """Computes cell x cell signal or noise correlations from a (trials, cells, time) dataarray.
+
+    Args:
+        da_trials (xr.DataArray): output of `xrsa.trials.timeseries_2_trials` (a single data
+          variable, e.g. `ds_trials['Fc_zscore']`)
+        kind (str): 'signal' or 'noise'
+        stim_coord (str): stimulus coordinate along `trial_dim`
+        trial_dim (str): trial dimension name
+        cell_dim (str): cell dimension name
+        time_dim (str): time dimension name
+        dtype (np.dtype): computation dtype (default float32)
+        block_size (int): # of cells per block
+        out_file (Union[str, Path]): write the dense matrix to this `.npy` file (memmapped)
+        top_k (int): return only the top-k partners per cell, as a sparse matrix
+
+    Returns:
+        Union[xr.DataArray, sparse.csr_matrix]: dims (`{cell_dim}_row`, `{cell_dim}_col`),
+          or a (cells, cells) sparse matrix if `top_k` is set
+
+    Examples:
+        >>> da_sig = compute_cell_corr(ds_bc_trials['Fc_zscore'], kind='signal')
+        >>> nn = compute_cell_corr(ds_bc_trials['Fc_zscore'], kind='noise', top_k=20)
+    """
+    if kind == 'signal':
+        x = signal_response_matrix(da_trials, stim_coord=stim_coord, trial_dim=trial_dim,
+                                   cell_dim=cell_dim, time_dim=time_dim, dtype=dtype)
+    elif kind == 'noise':
+        x = noise_response_matrix(da_trials, stim_coord=stim_coord, trial_dim=trial_dim,
+                                  cell_dim=cell_dim, time_dim=time_dim, dtype=dtype)
+    else:
+        raise ValueError(f"Invalid kind: {kind}")
+
+    corr = blocked_corr(x, block_size=block_size, dtype=dtype, out_file=out_file, top_k=top_k)
+
+    if top_k is not None:
+        return corr
+
+    row_dim, col_dim = f"{cell_dim}_row", f"{cell_dim}_col"
+    cells = da_trials[cell_dim].to_numpy() if cell_dim in da_trials.coords \
+        else np.arange(corr.shape[0])
+    da_corr = xr.DataArray(corr,
+                           dims=[row_dim, col_dim],
+                           coords={row_dim: (row_dim, cells), col_dim: (col_dim, cells)},
+                           name=da_trials.name,
+                           attrs=da_trials.attrs.copy())
+    da_corr.attrs['cellcorr.kind'] = kind
+    return da_corr
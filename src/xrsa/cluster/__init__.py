@@ -1 +1,3 @@
 from . import spectral
+from . import summary
+from . import consensus
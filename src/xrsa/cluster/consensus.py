@@ -0,0 +1,132 @@
+"""Consensus clustering of stimuli across acquisitions, from a co-association matrix.
+
+Each acquisition's stimulus clusters (e.g. `stim_labels` from
+`xrsa.cluster.spectral.add_spectral_coclusters_to_stim_respvec`) are added one at a time to a
+`CoassociationAccumulator`, which only keeps two (stim, stim) count matrices, so memory is
+O(stimuli^2) regardless of how many flies are added.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from attrs import define, field
+from scipy.cluster import hierarchy
+from scipy.spatial.distance import squareform
+
+
+@define(kw_only=True)
+class CoassociationAccumulator:
+    """Incrementally accumulates a stimulus x stimulus co-association matrix.
+
+    `coassociation[i, j]` is the fraction of acquisitions containing both stimuli `i` and `j`
+    in which they were assigned to the same cluster.
+
+    Examples:
+        >>> acc = CoassociationAccumulator()
+        >>> for da_coclust in da_coclust_list:
+        ...     acc.add_coclust(da_coclust)
+        >>> da_coassoc = acc.coassociation()
+        >>> consensus_labels = acc.cluster(n_clusters=6)
+    """
+    stim: list = field(factory=list)
+    n_together: np.ndarray = field(init=False, repr=False)
+    n_both: np.ndarray = field(init=False, repr=False)
+    n_acq: int = field(init=False, default=0)
+
+    def __attrs_post_init__(self):
+        n_stim = len(self.stim)
+        self.stim = list(self.stim)
+        self.n_together = np.zeros((n_stim, n_stim), dtype=np.int64)
+        self.n_both = np.zeros((n_stim, n_stim), dtype=np.int64)
+
+    def _stim_index(self, stim):
+        """Maps stimuli to rows, growing the count matrices for unseen stimuli."""
+        lookup = {s: i for i, s in enumerate(self.stim)}
+        new_stim = [s for s in dict.fromkeys(stim) if s not in lookup]
+
+        if new_stim:
+            n_old = len(self.stim)
+            n_new = n_old + len(new_stim)
+            for name in ('n_together', 'n_both'):
+                grown = np.zeros((n_new, n_new), dtype=np.int64)
+                grown[:n_old, :n_old] = getattr(self, name)
+                setattr(self, name, grown)
+            lookup.update({s: n_old + i for i, s in enumerate(new_stim)})
+            self.stim.extend(new_stim)
+
+        return np.array([lookup[s] for s in stim], dtype=np.int64)
+
+    def add(self, stim_labels, stim):
+        """Adds the stimulus cluster labels of one acquisition.
+
+        Args:
+            stim_labels (Union[list, np.ndarray]): integer cluster label for each stimulus
+            stim (Union[list, np.ndarray]): stimulus identifiers, same size as `stim_labels`
+        """
+        stim = list(stim)
+        if len(set(stim)) != len(stim):
+            raise ValueError("Stimuli must be unique within an acquisition.")
+
+        idx = self._stim_index(stim)
+        _, label_codes = np.unique(np.asarray(stim_labels), return_inverse=True)
+
+        onehot = np.zeros((idx.size, label_codes.max() + 1), dtype=np.int64)
+        onehot[np.arange(idx.size), label_codes] = 1
+
+        ix = np.ix_(idx, idx)
+        self.n_together[ix] += onehot @ onehot.T
+        self.n_both[ix] += 1
+        self.n_acq += 1
+
+    def add_coclust(self, da_coclust, stim_coord='stim', label_coord='stim_labels'):
+        """Adds labels from a dataarray returned by `add_spectral_coclusters_to_stim_respvec`."""
+        self.add(da_coclust[label_coord].to_numpy(), da_coclust[stim_coord].to_numpy())
+
+    def coassociation(self):
+        """Co-association matrix (NaN for stimulus pairs never recorded together).
+
+        Returns:
+            da_coassoc (xr.DataArray): dims ('stim_row', 'stim_col')
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            coassoc = self.n_together / self.n_both
+        da_coassoc = xr.DataArray(coassoc,
+                                  dims=['stim_row', 'stim_col'],
+                                  coords=dict(stim_row=self.stim, stim_col=self.stim),
+                                  name='coassociation')
+        da_coassoc.attrs['consensus.n_acq'] = self.n_acq
+        return da_coassoc
+
+    def linkage(self, method='average'):
+        """Hierarchical clustering linkage of `1 - coassociation` (missing pairs = distance 1).
+
+        Args:
+            method (str): linkage method (see `scipy.cluster.hierarchy.linkage`)
+
+        Returns:
+            Z (np.ndarray): linkage matrix
+        """
+        dist = 1 - np.nan_to_num(self.coassociation().to_numpy(), nan=0.0)
+        np.fill_diagonal(dist, 0)
+        return hierarchy.linkage(squareform(dist, checks=False), method=method)
+
+    def cluster(self, n_clusters=None, threshold=None, method='average'):
+        """Consensus stimulus clusters, from hierarchical clustering of the co-association.
+
+        Args:
+            n_clusters (int): # of clusters to cut the tree into
+            threshold (float): or, distance (1 - coassociation) at which to cut the tree
+            method (str): linkage method
+
+        Returns:
+            pd.Series: consensus cluster label (starting at 0) indexed by stimulus
+        """
+        Z = self.linkage(method=method)
+        if n_clusters is not None:
+            labels = hierarchy.fcluster(Z, t=n_clusters, criterion='maxclust')
+        elif threshold is not None:
+            labels = hierarchy.fcluster(Z, t=threshold, criterion='distance')
+        else:
+            raise ValueError("Either `n_clusters` or `threshold` must be provided.")
+        return pd.Series(labels - 1, index=pd.Index(self.stim, name='stim'),
+                         name='consensus_labels')
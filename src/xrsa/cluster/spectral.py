@@ -1,6 +1,12 @@
+import hashlib
+import json
+from itertools import combinations
+from pathlib import Path
 import xarray as xr
 import numpy as np
 import pandas as pd
+from joblib import Parallel, delayed
+from scipy import sparse
 
 
 def add_spectral_coclusters_to_stim_respvec(da_respvec, model,
@@ -50,10 +56,160 @@ def add_spectral_coclusters_to_stim_respvec(da_respvec, model,
 
 
 def get_cell_cluster_counts(da_coclust):
-    df_cell_cluster_counts = da_coclust['cell_labels'].to_pandas().value_counts().sort_index()
-    df_cell_cluster_counts = (df_cell_cluster_counts.reset_index()
-                              .rename(columns={'index': 'cell_cluster', 0: 'n_cells'})
-                              )
-    n_cells = df_cell_cluster_counts['n_cells']
-    df_cell_cluster_counts['fraction'] = df_cell_cluster_counts['n_cells'] / n_cells
+    """Number and fraction of cells in each cell cluster (`cell_labels` coordinate).
+
+    For summaries over many clustering runs at once, see
+    `xrsa.cluster.summary.summarize_clusters`.
+    """
+    n_cells = np.bincount(da_coclust['cell_labels'].to_numpy().astype(np.int64))
+    df_cell_cluster_counts = pd.DataFrame({'cell_cluster': np.flatnonzero(n_cells),
+                                           'n_cells': n_cells[n_cells > 0]})
+    df_cell_cluster_counts['fraction'] = \
+        df_cell_cluster_counts['n_cells'] / df_cell_cluster_counts['n_cells'].sum()
     return df_cell_cluster_counts
+
+
+def respvec_content_hash(da_respvec):
+    """Hash of the values, dims and shape of a response vector dataarray (used as cache key)."""
+    h = hashlib.sha1()
+    h.update(json.dumps([list(map(str, da_respvec.dims)), list(da_respvec.shape),
+                         str(da_respvec.dtype)]).encode())
+    h.update(np.ascontiguousarray(da_respvec.to_numpy()).tobytes())
+    return h.hexdigest()
+
+
+def _params_hash(params):
+    return hashlib.sha1(json.dumps(params, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _fit_spectral_biclustering(X, n_clusters, random_state, model_kws):
+    """Fits a single SpectralBiclustering model, returns (row_labels, column_labels)."""
+    from sklearn.cluster import SpectralBiclustering
+
+    model = SpectralBiclustering(n_clusters=n_clusters, random_state=random_state,
+                                 **model_kws).fit(X)
+    return model.row_labels_.astype(np.int32), model.column_labels_.astype(np.int32)
+
+
+def _mean_pairwise_ari(labels):
+    """Mean adjusted rand index between all pairs of label vectors (rows of `labels`)."""
+    from sklearn.metrics import adjusted_rand_score
+
+    if len(labels) < 2:
+        return np.nan
+    return np.mean([adjusted_rand_score(a, b) for a, b in combinations(labels, 2)])
+
+
+def run_spectral_biclustering(da_respvec, n_clusters_grid, n_restarts=5, row_dim='stim',
+                              col_dim='cells', method='scale', n_init=5,
+                              svd_method='randomized', n_svd_vecs=None, mini_batch=False,
+                              use_sparse=False, random_state=0, n_jobs=-1, cache_dir=None):
+    """Fits spectral biclustering over a grid of `n_clusters`, w/ parallel restarts and caching.
+
+    Every (n_clusters, restart) fit runs as a separate joblib task. Fitted labels are cached in
+    `cache_dir` as .npz files, keyed on the content hash of `da_respvec` and the model
+    parameters, so re-running with an extended grid only fits the new models.
+
+    Stability of each grid entry is the mean pairwise adjusted rand index between the labels
+    of its restarts (restart `i` uses seed `random_state + i`).
+
+    Args:
+        da_respvec (xr.DataArray): response vectors, with dims (`row_dim`, `col_dim`), e.g.
+          da_mean_peak_stim['Fc_zscore']
+        n_clusters_grid (List[Union[int, Tuple[int, int]]]): values of `n_clusters` to fit,
+          either ints or (n_row_clusters, n_column_clusters)
+        n_restarts (int): # of fits w/ different random seeds per grid entry
+        row_dim (str): dimension clustered into `stim_labels` (default 'stim')
+        col_dim (str): dimension clustered into `cell_labels` (default 'cells')
+        method (str): normalization method, see `sklearn.cluster.SpectralBiclustering`
+        n_init (int): # of k-means initializations per fit
+        svd_method (str): 'randomized' (fast, for many cells) or 'arpack'
+        n_svd_vecs (int): # of vectors for 'arpack'
+        mini_batch (bool): use mini-batch k-means
+        use_sparse (bool): convert the response matrix to `scipy.sparse.csr_matrix` before
+          fitting (useful for very many, mostly silent cells). Sparse data must be
+          non-negative (e.g. rectified responses).
+        random_state (int): base random seed
+        n_jobs (int): # of joblib workers (-1 for all cores)
+        cache_dir (Union[str, Path]): directory for cached labels (no caching if None)
+
+    Returns:
+        ds_runs (xr.Dataset): dims ('model', 'restart', `row_dim`, `col_dim`), w/ data vars
+          `stim_labels`, `cell_labels`, `stim_stability`, `cell_stability` and coords
+          `n_row_clusters`, `n_col_clusters` along 'model'.
+
+    Examples:
+        Fit a grid, then attach the labels of one model to the response vectors::
+
+            ds_runs = run_spectral_biclustering(ds_mean_peak_stim['Fc_zscore'],
+                                                n_clusters_grid=[(8, 8), (12, 12), (16, 16)],
+                                                cache_dir=acq.mov_dir / 'cluster_cache')
+            da_coclust = ds_mean_peak_stim['Fc_zscore'].assign_coords(
+                stim_labels=ds_runs['stim_labels'].isel(model=2, restart=0),
+                cell_labels=ds_runs['cell_labels'].isel(model=2, restart=0))
+    """
+    da_respvec = da_respvec.transpose(row_dim, col_dim)
+    X = da_respvec.to_numpy()
+    if use_sparse:
+        X = sparse.csr_matrix(X)
+
+    model_kws = dict(method=method, n_init=n_init, svd_method=svd_method,
+                     n_svd_vecs=n_svd_vecs, mini_batch=mini_batch)
+
+    grid = [tuple(n) if np.ndim(n) else (int(n), int(n)) for n in n_clusters_grid]
+    tasks = [(i_model, i_restart) for i_model in range(len(grid))
+             for i_restart in range(n_restarts)]
+
+    if cache_dir is not None:
+        cache_dir = Path(cache_dir)
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        data_hash = respvec_content_hash(da_respvec)
+
+    def cache_file(i_model, i_restart):
+        params = dict(n_clusters=grid[i_model], random_state=random_state + i_restart,
+                      use_sparse=use_sparse, **model_kws)
+        return cache_dir.joinpath(f"spectral_{data_hash[:16]}_{_params_hash(params)[:16]}.npz")
+
+    results = {}
+    if cache_dir is not None:
+        for task in tasks:
+            file = cache_file(*task)
+            if file.is_file():
+                with np.load(file) as npz:
+                    results[task] = (npz['row_labels'], npz['col_labels'])
+
+    to_fit = [task for task in tasks if task not in results]
+    fitted = Parallel(n_jobs=n_jobs)(
+            delayed(_fit_spectral_biclustering)(X, grid[i_model], random_state + i_restart,
+                                                model_kws)
+            for i_model, i_restart in to_fit)
+
+    for task, (row_labels, col_labels) in zip(to_fit, fitted):
+        results[task] = (row_labels, col_labels)
+        if cache_dir is not None:
+            np.savez(cache_file(*task), row_labels=row_labels, col_labels=col_labels)
+
+    stim_labels = np.stack([np.stack([results[(i, r)][0] for r in range(n_restarts)])
+                            for i in range(len(grid))])
+    cell_labels = np.stack([np.stack([results[(i, r)][1] for r in range(n_restarts)])
+                            for i in range(len(grid))])
+
+    ds_runs = xr.Dataset(
+            data_vars=dict(
+                    stim_labels=(['model', 'restart', row_dim], stim_labels),
+                    cell_labels=(['model', 'restart', col_dim], cell_labels),
+                    stim_stability=('model', [_mean_pairwise_ari(x) for x in stim_labels]),
+                    cell_stability=('model', [_mean_pairwise_ari(x) for x in cell_labels]),
+                    ),
+            coords={
+                'model': range(len(grid)),
+                'restart': range(n_restarts),
+                'n_row_clusters': ('model', [g[0] for g in grid]),
+                'n_col_clusters': ('model', [g[1] for g in grid]),
+                row_dim: da_respvec[row_dim].to_numpy(),
+                col_dim: da_respvec[col_dim].to_numpy(),
+                },
+            attrs={f"spectral.{k}": str(v) for k, v in model_kws.items()}
+            )
+    ds_runs.attrs['spectral.random_state'] = random_state
+    return ds_runs
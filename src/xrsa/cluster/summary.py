@@ -0,0 +1,166 @@
+"""Vectorized count and profile summaries for clustered response vectors.
+
+All summaries are segment sums over integer label codes: the labels of every model (and
+every cell group, e.g. acquisitions pooled along `cells`) are offset into one flat code
+vector, so counts are a single `np.bincount` and per-cluster sums a single sparse one-hot
+matrix product, no matter how many clustering runs are summarized.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from scipy import sparse
+
+
+def _as_label_dataarray(labels, label_dim):
+    if isinstance(labels, xr.DataArray):
+        return labels
+    labels = np.asarray(labels)
+    dims = [f"dim_{i}" for i in range(labels.ndim - 1)] + [label_dim]
+    return xr.DataArray(labels, dims=dims)
+
+
+def _segment_stats(codes, n_codes, X):
+    """Counts, sums and sums of squares of the rows of `X` (n_items, n_features) per code.
+
+    `codes` has shape (n_models, n_items), with values in [0, n_codes).
+    """
+    n_models, n_items = codes.shape
+    counts = np.bincount(codes.ravel(), minlength=n_codes)
+
+    onehot = sparse.csr_matrix(
+            (np.ones(codes.size, dtype=X.dtype),
+             (codes.ravel(), np.tile(np.arange(n_items), n_models))),
+            shape=(n_codes, n_items))
+    sums = np.asarray(onehot @ X)
+    sumsq = np.asarray(onehot @ (X * X))
+    return counts, sums, sumsq
+
+
+def _mean_sem(counts, sums, sumsq):
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+        var = (sumsq - sums * mean) / (counts - 1)
+        sem = np.sqrt(np.maximum(var, 0) / counts)
+    return mean, sem
+
+
+def summarize_clusters(da_respvec, cell_labels, stim_labels=None, row_dim='stim',
+                       col_dim='cells', cell_group_coord=None, n_cell_clusters=None,
+                       n_stim_clusters=None):
+    """Cluster counts, fractions, and mean/SEM profiles for many clustering runs at once.
+
+    Args:
+        da_respvec (xr.DataArray): response vectors w/ dims (`row_dim`, `col_dim`)
+        cell_labels (Union[xr.DataArray, np.ndarray]): integer cell labels, shape
+          (..., `col_dim`); leading dims (e.g. 'model', 'restart' from
+          `xrsa.cluster.spectral.run_spectral_biclustering`) are summarized independently
+        stim_labels (Union[xr.DataArray, np.ndarray]): optional integer stimulus labels, shape
+          (..., `row_dim`), w/ the same leading dims as `cell_labels`
+        row_dim (str): stimulus dimension
+        col_dim (str): cell dimension
+        cell_group_coord (str): optional coordinate along `col_dim` (e.g. 'acq', for cells
+          pooled across acquisitions); summaries are computed separately per group
+        n_cell_clusters (int): # of cell clusters (default: max label + 1)
+        n_stim_clusters (int): # of stimulus clusters (default: max label + 1)
+
+    Returns:
+        ds_summary (xr.Dataset): w/ data variables
+
+          - `n_cells`, `fraction`: (..., [group], cell_label)
+          - `profile_mean`, `profile_sem`: (..., [group], cell_label, `row_dim`), i.e. mean
+            response of each cell cluster to each stimulus
+          - `n_stim`: (..., stim_label), if `stim_labels` is provided
+          - `block_mean`, `block_sem`: (..., [group], cell_label, stim_label), if
+            `stim_labels` is provided
+
+    Examples:
+        >>> ds_runs = run_spectral_biclustering(da_respvec, n_clusters_grid=[8, 12, 16])
+        >>> ds_summary = summarize_clusters(da_respvec, ds_runs['cell_labels'],
+        ...                                 ds_runs['stim_labels'])
+        >>> df_mean_cell_clusters = (ds_summary['profile_mean']
+        ...                          .isel(model=0, restart=0).to_pandas())
+    """
+    da_respvec = da_respvec.transpose(row_dim, col_dim)
+    X = da_respvec.to_numpy().T.astype(np.float64)  # (cells, stim)
+    n_cells_total, n_stim_total = X.shape
+
+    da_cell_labels = _as_label_dataarray(cell_labels, col_dim)
+    lead_dims = [d for d in da_cell_labels.dims if d != col_dim]
+    da_cell_labels = da_cell_labels.transpose(*lead_dims, col_dim)
+    lead_shape = da_cell_labels.shape[:-1]
+    lead_coords = {d: da_cell_labels[d].to_numpy() for d in lead_dims
+                   if d in da_cell_labels.coords}
+
+    cell_codes = da_cell_labels.to_numpy().reshape(-1, n_cells_total).astype(np.int64)
+    n_models = cell_codes.shape[0]
+    if n_cell_clusters is None:
+        n_cell_clusters = int(cell_codes.max()) + 1
+
+    # groups (e.g. acquisitions) along the cell dimension
+    if cell_group_coord is not None:
+        group_codes, groups = pd.factorize(da_respvec[cell_group_coord].to_numpy())
+        n_groups = groups.size
+    else:
+        group_codes = np.zeros(n_cells_total, dtype=np.int64)
+        groups = None
+        n_groups = 1
+
+    codes = (np.arange(n_models)[:, None] * n_groups + group_codes[None, :]) * n_cell_clusters \
+        + cell_codes
+    counts, sums, sumsq = _segment_stats(codes, n_models * n_groups * n_cell_clusters, X)
+
+    counts = counts.reshape(n_models, n_groups, n_cell_clusters)
+    sums = sums.reshape(n_models, n_groups, n_cell_clusters, n_stim_total)
+    sumsq = sumsq.reshape(n_models, n_groups, n_cell_clusters, n_stim_total)
+
+    profile_mean, profile_sem = _mean_sem(counts[..., None], sums, sumsq)
+    fraction = counts / counts.sum(axis=-1, keepdims=True)
+
+    group_dims = ['group'] if groups is not None else []
+    out_lead = list(lead_shape) + ([n_groups] if groups is not None else [])
+
+    def reshape(arr, *trailing):
+        return arr.reshape(*out_lead, *trailing)
+
+    data_vars = dict(
+            n_cells=([*lead_dims, *group_dims, 'cell_label'],
+                     reshape(counts, n_cell_clusters)),
+            fraction=([*lead_dims, *group_dims, 'cell_label'],
+                      reshape(fraction, n_cell_clusters)),
+            profile_mean=([*lead_dims, *group_dims, 'cell_label', row_dim],
+                          reshape(profile_mean, n_cell_clusters, n_stim_total)),
+            profile_sem=([*lead_dims, *group_dims, 'cell_label', row_dim],
+                         reshape(profile_sem, n_cell_clusters, n_stim_total)),
+            )
+    coords = {**lead_coords,
+              'cell_label': np.arange(n_cell_clusters),
+              row_dim: da_respvec[row_dim].to_numpy()}
+    if groups is not None:
+        coords['group'] = np.asarray(groups)
+
+    if stim_labels is not None:
+        da_stim_labels = _as_label_dataarray(stim_labels, row_dim).transpose(*lead_dims, row_dim)
+        stim_codes = da_stim_labels.to_numpy().reshape(n_models, n_stim_total).astype(np.int64)
+        if n_stim_clusters is None:
+            n_stim_clusters = int(stim_codes.max()) + 1
+
+        # (models, stim, stim_label) one-hot, to sum stimulus profiles within stim clusters
+        stim_onehot = np.zeros((n_models, n_stim_total, n_stim_clusters))
+        np.put_along_axis(stim_onehot, stim_codes[..., None], 1, axis=-1)
+        n_stim = stim_onehot.sum(axis=1)
+
+        block_sums = np.einsum('mgks,msj->mgkj', sums, stim_onehot)
+        block_sumsq = np.einsum('mgks,msj->mgkj', sumsq, stim_onehot)
+        block_counts = counts[..., None] * n_stim[:, None, None, :]
+        block_mean, block_sem = _mean_sem(block_counts, block_sums, block_sumsq)
+
+        data_vars['n_stim'] = ([*lead_dims, 'stim_label'],
+                               n_stim.reshape(*lead_shape, n_stim_clusters).astype(np.int64))
+        data_vars['block_mean'] = ([*lead_dims, *group_dims, 'cell_label', 'stim_label'],
+                                   reshape(block_mean, n_cell_clusters, n_stim_clusters))
+        data_vars['block_sem'] = ([*lead_dims, *group_dims, 'cell_label', 'stim_label'],
+                                  reshape(block_sem, n_cell_clusters, n_stim_clusters))
+        coords['stim_label'] = np.arange(n_stim_clusters)
+
+    return xr.Dataset(data_vars=data_vars, coords=coords, attrs=da_respvec.attrs.copy())
@@ -0,0 +1,132 @@
+"""Linear decoding of stimulus identity from response vectors, w/ cross-validation over
+stimulus repeats.
+
+Decoding uses ridge classification in its dual form: for each timepoint (or any other
+batch dimension) the (trials, trials) Gram matrix `X @ X.T` is computed once, and every
+cross-validation fold is solved from sub-blocks of it. With many more cells than trials this
+is much cheaper than fitting in cell space, and all timepoints in a chunk are solved together
+w/ batched `np.linalg.solve`. Chunks of timepoints/acquisitions run in parallel w/ joblib.
+"""
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+from joblib import Parallel, delayed
+
+
+def _center_gram(K_tr, K_te):
+    """Centers train/test Gram matrices on the training-set mean (kernel centering)."""
+    row_mean_tr = K_tr.mean(axis=-1, keepdims=True)            # (..., n, 1)
+    col_mean_tr = K_tr.mean(axis=-2, keepdims=True)            # (..., 1, n)
+    grand_mean = row_mean_tr.mean(axis=-2, keepdims=True)      # (..., 1, 1)
+
+    Kc_tr = K_tr - row_mean_tr - col_mean_tr + grand_mean
+    Kc_te = K_te - K_te.mean(axis=-1, keepdims=True) - col_mean_tr + grand_mean
+    return Kc_tr, Kc_te
+
+
+def _decode_chunk(X, labels, folds, n_classes, alpha):
+    """Cross-validated dual ridge classification for a chunk of tasks.
+
+    Args:
+        X (np.ndarray): (batch, trials, cells)
+        labels (np.ndarray): (trials,) integer class labels
+        folds (np.ndarray): (trials,) integer fold ids
+        n_classes (int): # of classes
+        alpha (float): ridge penalty
+
+    Returns:
+        predictions (np.ndarray): (batch, trials) predicted labels (each trial predicted
+          by the fold in which it is held out)
+    """
+    X = np.nan_to_num(X, nan=0.0)
+    K = np.matmul(X, np.swapaxes(X, -1, -2))                   # (batch, trials, trials)
+    Y = np.eye(n_classes)[labels]                              # (trials, classes)
+
+    predictions = np.empty(X.shape[:2], dtype=np.int64)
+    for fold in np.unique(folds):
+        test = folds == fold
+        train = ~test
+
+        Kc_tr, Kc_te = _center_gram(K[:, train][:, :, train], K[:, test][:, :, train])
+        y_mean = Y[train].mean(axis=0)
+        Yc = Y[train] - y_mean
+
+        n_train = int(train.sum())
+        dual = np.linalg.solve(Kc_tr + alpha * np.eye(n_train),
+                               np.broadcast_to(Yc, (X.shape[0],) + Yc.shape))
+        scores = np.matmul(Kc_te, dual) + y_mean
+        predictions[:, test] = scores.argmax(axis=-1)
+    return predictions
+
+
+def decode_stim(da_respvec, stim_coord='stim', fold_coord='stim_occ', trial_dim='trials',
+                cell_dim='cells', alpha=1.0, chunk_size=32, n_jobs=1):
+    """Decodes `stim` from response vectors, w/ leave-one-repeat-out cross-validation.
+
+    Each fold holds out all trials w/ one value of `fold_coord` (by default the n-th
+    occurrence of every stimulus), so folds are stratified by stimulus. All dims other than
+    `trial_dim` and `cell_dim` (e.g. 'time', 'acq') are decoded independently.
+
+    NaNs (e.g. cells w/o data at a timepoint) are set to 0 before decoding.
+
+    Args:
+        da_respvec (xr.DataArray): (trials, cells, ...), e.g. `peak_amp` outputs or
+          baseline-corrected trial tensors (for time-resolved decoding)
+        stim_coord (str): coordinate along `trial_dim` w/ class labels
+        fold_coord (str): coordinate along `trial_dim` defining cross-validation folds
+        trial_dim (str): trial dimension name
+        cell_dim (str): cell dimension name
+        alpha (float): ridge penalty
+        chunk_size (int): # of timepoints/acquisitions per parallel task
+        n_jobs (int): # of joblib workers
+
+    Returns:
+        ds_decode (xr.Dataset): w/ data variables `accuracy` (...) and `confusion`
+          (..., true_stim, pred_stim), where confusion holds trial counts
+
+    Examples:
+        Time-resolved decoding::
+
+            >>> ds_decode = decode_stim(ds_bc_trials['Fc_zscore'], n_jobs=8)
+            >>> ds_decode['accuracy'].plot()
+    """
+    labels, classes = pd.factorize(da_respvec[stim_coord].to_numpy())
+    folds, _ = pd.factorize(da_respvec[fold_coord].to_numpy())
+    n_classes = classes.size
+
+    batch_dims = [d for d in da_respvec.dims if d not in (trial_dim, cell_dim)]
+    da = da_respvec.transpose(*batch_dims, trial_dim, cell_dim)
+    batch_shape = tuple(da.sizes[d] for d in batch_dims)
+    X = da.to_numpy().reshape(-1, da.sizes[trial_dim], da.sizes[cell_dim])
+
+    chunks = [slice(i, min(i + chunk_size, X.shape[0])) for i in range(0, X.shape[0],
+                                                                      chunk_size)]
+    results = Parallel(n_jobs=n_jobs)(
+            delayed(_decode_chunk)(X[sl], labels, folds, n_classes, alpha) for sl in chunks)
+    predictions = np.concatenate(results, axis=0)              # (batch, trials)
+
+    accuracy = (predictions == labels).mean(axis=-1)
+
+    # confusion counts, from one bincount over (batch, true, pred) codes
+    n_batch = predictions.shape[0]
+    codes = (np.arange(n_batch)[:, None] * n_classes + labels) * n_classes + predictions
+    confusion = np.bincount(codes.ravel(), minlength=n_batch * n_classes * n_classes)
+    confusion = confusion.reshape(n_batch, n_classes, n_classes)
+
+    coords = {d: da[d].to_numpy() for d in batch_dims if d in da.coords}
+    coords.update(true_stim=np.asarray(classes), pred_stim=np.asarray(classes))
+
+    ds_decode = xr.Dataset(
+            data_vars=dict(
+                    accuracy=(batch_dims, accuracy.reshape(batch_shape)),
+                    confusion=([*batch_dims, 'true_stim', 'pred_stim'],
+                               confusion.reshape(*batch_shape, n_classes, n_classes)),
+                    ),
+            coords=coords,
+            attrs=da_respvec.attrs.copy()
+            )
+    ds_decode.attrs['decoding.alpha'] = alpha
+    ds_decode.attrs['decoding.fold_coord'] = fold_coord
+    ds_decode.attrs['decoding.chance'] = 1 / n_classes
+    return ds_decode
@@ -0,0 +1,120 @@
+"""Low-dimensional projections (PCA) of (trials, cells, time) datasets, for population
+trajectories.
+
+PCA is fit on trial-averaged responses w/ a randomized SVD of the (stim * time, cells)
+matrix, so no (cells, cells) covariance matrix is ever formed. All trials and timepoints are
+then projected w/ a single batched matrix product.
+"""
+
+import numpy as np
+import xarray as xr
+
+
+def fit_trial_pca(da_trials, n_components=10, stim_coord='stim', time_win=None,
+                  cell_dim='cells', time_dim='time', dtype=np.float32, n_oversamples=10,
+                  n_iter=4, random_state=0):
+    """Fits PCA (over cells) to trial-averaged responses, w/ randomized SVD.
+
+    Args:
+        da_trials (xr.DataArray): (trials, cells, time) data, from
+          `xrsa.trials.timeseries_2_trials` (a single data variable)
+        n_components (int): # of principal components
+        stim_coord (str): trials are averaged by this coordinate before fitting
+        time_win (tuple): optional (start, stop) time range used for fitting
+        cell_dim (str): cell dimension name
+        time_dim (str): time dimension name
+        dtype (np.dtype): computation dtype
+        n_oversamples (int): see `sklearn.utils.extmath.randomized_svd`
+        n_iter (int): see `sklearn.utils.extmath.randomized_svd`
+        random_state (int): random seed
+
+    Returns:
+        ds_pca (xr.Dataset): w/ data variables `components` (pc, cells), `mean` (cells),
+          `explained_variance` (pc) and `explained_variance_ratio` (pc)
+    """
+    from sklearn.utils.extmath import randomized_svd
+
+    da_fit = da_trials
+    if time_win is not None:
+        da_fit = da_fit.sel({time_dim: slice(*time_win)})
+
+    da_mean = da_fit.groupby(stim_coord).mean()
+    X = (da_mean
+         .transpose(..., cell_dim)
+         .to_numpy()
+         .reshape(-1, da_mean.sizes[cell_dim])
+         .astype(dtype, copy=False))
+    X = X[np.isfinite(X).all(axis=1)]
+
+    mean = X.mean(axis=0, dtype=np.float64).astype(dtype)
+    Xc = X - mean
+
+    U, S, Vt = randomized_svd(Xc, n_components=n_components, n_oversamples=n_oversamples,
+                              n_iter=n_iter, random_state=random_state)
+
+    n_samples = Xc.shape[0]
+    explained_variance = S ** 2 / (n_samples - 1)
+    total_variance = np.einsum('ij,ij->', Xc, Xc, dtype=np.float64) / (n_samples - 1)
+
+    ds_pca = xr.Dataset(
+            data_vars=dict(
+                    components=(['pc', cell_dim], Vt),
+                    mean=([cell_dim], mean),
+                    explained_variance=(['pc'], explained_variance),
+                    explained_variance_ratio=(['pc'], explained_variance / total_variance),
+                    ),
+            coords={'pc': np.arange(n_components),
+                    cell_dim: da_trials[cell_dim].to_numpy()}
+            )
+    ds_pca.attrs['pca.stim_coord'] = stim_coord
+    if time_win is not None:
+        ds_pca.attrs['pca.time_win'] = time_win
+    return ds_pca
+
+
+def _project(x, mean, components):
+    """(..., cells) -> (..., pc), as a single matmul (in the dtype of `components`)."""
+    return np.matmul(np.asarray(x, dtype=components.dtype) - mean, components.T)
+
+
+def project_trials(da_trials, ds_pca, cell_dim='cells'):
+    """Projects all trials and timepoints onto fitted principal components.
+
+    Args:
+        da_trials (Union[xr.Dataset, xr.DataArray]): (trials, cells, time) data
+        ds_pca (xr.Dataset): from `fit_trial_pca`
+        cell_dim (str): cell dimension name
+
+    Returns:
+        da_proj (Union[xr.Dataset, xr.DataArray]): `cell_dim` replaced by `pc`; all other
+          dims and coords (including the `trials` MultiIndex) are kept
+    """
+    components = ds_pca['components'].transpose('pc', cell_dim).to_numpy()
+    mean = ds_pca['mean'].to_numpy()
+
+    da_proj = xr.apply_ufunc(
+            _project,
+            da_trials,
+            input_core_dims=[[cell_dim]],
+            output_core_dims=[['pc']],
+            kwargs=dict(mean=mean.astype(components.dtype),
+                        components=components),
+            keep_attrs=True)
+    return da_proj.assign_coords(pc=ds_pca['pc'].to_numpy())
+
+
+def trial_pca(da_trials, n_components=10, stim_coord='stim', time_win=None, **kwargs):
+    """Fits PCA on trial-averaged responses, and projects all trials.
+
+    Examples:
+        >>> da_traj, ds_pca = trial_pca(ds_bc_trials['Fc_zscore'], n_components=3,
+        ...                             time_win=(0, 5))
+        >>> da_traj.sel(pc=[0, 1]).mean('time')
+
+    Returns:
+        da_proj (xr.DataArray): (trials, time, pc) trajectories
+        ds_pca (xr.Dataset): fitted PCA, see `fit_trial_pca`
+    """
+    ds_pca = fit_trial_pca(da_trials, n_components=n_components, stim_coord=stim_coord,
+                           time_win=time_win, **kwargs)
+    return project_trials(da_trials, ds_pca), ds_pca
@@ -1,16 +1,207 @@
+"""Representational dissimilarity matrices (RDMs) from response vectors.
+
+Pairwise distances are computed by batched kernels from a registry (`DISTANCE_KERNELS`),
+which take stacks of shape `(..., n, features)` and return `(..., n, n)` in a few BLAS calls:
+
+  - 'correlation', 'cosine', 'euclidean', 'sqeuclidean'
+  - 'mahalanobis', w/ one precision matrix `VI` shared by all batches (default: pseudo-inverse
+    of the covariance of all rows)
+
+Other metrics fall back to `sklearn.metrics.pairwise_distances`, one batch at a time. New
+kernels can be added w/ `register_distance_kernel`. BLAS threads can be capped w/ `n_threads`
+(via threadpoolctl), e.g. to avoid oversubscription when RDMs are computed in process pools.
+"""
+
+import contextlib
+import inspect
 import xarray as xr
-from sklearn import metrics
 import pandas as pd
 import numpy as np
+import ryeutils
+from ryeutils.profiling import profiled
+from . import respvec
+from .utils import select_data_vars
+
+try:
+    from threadpoolctl import threadpool_limits
+except ImportError:
+    threadpool_limits = None
+
+DISTANCE_KERNELS = {}
+
+
+def register_distance_kernel(name):
+    """Decorator adding a batched kernel `f(x, dtype=None, **kwargs)` to `DISTANCE_KERNELS`.
+
+    Kernels get `x` w/ shape (..., n, features) and return distances w/ shape (..., n, n).
+
+    Examples:
+        >>> @register_distance_kernel('cityblock')
+        ... def _cityblock_distance(x, dtype=None):
+        ...     return np.abs(x[..., :, None, :] - x[..., None, :, :]).sum(axis=-1)
+    """
+    def decorator(func):
+        DISTANCE_KERNELS[name] = func
+        return func
+    return decorator
+
+
+@contextlib.contextmanager
+def blas_threads(n_threads=None):
+    """Limits BLAS threads to `n_threads` inside the context (no-op if None)."""
+    if n_threads is None:
+        yield
+    elif threadpool_limits is None:
+        raise ImportError("threadpoolctl is required to set `n_threads`.")
+    else:
+        with threadpool_limits(limits=n_threads, user_api='blas'):
+            yield
+
+
+def _kernel_input(x, dtype):
+    """`x` as a floating point array, rows centered on the mean finite row of each batch.
+
+    Centering doesn't change euclidean/mahalanobis distances, but keeps the expanded form
+    `|a|^2 + |b|^2 - 2 a.b` well conditioned (especially in float32). Rows w/ NaNs are left
+    out of the mean, so they only affect their own distances.
+    """
+    x = np.asarray(x)
+    x = x.astype(ryeutils.resolve_dtype(x, dtype=dtype), copy=True)
+    finite_rows = np.isfinite(x).all(axis=-1, keepdims=True)
+    n_finite = finite_rows.sum(axis=-2, keepdims=True)
+    row_sum = np.where(finite_rows, x, 0).sum(axis=-2, keepdims=True)
+    x -= row_sum / np.maximum(n_finite, 1).astype(x.dtype)
+    return x
+
+
+def _sq_distances_from_gram(gram, sq_norms):
+    """Squared distances `q_i + q_j - 2 g_ij`, clipped to >= 0 w/ a zero diagonal."""
+    d2 = sq_norms[..., :, None] + sq_norms[..., None, :] - 2 * gram
+    np.maximum(d2, 0, out=d2)
+    diag = np.einsum('...ii->...i', d2)
+    diag[np.isfinite(diag)] = 0
+    return d2
+
+
+@register_distance_kernel('correlation')
+def _batched_correlation_distance(x, dtype=None):
+    """Correlation distance between rows of x (..., n, features), for all batches at once."""
+    return 1 - ryeutils.pearson_corr(x, nan_policy='propagate', dtype=dtype)
+
+
+@register_distance_kernel('cosine')
+def _batched_cosine_distance(x, dtype=None):
+    """Cosine distance between rows (rows of zeros have distance 1 to all others)."""
+    x = np.asarray(x)
+    x = x.astype(ryeutils.resolve_dtype(x, dtype=dtype), copy=False)
+    norm = np.sqrt(np.einsum('...ij,...ij->...i', x, x))
+    norm[norm == 0] = 1
+    z = x / norm[..., None]
+    dist = 1 - np.matmul(z, np.swapaxes(z, -1, -2))
+    np.clip(dist, 0, 2, out=dist)
+    diag = np.einsum('...ii->...i', dist)
+    diag[np.isfinite(diag)] = 0
+    return dist
+
+
+@register_distance_kernel('sqeuclidean')
+def _batched_sqeuclidean_distance(x, dtype=None):
+    """Squared euclidean distance between rows."""
+    x = _kernel_input(x, dtype)
+    gram = np.matmul(x, np.swapaxes(x, -1, -2))
+    return _sq_distances_from_gram(gram, np.einsum('...ii->...i', gram).copy())
+
+
+@register_distance_kernel('euclidean')
+def _batched_euclidean_distance(x, dtype=None):
+    """Euclidean distance between rows."""
+    return np.sqrt(_batched_sqeuclidean_distance(x, dtype=dtype))
+
+
+def shared_precision_matrix(x, dtype=None):
+    """Pseudo-inverse of the feature covariance, pooled over all rows of all batches.
+
+    Args:
+        x (np.ndarray): shape (..., n, features)
+        dtype (np.dtype): output dtype
+
+    Returns:
+        (np.ndarray): precision matrix, shape (features, features)
+    """
+    x = np.asarray(x)
+    rows = x.reshape(-1, x.shape[-1]).astype(np.float64)
+    rows = rows[np.isfinite(rows).all(axis=1)]
+    cov = np.atleast_2d(np.cov(rows, rowvar=False))
+    return np.linalg.pinv(cov, hermitian=True).astype(ryeutils.resolve_dtype(x, dtype=dtype))
+
+
+@register_distance_kernel('mahalanobis')
+def _batched_mahalanobis_distance(x, dtype=None, VI=None):
+    """Mahalanobis distance between rows, w/ the same precision matrix `VI` for all batches.
+
+    If `VI` is None, it's estimated once from all rows (see `shared_precision_matrix`).
+    """
+    if VI is None:
+        VI = shared_precision_matrix(x, dtype=dtype)
+    x = _kernel_input(x, dtype)
+    # one (rows, features) @ (features, features) product for all batches
+    xv = (x.reshape(-1, x.shape[-1]) @ np.asarray(VI, dtype=x.dtype)).reshape(x.shape)
+    gram = np.matmul(xv, np.swapaxes(x, -1, -2))
+    d2 = _sq_distances_from_gram(gram, np.einsum('...ij,...ij->...i', xv, x))
+    return np.sqrt(d2)
+
+
+def _allow_nan_kwargs():
+    """`pairwise_distances` kwargs allowing NaNs (`force_all_finite` was renamed
+    `ensure_all_finite` in scikit-learn 1.6, and removed in 1.8)."""
+    from sklearn.metrics import pairwise_distances
+
+    params = inspect.signature(pairwise_distances).parameters
+    return {'ensure_all_finite' if 'ensure_all_finite' in params else 'force_all_finite': False}
+
+
+def _sklearn_pairwise_distances(x, metric, dtype=None, **kwargs):
+    """Fallback for unregistered metrics: `sklearn.metrics.pairwise_distances` per batch."""
+    from sklearn import metrics
+
+    kwargs = {**_allow_nan_kwargs(), **kwargs}
+
+    x = np.asarray(x)
+    x = x.astype(ryeutils.resolve_dtype(x, dtype=dtype), copy=False)
+    batches = x.reshape(-1, *x.shape[-2:])
+    dist = np.stack([metrics.pairwise_distances(b, metric=metric, **kwargs) for b in batches])
+    return dist.reshape(*x.shape[:-1], x.shape[-2]).astype(x.dtype, copy=False)
+
+
+def batched_pairwise_distances(x, metric='correlation', dtype=None, n_threads=None,
+                               **kwargs):
+    """Pairwise distances between rows of x (..., n, features), for all batches at once.
+
+    Args:
+        x (np.ndarray): shape (..., n, features)
+        metric (str): a key of `DISTANCE_KERNELS`, otherwise any metric accepted by
+          `sklearn.metrics.pairwise_distances`
+        dtype (np.dtype): computation and output dtype (default: float64, or float32 if the
+          inputs are float32)
+        n_threads (int): max. # of BLAS threads (default: no limit)
+        **kwargs: passed to the kernel (e.g. `VI` for 'mahalanobis')
+
+    Returns:
+        (np.ndarray): distances, shape (..., n, n)
+    """
+    with blas_threads(n_threads):
+        if metric in DISTANCE_KERNELS:
+            return DISTANCE_KERNELS[metric](x, dtype=dtype, **kwargs)
+        return _sklearn_pairwise_distances(x, metric, dtype=dtype, **kwargs)
 
 
 def compute_rdm(ds_respvec, metric='correlation', input_dim_ord=None,
-                output_dim_names=None, output_suffixes=None):
+                output_dim_names=None, output_suffixes=None, n_threads=None, **metric_kws):
     """Compute representation dissimilarity matrix w/ specified dimension order.
 
     Args:
         ds_respvec (Union[xr.Dataset, xr.DataArray]):
-        metric (str): pairwise distance metric (see `sklearn.metrics.pairwise_distances`)
+        metric (str): pairwise distance metric (see `batched_pairwise_distances`)
         input_dim_ord (List[str]): input dimension order
           - if input_dim_ord has dims (trials, cells), then output_dim_ord has dims (trials, trials)
         output_dim_names (List[str]): output dimension names for RDM with shape `(input_dim_ord[0],
@@ -18,6 +209,8 @@ def compute_rdm(ds_respvec, metric='correlation', input_dim_ord=None,
         output_suffixes (List[str]): suffixes used to generate output dim. names
             - default ['_row', '_col']
             - used only if output_dim_names = `None`
+        n_threads (int): max. # of BLAS threads
+        **metric_kws: passed to the distance kernel (e.g. `VI` for 'mahalanobis')
     Returns:
         ds_rdm (Union[xr.Dataset, xr.DataArray]):
 
@@ -38,12 +231,11 @@ def compute_rdm(ds_respvec, metric='correlation', input_dim_ord=None,
     # print(output_dim_names)
 
     ds_rdm = xr.apply_ufunc(
-            metrics.pairwise_distances,
+            batched_pairwise_distances,
             ds_respvec,
             input_core_dims=[input_dim_ord],
             output_core_dims=[output_dim_names],
-            vectorize=True,
-            kwargs=dict(metric=metric, force_all_finite=False),
+            kwargs=dict(metric=metric, n_threads=n_threads, **metric_kws),
             keep_attrs=True)
 
     # copy coordinates along the 1st intput dimension to the output dimensions
@@ -82,10 +274,15 @@ def check_input_to_respvec_rdm(ds_input):
     #     'stim' in ds_trials['trials'].coords.keys()
 
 
-def compute_trial_respvec_rdm(ds_respvec, metric='correlation'):
+@profiled
+def compute_trial_respvec_rdm(ds_respvec, metric='correlation', data_vars=None, dtype=None,
+                              n_threads=None, **metric_kws):
     """Compute RDM w/ dims (..., trial_row, trial_col) from a (..., cells, time) dataset.
 
-    `ds_respvec` must have dimension `trials`.
+    `ds_respvec` must have dimension `trials`. Only `data_vars` (default: all) are used.
+    Distances are computed for all leading dims at once w/ `batched_pairwise_distances`
+    (`n_threads` BLAS threads, `metric_kws` passed to the kernel), in `dtype`, which is also
+    the dtype of the returned RDMs (default: float64, or float32 if the inputs are float32).
 
     If `trials` is a MultiIndex, copy all the MultiIndex columns to `trial_row` and `trial_col`
     with prefixes "row_" and "col_".
@@ -144,17 +341,27 @@ def compute_trial_respvec_rdm(ds_respvec, metric='correlation'):
             distance_metric:             correlation
 
     """
+    ds_respvec = select_data_vars(ds_respvec, data_vars=data_vars, dtype=dtype)
+
     # compute RDM with dims (..., trial_row, trial_col)
     ds_rdm = xr.apply_ufunc(
-            metrics.pairwise_distances,
+            batched_pairwise_distances,
             ds_respvec,
             input_core_dims=[['trials', 'cells']],
             output_core_dims=[['trial_row', 'trial_col']],
-            vectorize=True,
-            kwargs=dict(metric=metric, force_all_finite=False),
+            kwargs=dict(metric=metric, dtype=dtype, n_threads=n_threads, **metric_kws),
             keep_attrs=True
             )
 
+    ds_rdm = _copy_trial_coords_to_rdm(ds_rdm, ds_respvec)
+
+    ds_rdm.attrs['rdm.metric'] = metric
+
+    return ds_rdm
+
+
+def _copy_trial_coords_to_rdm(ds_rdm, ds_respvec):
+    """Copies coordinates along `trials` in `ds_respvec` to `trial_row` and `trial_col`."""
     if ds_respvec.indexes.is_multi('trials'):
         # copy all multiindex columns to trial_row and trial_col
         mi = ds_respvec['trials'].to_index()
@@ -191,8 +398,56 @@ def compute_trial_respvec_rdm(ds_respvec, metric='correlation'):
                 col_trial_idx=('trial_col', trial_idx)
                 )
 
-    ds_rdm.attrs['rdm.metric'] = metric
+    return ds_rdm
+
 
+@profiled
+def compute_time_resolved_rdm(ds_trials, window_width, window_stride, time_win=None,
+                              metric='correlation', dtype=None, data_vars=None,
+                              n_threads=None, **metric_kws):
+    """Compute RDMs w/ dims (..., time, trial_row, trial_col) on sliding time windows.
+
+    Window means are computed for all windows at once from prefix sums
+    (`xrsa.respvec.sliding_window_mean`), and all windows are passed through a single call
+    of the batched distance kernel for `metric` (see `batched_pairwise_distances`).
+
+    Args:
+        ds_trials (Union[xr.Dataset, xr.DataArray]): (trials, cells, time) dataset, e.g. from
+          `xrsa.trials.baseline_correct_trials`
+        window_width (float): window width (s)
+        window_stride (float): step between windows (s)
+        time_win (tuple): optional (start, stop) time range to sweep
+        metric (str): pairwise distance metric
+        dtype (np.dtype): computation and output dtype (default: float64, or float32 if the
+          inputs are float32)
+        data_vars (list): data variables to compute RDMs for (default: all)
+        n_threads (int): max. # of BLAS threads
+        **metric_kws: passed to the distance kernel (e.g. `VI` for 'mahalanobis')
+
+    Returns:
+        ds_rdm (Union[xr.Dataset, xr.DataArray]): RDMs, `time` is the window center, w/
+          coordinates `win_start` and `win_stop`
+
+    Examples:
+        Full-trial sweep, 250 ms windows at a 50 ms stride::
+
+            >>> ds_rdm_t = compute_time_resolved_rdm(ds_bc_trials, 0.25, 0.05,
+            ...                                      dtype=np.float32)
+    """
+    ds_trials = select_data_vars(ds_trials, data_vars=data_vars)
+    ds_win = respvec.sliding_window_mean(ds_trials, window_width, window_stride,
+                                         time_win=time_win)
+
+    ds_rdm = xr.apply_ufunc(
+            batched_pairwise_distances,
+            ds_win,
+            input_core_dims=[['trials', 'cells']],
+            output_core_dims=[['trial_row', 'trial_col']],
+            kwargs=dict(metric=metric, dtype=dtype, n_threads=n_threads, **metric_kws),
+            keep_attrs=True
+            )
+    ds_rdm = _copy_trial_coords_to_rdm(ds_rdm, ds_win)
+    ds_rdm.attrs['rdm.metric'] = metric
     return ds_rdm
 
 
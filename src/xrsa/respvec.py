@@ -1,20 +1,61 @@
 import xarray as xr
 import numpy as np
 from typing import Union, List
+from .utils import select_data_vars, match_float_dtypes
 
 
-def filter_cells_by_coord(ds_respvec, good_xid, xid_coord='xid0'):
+def cell_filter_positions(ds_respvec, filters, cell_dim='cells'):
+    """Integer positions along `cell_dim` of cells passing all `filters`.
+
+    Args:
+        ds_respvec (Union[xr.Dataset, xr.DataArray]): has 1-D coordinates along `cell_dim`
+        filters (dict): {coord_name: allowed values, or a function of the coordinate values
+          returning a boolean mask}; cells must pass all filters
+        cell_dim (str): cell dimension name
+
+    Returns:
+        (np.ndarray): integer positions of kept cells
+    """
+    keep = np.ones(ds_respvec.sizes[cell_dim], dtype=bool)
+    for coord_name, allowed in filters.items():
+        if ds_respvec[coord_name].dims != (cell_dim,):
+            raise ValueError(f"Coord `{coord_name}` must be 1-D along `{cell_dim}`.")
+        values = ds_respvec[coord_name].to_numpy()
+        if callable(allowed):
+            keep &= np.asarray(allowed(values), dtype=bool)
+        else:
+            keep &= np.isin(values, np.atleast_1d(allowed))
+    return np.flatnonzero(keep)
+
+
+def filter_cells_by_coord(ds_respvec, good_xid=None, xid_coord='xid0', filters=None,
+                          cell_dim='cells'):
     """Filter cells by xid_coord values.
 
+    Cells are selected w/ `isel` on integer positions (see `cell_filter_positions`), so
+    dtypes are preserved and no mask is broadcast over the other dimensions.
+
     Args:
         ds_respvec (Union[xr.Dataset, xr.DataArray]): must contain `xid_coord` as a coordinate
         good_xid (Union[np.array, List]): cluster IDs to include
         xid_coord (str): name of cell coordinate to filter
+        filters (dict): additional filters, applied together w/ `good_xid`, e.g.
+          `{'iscell': 1, 'cellprob': lambda x: x > 0.5}`
+        cell_dim (str): cell dimension name
 
     Returns:
         ds_respvec_filt (Union[xr.Dataset, xr.DataArray]): ds_respvec w/ filtered cells
+
+    Examples:
+        >>> ds_filt = filter_cells_by_coord(ds_respvec, good_xid=[1, 3], xid_coord='xid0')
+        >>> ds_filt = filter_cells_by_coord(ds_suite2p_outputs, filters={'iscell': 1})
     """
-    ds_respvec_filt = ds_respvec.where(ds_respvec[xid_coord].isin(good_xid), drop=True)
+    filters = {} if filters is None else dict(filters)
+    if good_xid is not None:
+        filters[xid_coord] = good_xid
+
+    positions = cell_filter_positions(ds_respvec, filters, cell_dim=cell_dim)
+    ds_respvec_filt = ds_respvec.isel({cell_dim: positions})
     return ds_respvec_filt
 
 
@@ -39,9 +80,14 @@ def filter_cells_by_attr(ds_respvec, attr_name='good_xid', xid_coord='xid0'):
 
 def peak_amp(ds_trials, peak_win, peak_method='mean', peak_quantile=None,
              subtract_baseline=False,
-             baseline_win=None, baseline_method='mean', baseline_quantile=None):
-    """To perform baseline subtraction, baseline_win must be set."""
+             baseline_win=None, baseline_method='mean', baseline_quantile=None,
+             data_vars=None, dtype=None):
+    """To perform baseline subtraction, baseline_win must be set.
 
+    Only `data_vars` (default: all) are kept, cast to `dtype` (default: unchanged), see
+    `xrsa.utils.select_data_vars`.
+    """
+    ds_trials = select_data_vars(ds_trials, data_vars=data_vars, dtype=dtype)
 
     ds_trials_peak = ds_trials.sel(time=slice(*peak_win)).copy(deep=True)
 
@@ -100,4 +146,63 @@ def peak_amp(ds_trials, peak_win, peak_method='mean', peak_quantile=None,
         if peak_method == 'quantile':
             ds_peak_amp.attrs['respvec.baseline_method'] = baseline_method
 
-    return ds_peak_amp
+    return match_float_dtypes(ds_peak_amp, ds_trials)
+
+
+def _window_nanmean(arr, starts, width):
+    """Means over windows [start, start + width) along the last axis, from prefix sums."""
+    valid = np.isfinite(arr)
+    zero_pad = np.zeros(arr.shape[:-1] + (1,))
+    csum = np.concatenate([zero_pad, np.cumsum(np.where(valid, arr, 0), axis=-1)], axis=-1)
+    ccount = np.concatenate([zero_pad, np.cumsum(valid, axis=-1)], axis=-1)
+
+    win_sum = csum[..., starts + width] - csum[..., starts]
+    win_count = ccount[..., starts + width] - ccount[..., starts]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (win_sum / win_count).astype(arr.dtype, copy=False)
+
+
+def sliding_window_mean(ds_trials, window_width, window_stride, time_win=None, time_dim='time'):
+    """Means of `ds_trials` over sliding time windows, computed from prefix sums.
+
+    All windows are computed at once from cumulative sums along `time_dim` (NaNs are
+    ignored), instead of re-running `peak_amp` once per window.
+
+    Args:
+        ds_trials (Union[xr.Dataset, xr.DataArray]): trial dataset w/ dimension `time_dim`
+        window_width (float): window width, in units of `time_dim` (i.e. seconds)
+        window_stride (float): step between window starts, in units of `time_dim`
+        time_win (tuple): optional (start, stop) time range to sweep
+        time_dim (str): time dimension name
+
+    Returns:
+        ds_win (Union[xr.Dataset, xr.DataArray]): `time_dim` now indexes windows, w/
+          coordinates `time` (window centers), `win_start` and `win_stop`
+    """
+    if time_win is not None:
+        ds_trials = ds_trials.sel({time_dim: slice(*time_win)})
+
+    t = ds_trials[time_dim].to_numpy()
+    dt = np.median(np.diff(t))
+    width = max(int(round(window_width / dt)), 1)
+    stride = max(int(round(window_stride / dt)), 1)
+    starts = np.arange(0, t.size - width + 1, stride)
+
+    ds_win = xr.apply_ufunc(
+            _window_nanmean,
+            ds_trials,
+            input_core_dims=[[time_dim]],
+            output_core_dims=[['_window']],
+            exclude_dims={time_dim},
+            kwargs=dict(starts=starts, width=width),
+            keep_attrs=True)
+
+    ds_win = (ds_win
+              .rename({'_window': time_dim})
+              .assign_coords({time_dim: (t[starts] + t[starts + width - 1]) / 2,
+                              'win_start': (time_dim, t[starts]),
+                              'win_stop': (time_dim, t[starts + width - 1])})
+              )
+    ds_win.attrs['respvec.window_width'] = window_width
+    ds_win.attrs['respvec.window_stride'] = window_stride
+    return ds_win
@@ -5,12 +5,15 @@ import numpy as np
 import xarray as xr
 import pandas as pd
 import ryeutils
+from ryeutils.profiling import profiled
+from .utils import select_data_vars, match_float_dtypes
 
 xr.set_options(keep_attrs=True)
 
 
+@profiled
 def timeseries_2_trials(ds_timeseries, stim_ict, stim_list, trial_ts, index_stimuli=False,
-                        stimulus_index_keys=None):
+                        stimulus_index_keys=None, data_vars=None, dtype=None):
     """Converts timeseries dataset (cells x time) to a (trials, cells, time) tensor dataset.
 
     Args:
@@ -23,17 +26,23 @@ def timeseries_2_trials(ds_timeseries, stim_ict, stim_list, trial_ts, index_stim
         stimulus_index_keys (list): which keys to keep from indexed stimuli returned by
             `ryeutils.index_stimuli`.  Default value is `['stim', 'stim_occ', 'run_idx',
             'idx_in_run', 'run_occ']`. Only used if `index_stimuli=True`.
+        data_vars (list): data variables to keep (default: all). Derived variables ('Fc',
+            'F_zscore', 'Fc_zscore') missing from `ds_timeseries` are recomputed from 'F' and
+            'Fneu' (see `xrsa.utils.select_data_vars`).
+        dtype (np.dtype): dtype of the trial tensors (e.g. np.float32, default: unchanged)
 
     Returns:
         xr.Dataset: (trials x cells x time) with `stim_ict` and `stim_list` stored in `attrs`
 
     """
+    ds_timeseries = select_data_vars(ds_timeseries, data_vars=data_vars, dtype=dtype)
 
     trials = []
 
     # split cells x time xr.Dataset by trials, with stimulus onset at time=0
     for trial_idx, ict in enumerate(stim_ict):
-        ds0 = ds_timeseries.interp(time=trial_ts + ict)
+        # `interp` returns float64, so cast each trial before concatenating
+        ds0 = select_data_vars(ds_timeseries.interp(time=trial_ts + ict), dtype=dtype)
         ds0 = ds0.assign_coords(
                 trials=trial_idx,
                 time=trial_ts
@@ -64,8 +73,9 @@ def timeseries_2_trials(ds_timeseries, stim_ict, stim_list, trial_ts, index_stim
     return ds_trials0
 
 
+@profiled
 def baseline_correct_trials(ds_trials, baseline_win=(-5, 0), baseline_method='quantile',
-                            baseline_quantile=0.5):
+                            baseline_quantile=0.5, data_vars=None, dtype=None):
     """Baseline-corrects trials by subtracting the mean/baseline quantile of the baseline window.
 
     Args:
@@ -73,10 +83,13 @@ def baseline_correct_trials(ds_trials, baseline_win=(-5, 0), baseline_method='qu
         baseline_win (tuple): time window of baseline
         baseline_method (str): 'mean' or 'quantile'
         baseline_quantile (float): used only if baseline_method='quantile'
+        data_vars (list): data variables to keep (default: all)
+        dtype (np.dtype): output dtype (default: unchanged)
 
     Returns:
         ds_bc_trials (xr.Dataset): baseline-corrected dataset, with parameters added to `attrs`
     """
+    ds_trials = select_data_vars(ds_trials, data_vars=data_vars, dtype=dtype)
 
     if baseline_method == 'quantile':
         ds_baseline = (ds_trials
@@ -90,7 +103,7 @@ def baseline_correct_trials(ds_trials, baseline_win=(-5, 0), baseline_method='qu
                        .sel(time=slice(*baseline_win))
                        .mean(dim='time'))
 
-    ds_bc_trials = ds_trials - ds_baseline
+    ds_bc_trials = match_float_dtypes(ds_trials - ds_baseline, ds_trials)
 
     # add information about baselining to attrs
     ds_bc_trials.attrs['baseline.baseline_win'] = baseline_win
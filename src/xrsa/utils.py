@@ -1,7 +1,85 @@
+import numpy as np
 import xarray as xr
 
+from external.suite2p.preprocess import DERIVED_VARS, neuropil_correct, zscore_rows
+
 
 def convert_stim_2_odor(ds, coord_name):
     stim_list = ds[coord_name].values
     odor_list = [item.split(' @ ')[0] for item in stim_list]
     return ds.assign_coords({coord_name: (ds[coord_name].dims[0], odor_list)})
+
+
+def derive_data_var(ds, name, time_dim='time'):
+    """Recomputes a derived suite2p variable ('Fc', 'F_zscore' or 'Fc_zscore') from 'F' and
+    'Fneu', w/ `neucoeff` from `ds.attrs['suite2p.neucoeff']` (default 0.7).
+
+    Uses the same helpers as `external.suite2p.convert.outputs_2_xarray_base`
+    (`external.suite2p.preprocess.neuropil_correct` and `zscore_rows`), in the dtype of 'F', so
+    derived values match the stored ones. Z-scores use statistics over `time_dim`, so they can
+    only be derived from (cells, time) timeseries, not from trial tensors.
+    """
+    if name not in DERIVED_VARS:
+        raise ValueError(f"Cannot derive `{name}`, must be one of {DERIVED_VARS}.")
+    if name.endswith('_zscore') and 'trials' in ds.dims:
+        raise ValueError(f"`{name}` must be derived from (cells, time) timeseries, "
+                         f"before splitting into trials.")
+
+    dtype = ds['F'].dtype
+    if name.startswith('Fc'):
+        neucoeff = ds.attrs.get('suite2p.neucoeff', 0.7)
+        da = xr.apply_ufunc(neuropil_correct, ds['F'], ds['Fneu'],
+                            kwargs=dict(neucoeff=neucoeff, dtype=dtype))
+    else:
+        da = ds['F']
+
+    if name.endswith('_zscore'):
+        def _zscore(X):
+            return zscore_rows(X.reshape(-1, X.shape[-1]), dtype=dtype).reshape(X.shape)
+
+        da = xr.apply_ufunc(_zscore, da, input_core_dims=[[time_dim]],
+                            output_core_dims=[[time_dim]]).transpose(*da.dims)
+    return da.rename(name)
+
+
+def select_data_vars(ds, data_vars=None, dtype=None, time_dim='time'):
+    """Keeps only `data_vars` (derived on demand if missing), cast to `dtype`.
+
+    Args:
+        ds (Union[xr.Dataset, xr.DataArray]): dataset (DataArrays are only cast)
+        data_vars (Sequence[str]): data variables to keep (default: all); missing variables
+          in `DERIVED_VARS` are recomputed w/ `derive_data_var`
+        dtype (np.dtype): dtype of floating point data variables (default: unchanged)
+        time_dim (str): time dimension name, for derived z-scores
+
+    Returns:
+        (Union[xr.Dataset, xr.DataArray])
+    """
+    if isinstance(ds, xr.Dataset) and data_vars is not None:
+        data_vars = [data_vars] if isinstance(data_vars, str) else list(data_vars)
+        missing = [v for v in data_vars if v not in ds.data_vars]
+        if missing:
+            ds = ds.assign({v: derive_data_var(ds, v, time_dim=time_dim) for v in missing})
+        ds = ds[data_vars]
+
+    if dtype is not None:
+        if isinstance(ds, xr.DataArray):
+            ds = ds.astype(dtype, copy=False) if ds.dtype.kind == 'f' else ds
+        else:
+            ds = ds.copy(deep=False)
+            for k in [k for k, v in ds.data_vars.items() if v.dtype.kind == 'f']:
+                ds[k] = ds[k].variable.astype(dtype, copy=False)
+    return ds
+
+
+def match_float_dtypes(ds, ds_like):
+    """Casts floating point data variables of `ds` to the dtype of the same variable in
+    `ds_like` (e.g. to undo float64 promotion by `quantile`)."""
+    if isinstance(ds, xr.DataArray):
+        return ds.astype(ds_like.dtype, copy=False) if ds_like.dtype.kind == 'f' else ds
+    # replace variables only; assigning DataArrays would also reassign (and warn about)
+    # MultiIndex coords
+    ds = ds.copy(deep=False)
+    for k in [k for k in ds.data_vars if k in ds_like.data_vars and ds_like[k].dtype.kind == 'f']:
+        ds[k] = ds[k].variable.astype(ds_like[k].dtype, copy=False)
+    return ds
@@ -0,0 +1,3 @@
+from ryeutils.lazy import lazy_submodules
+
+__getattr__, __dir__, __all__ = lazy_submodules(__name__, ['rdm', 'respvec', 'clusters'])
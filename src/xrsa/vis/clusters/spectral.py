@@ -1,5 +1,4 @@
 import matplotlib.pyplot as plt
-import seaborn as sns
 import xarray as xr
 import pandas as pd
 import numpy as np
@@ -15,6 +14,8 @@ def plot_cell_cluster_profiles(df_mean_cell_clusters, df_cell_cluster_counts, st
     Returns:
 
     """
+    import seaborn as sns
+
     fig_biclusters, (ax_spectral_1, ax_spectral_2) = \
         plt.subplots(1, 2, figsize=(12, 6.4))
 
@@ -1,7 +1,15 @@
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+import numpy as np
 import xarray as xr
 import matplotlib.pyplot as plt
+from matplotlib import animation
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.backends.backend_pdf import PdfPages
+from matplotlib.figure import Figure
 import ryeutils
-import seaborn as sns
 from mpl_toolkits.axes_grid1 import ImageGrid
 
 plt.rcParams.update({'pdf.fonttype': 42,
@@ -10,6 +18,8 @@ plt.rcParams.update({'pdf.fonttype': 42,
 
 def plot_rsm_heatmap(da_rsm, row_coord='row_stim', col_coord='col_stim', ax=None, cbar_ax=None,
                      heatmap_kws=None):
+    import seaborn as sns
+
     # ds_rdm_sorted = (da_rsm
     #                  .assign_coords(row_occ=('trial_row', range(da_rsm.dims['trial_row'])),
     #                                 col_occ=('trial_col', range(da_rsm.dims['trial_col']))
@@ -161,3 +171,289 @@ def plot_trial_and_stim_rdms(da_trial_rsm, da_stim_rsm, heatmap_kws=None):
 
     fig.suptitle("")
     return axarr
+
+
+@lru_cache(maxsize=128)
+def _block_ticks(labels):
+    """Stimulus block tick labels and (imshow) locations, cached per stimulus ordering."""
+    tick_labels, tick_locs = ryeutils.main.get_tick_labels_and_locs(list(labels))
+    return tick_labels, tick_locs - 0.5
+
+
+def _rsm_panel_data(da_rsm, row_coord, col_coord):
+    """(values, row_labels, col_labels) of a 2D RSM/RDM, ordered (row, col)."""
+    row_dim, = da_rsm[row_coord].dims
+    col_dim, = da_rsm[col_coord].dims
+    values = da_rsm.transpose(row_dim, col_dim).to_numpy()
+    return (values,
+            tuple(da_rsm[row_coord].to_numpy().tolist()),
+            tuple(da_rsm[col_coord].to_numpy().tolist()))
+
+
+def _draw_rsm(ax, values, row_labels, col_labels, imshow_kws, tick_fontsize):
+    use_imshow_kws = dict(cmap='RdBu_r', vmin=-1, vmax=1, interpolation='nearest')
+    if imshow_kws is not None:
+        use_imshow_kws.update(**imshow_kws)
+    img = ax.imshow(values, **use_imshow_kws)
+
+    col_tick_labels, col_tick_locs = _block_ticks(col_labels)
+    row_tick_labels, row_tick_locs = _block_ticks(row_labels)
+    ax.set_xticks(col_tick_locs, col_tick_labels, rotation=90, fontsize=tick_fontsize)
+    ax.set_yticks(row_tick_locs, row_tick_labels, fontsize=tick_fontsize)
+    return img
+
+
+def plot_rsm_imshow(da_rsm, row_coord='row_stim', col_coord='col_stim', ax=None, cbar_ax=None,
+                    imshow_kws=None, tick_fontsize=10):
+    """Fast version of `plot_rsm_heatmap`: draws the RSM as a single image w/ `ax.imshow`.
+
+    Draws straight from the numpy array (no pandas conversion, no per-cell artists), w/ one
+    tick per stimulus block (see `ryeutils.main.get_tick_labels_and_locs`).
+
+    Args:
+        da_rsm (xr.DataArray): 2D RSM/RDM, w/ coords `row_coord` and `col_coord`
+        row_coord (str): stimulus coordinate along rows
+        col_coord (str): stimulus coordinate along columns
+        ax (plt.Axes): axes to draw in (default: current axes)
+        cbar_ax (plt.Axes): if provided, draw a colorbar in this axes
+        imshow_kws (dict): passed to `ax.imshow` (defaults: cmap='RdBu_r', vmin=-1, vmax=1)
+        tick_fontsize (int): tick label font size
+
+    Returns:
+        ax (plt.Axes)
+    """
+    if ax is None:
+        ax = plt.gca()
+
+    img = _draw_rsm(ax, *_rsm_panel_data(da_rsm, row_coord, col_coord),
+                    imshow_kws=imshow_kws, tick_fontsize=tick_fontsize)
+    if cbar_ax is not None:
+        ax.figure.colorbar(img, cax=cbar_ax)
+    return ax
+
+
+def _render_rsm_panel(values, row_labels, col_labels, title, imshow_kws, figsize, dpi,
+                      tick_fontsize):
+    """Renders one RSM page to an RGBA array (runs in worker processes, no pyplot)."""
+    fig = Figure(figsize=figsize, dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    img = _draw_rsm(ax, values, row_labels, col_labels, imshow_kws, tick_fontsize)
+    fig.colorbar(img, ax=ax, fraction=0.046, pad=0.04)
+    if title is not None:
+        ax.set_title(title)
+    fig.tight_layout()
+    canvas.draw()
+    return np.asarray(canvas.buffer_rgba()).copy()
+
+
+def export_rdm_pdf(da_rdm, filename, panel_dim='acq', row_coord='row_stim',
+                   col_coord='col_stim', title_coord=None, imshow_kws=None, figsize=(8, 8),
+                   dpi=150, tick_fontsize=8, n_jobs=1):
+    """Exports one RSM/RDM panel per index of `panel_dim` to a multi-page PDF.
+
+    With `n_jobs=1`, a single figure is reused and only the image data, ticks and title are
+    updated per page (vector text). With `n_jobs > 1`, panels are rendered to images in
+    parallel processes and embedded as one raster image per page.
+
+    Args:
+        da_rdm (xr.DataArray): RDMs w/ dims (`panel_dim`, row, col)
+        filename (Union[str, Path]): output .pdf file
+        panel_dim (str): dimension to split into pages (e.g. 'acq' or 'time')
+        row_coord (str): stimulus coordinate along rows
+        col_coord (str): stimulus coordinate along columns
+        title_coord (str): coordinate along `panel_dim` used for page titles
+        imshow_kws (dict): passed to `ax.imshow`
+        figsize (tuple): page size (inches)
+        dpi (int): resolution of raster pages (`n_jobs > 1`)
+        tick_fontsize (int): tick label font size
+        n_jobs (int): # of worker processes
+
+    Returns:
+        filename
+    """
+    n_panels = da_rdm.sizes[panel_dim]
+
+    def panel_args(i):
+        da = da_rdm.isel({panel_dim: i})
+        title = str(da[title_coord].item()) if title_coord is not None else None
+        return (*_rsm_panel_data(da, row_coord, col_coord), title)
+
+    with PdfPages(filename) as pdf:
+        if n_jobs == 1:
+            fig = Figure(figsize=figsize)
+            FigureCanvasAgg(fig)
+            ax = fig.add_subplot(111)
+            img, cbar = None, None
+
+            for i in range(n_panels):
+                values, row_labels, col_labels, title = panel_args(i)
+                if img is None or img.get_array().shape != values.shape:
+                    ax.clear()
+                    img = _draw_rsm(ax, values, row_labels, col_labels, imshow_kws,
+                                    tick_fontsize)
+                    # rebind the colorbar to the new image
+                    if cbar is None:
+                        cbar = fig.colorbar(img, ax=ax, fraction=0.046, pad=0.04)
+                    else:
+                        cbar.update_normal(img)
+                else:
+                    img.set_data(values)
+                    col_tick_labels, col_tick_locs = _block_ticks(col_labels)
+                    row_tick_labels, row_tick_locs = _block_ticks(row_labels)
+                    ax.set_xticks(col_tick_locs, col_tick_labels, rotation=90,
+                                  fontsize=tick_fontsize)
+                    ax.set_yticks(row_tick_locs, row_tick_labels, fontsize=tick_fontsize)
+                ax.set_title(title if title is not None else '')
+                fig.tight_layout()   # same layout as `_render_rsm_panel` (n_jobs > 1)
+                pdf.savefig(fig)
+        else:
+            with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+                futures = [executor.submit(_render_rsm_panel, *panel_args(i), imshow_kws,
+                                           figsize, dpi, tick_fontsize)
+                           for i in range(n_panels)]
+                for future in futures:
+                    rgba = future.result()
+                    fig = Figure(figsize=(rgba.shape[1] / dpi, rgba.shape[0] / dpi), dpi=dpi)
+                    FigureCanvasAgg(fig)
+                    fig.figimage(rgba, resize=False)
+                    pdf.savefig(fig, dpi=dpi)
+    return filename
+
+
+def _default_movie_writer(filename, fps):
+    if Path(filename).suffix.lower() == '.gif':
+        return animation.PillowWriter(fps=fps)
+    return animation.FFMpegWriter(fps=fps)
+
+
+def _write_rsm_movie(frames, row_labels, col_labels, titles, filename, fps, dpi, figsize,
+                     imshow_kws, tick_fontsize, writer=None):
+    """Streams (frame, row, col) RSMs to a movie file, updating a single image artist."""
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    img = _draw_rsm(ax, frames[0], row_labels, col_labels, imshow_kws, tick_fontsize)
+    fig.colorbar(img, ax=ax, fraction=0.046, pad=0.04)
+    title = ax.set_title('')
+    fig.tight_layout()
+
+    if writer is None:
+        writer = _default_movie_writer(filename, fps)
+
+    with writer.saving(fig, str(filename), dpi=dpi):
+        for values, frame_title in zip(frames, titles):
+            img.set_data(values)
+            title.set_text(frame_title)
+            writer.grab_frame()
+    return filename
+
+
+def _join_movie_parts(part_files, filename, fps):
+    """Joins consecutive movie chunks into `filename` (w/o re-encoding, except for .gif),
+    then deletes the chunks."""
+    try:
+        if filename.suffix.lower() == '.gif':
+            from PIL import Image, ImageSequence
+
+            frames = []
+            for part_file in part_files:
+                with Image.open(part_file) as im:
+                    frames.extend(frame.copy() for frame in ImageSequence.Iterator(im))
+            frames[0].save(filename, save_all=True, append_images=frames[1:],
+                           duration=int(1000 / fps), loop=0)
+        else:
+            list_file = filename.with_name(f".{filename.stem}_parts.txt")
+            list_file.write_text(''.join(f"file '{f.resolve()}'\n" for f in part_files))
+            try:
+                subprocess.run([animation.FFMpegWriter.bin_path(), '-y', '-loglevel', 'error',
+                                '-f', 'concat', '-safe', '0', '-i', str(list_file),
+                                '-c', 'copy', str(filename)], check=True)
+            finally:
+                list_file.unlink(missing_ok=True)
+    finally:
+        for part_file in part_files:
+            part_file.unlink(missing_ok=True)
+    return filename
+
+
+def _frame_titles(da_rdm, frame_dim, title_fmt):
+    if frame_dim not in da_rdm.coords:
+        return [f"{frame_dim} = {i}" for i in range(da_rdm.sizes[frame_dim])]
+    values = da_rdm[frame_dim].to_numpy()
+    if title_fmt is None:
+        # fixed precision only for numeric coordinates (not for strings, datetimes, ...)
+        title_fmt = "{dim} = {value:.2f}" if values.dtype.kind in 'iuf' else "{dim} = {value}"
+    return [title_fmt.format(dim=frame_dim, value=v) for v in values]
+
+
+def export_rdm_movie(da_rdm, filename, frame_dim='time', row_coord='row_stim',
+                     col_coord='col_stim', title_fmt=None, fps=10, dpi=100,
+                     figsize=(6, 6), imshow_kws=None, tick_fontsize=8, writer=None, n_jobs=1):
+    """Exports a stack of RSMs/RDMs (e.g. time-resolved RDMs) to a movie (.mp4, .gif, ...).
+
+    The figure is built once; each frame only updates the image data and title, and frames
+    are streamed directly to the encoder (`matplotlib.animation` writer, `grab_frame`).
+
+    With `n_jobs > 1`, frames are split into `n_jobs` consecutive chunks, written in parallel
+    processes to temporary `.{stem}_part{k:03d}{suffix}` files, then joined into `filename`
+    (w/ the ffmpeg concat demuxer, w/o re-encoding; .gif chunks are joined w/ Pillow).
+
+    Args:
+        da_rdm (xr.DataArray): RDMs w/ dims (`frame_dim`, row, col), e.g. from
+          `xrsa.rdm.compute_time_resolved_rdm` or `compute_trial_respvec_rdm`
+        filename (Union[str, Path]): output movie file (.gif uses Pillow, otherwise ffmpeg)
+        frame_dim (str): dimension to animate over
+        row_coord (str): stimulus coordinate along rows
+        col_coord (str): stimulus coordinate along columns
+        title_fmt (str): frame title, formatted w/ `dim` and `value` (coordinate value).
+          Default: "{dim} = {value:.2f}" for numeric coordinates, else "{dim} = {value}"
+        fps (int): frames per second
+        dpi (int): frame resolution
+        figsize (tuple): figure size (inches)
+        imshow_kws (dict): passed to `ax.imshow`
+        tick_fontsize (int): tick label font size
+        writer (animation.AbstractMovieWriter): movie writer (`n_jobs=1` only)
+        n_jobs (int): # of worker processes
+
+    Returns:
+        (Path): movie file
+
+    Examples:
+        >>> ds_rdm_t = xrsa.rdm.compute_time_resolved_rdm(ds_bc_trials, 0.25, 0.05)
+        >>> export_rdm_movie(ds_rdm_t['Fc_zscore'], 'rdm_movie.mp4', fps=20)
+    """
+    filename = Path(filename)
+    row_dim, = da_rdm[row_coord].dims
+    col_dim, = da_rdm[col_coord].dims
+
+    frames = da_rdm.transpose(frame_dim, row_dim, col_dim).to_numpy()
+    row_labels = tuple(da_rdm[row_coord].to_numpy().tolist())
+    col_labels = tuple(da_rdm[col_coord].to_numpy().tolist())
+
+    titles = _frame_titles(da_rdm, frame_dim, title_fmt)
+
+    movie_kws = dict(fps=fps, dpi=dpi, figsize=figsize, imshow_kws=imshow_kws,
+                     tick_fontsize=tick_fontsize)
+
+    if n_jobs == 1:
+        return _write_rsm_movie(frames, row_labels, col_labels, titles, filename,
+                                writer=writer, **movie_kws)
+
+    chunks = np.array_split(np.arange(frames.shape[0]), n_jobs)
+    chunks = [idx for idx in chunks if idx.size > 0]
+    part_files = [filename.with_name(f".{filename.stem}_part{k:03d}{filename.suffix}")
+                  for k in range(len(chunks))]
+
+    try:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            futures = [executor.submit(_write_rsm_movie, frames[idx], row_labels, col_labels,
+                                       titles[idx[0]:idx[-1] + 1], part_file, **movie_kws)
+                       for idx, part_file in zip(chunks, part_files)]
+            for future in futures:
+                future.result()
+    except BaseException:
+        for part_file in part_files:
+            part_file.unlink(missing_ok=True)
+        raise
+    return _join_movie_parts(part_files, filename, fps)
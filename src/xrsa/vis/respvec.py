@@ -1,16 +1,83 @@
+import hashlib
+from collections import OrderedDict
+import numpy as np
+import pandas as pd
 import xarray as xr
+from scipy.cluster import hierarchy
 import matplotlib.pyplot as plt
 import ryeutils
-import seaborn as sns
 from mpl_toolkits.axes_grid1 import ImageGrid
 
 plt.rcParams.update({'pdf.fonttype': 42,
                      'text.usetex': False})
 
 
+# least recently used linkages are evicted once the cache holds LINKAGE_CACHE_MAXSIZE entries
+LINKAGE_CACHE_MAXSIZE = 32
+_LINKAGE_CACHE = OrderedDict()
+
+
+def _linkage_cache_key(X, metric, method):
+    h = hashlib.sha1()
+    h.update(f"{X.shape}|{X.dtype}|{metric}|{method}".encode())
+    h.update(np.ascontiguousarray(X).tobytes())
+    return h.hexdigest()
+
+
+def compute_respvec_linkage(da_respvec, dim='cells', metric='correlation', method='average',
+                            dtype=np.float32, use_cache=True):
+    """Hierarchical clustering linkage of the rows along `dim` of a 2D response vector array.
+
+    Linkages are computed on `dtype` (float32) data w/ NaNs set to 0, and cached in memory by
+    data content + parameters, so re-plotting (e.g. w/ different color scales or data
+    variables sharing the same cells) doesn't redo the clustering. The cache keeps the
+    `LINKAGE_CACHE_MAXSIZE` most recently used linkages (see `clear_linkage_cache`).
+
+    Args:
+        da_respvec (xr.DataArray): 2D response vectors, e.g. (cells, trials)
+        dim (str): dimension to cluster (rows of the linkage)
+        metric (str): distance metric (see `scipy.spatial.distance.pdist`)
+        method (str): linkage method (see `scipy.cluster.hierarchy.linkage`)
+        dtype (np.dtype): dtype of the data used for clustering
+        use_cache (bool): whether to use/store cached linkages
+
+    Returns:
+        Z (np.ndarray): linkage matrix, w/ `da_respvec.sizes[dim] - 1` rows
+    """
+    X = da_respvec.transpose(dim, ...).to_numpy().astype(dtype, copy=False)
+    X = np.nan_to_num(X, nan=0.0)
+
+    key = _linkage_cache_key(X, metric, method)
+    if use_cache and key in _LINKAGE_CACHE:
+        _LINKAGE_CACHE.move_to_end(key)
+        return _LINKAGE_CACHE[key]
+
+    Z = hierarchy.linkage(X, method=method, metric=metric)
+    if use_cache:
+        _LINKAGE_CACHE[key] = Z
+        while len(_LINKAGE_CACHE) > LINKAGE_CACHE_MAXSIZE:
+            _LINKAGE_CACHE.popitem(last=False)
+    return Z
+
+
+def clear_linkage_cache():
+    """Clears linkages cached by `compute_respvec_linkage`."""
+    _LINKAGE_CACHE.clear()
+
+
+def _downsample_rows(X, row_order, n_bins):
+    """Bin-averages rows of `X` (in `row_order`) into `n_bins` consecutive bins."""
+    X = X[row_order]
+    bin_starts = np.linspace(0, X.shape[0], n_bins + 1).astype(int)[:-1]
+    bin_counts = np.diff(np.append(bin_starts, X.shape[0]))
+    return np.add.reduceat(X, bin_starts, axis=0) / bin_counts[:, None]
+
+
 def plot_trials(da_respvec, stim_coord='stim',
                 cell_dim='cells', trial_dim='trials',
-                metric='correlation', method='average'):
+                metric='correlation', method='average',
+                row_linkage=None, col_linkage=None, col_cluster=True,
+                max_cells=None, **clustermap_kws):
     """
 
     Args:
@@ -20,26 +87,57 @@ def plot_trials(da_respvec, stim_coord='stim',
         trial_dim (str): trial dimension name (default 'stim')
         metric (str): distance metric used for clustering (see scipy.spatial.distance.pdist)
         method (str): Linkage method to use for calculating clusters.
+        row_linkage (np.ndarray): precomputed cell linkage (default: computed w/
+          `compute_respvec_linkage`, cached)
+        col_linkage (np.ndarray): precomputed trial linkage (default: computed w/
+          `compute_respvec_linkage`, cached)
+        col_cluster (bool): whether to cluster trials
+        max_cells (int): if there are more cells than this, cells are sorted by the cell
+          linkage and averaged in `max_cells` consecutive bins before plotting (the cell
+          dendrogram is not drawn)
+        **clustermap_kws: passed to `sns.clustermap`, overriding defaults (e.g. `vmin`, `cmap`)
 
     Returns:
         g (sns.ClusterGrid): Respvec clustermap
     """
+    import seaborn as sns
 
     stim_tick_labels, stim_tick_locs = ryeutils.main.get_tick_labels_and_locs(
             da_respvec[stim_coord].to_numpy())
 
+    if row_linkage is None:
+        row_linkage = compute_respvec_linkage(da_respvec, dim=cell_dim, metric=metric,
+                                              method=method)
+    if col_cluster and col_linkage is None:
+        col_linkage = compute_respvec_linkage(da_respvec, dim=trial_dim, metric=metric,
+                                              method=method)
+
     df_plot = da_respvec.transpose(cell_dim, trial_dim).to_pandas()
+    row_cluster = True
+
+    if max_cells is not None and df_plot.shape[0] > max_cells:
+        leaves = hierarchy.leaves_list(row_linkage)
+        df_plot = pd.DataFrame(_downsample_rows(df_plot.to_numpy(np.float32), leaves,
+                                                max_cells),
+                               columns=df_plot.columns)
+        row_cluster = False
+
+    use_clustermap_kws = dict(cmap='vlag',
+                              center=0,
+                              robust=True,
+                              xticklabels=True, yticklabels=False,
+                              figsize=(8.5, 11),
+                              dendrogram_ratio=(0.3, 0.2),
+                              cbar_pos=(.05, .825, .025, .15)
+                              )
+    use_clustermap_kws.update(**clustermap_kws)
 
-    g = sns.clustermap(df_plot, cmap='vlag',
-                       center=0,
-                       robust=True,
-                       xticklabels=True, yticklabels=False,
-                       figsize=(8.5, 11),
-                       metric=metric,
-                       method=method,
-                       dendrogram_ratio=(0.3, 0.2),
-                       cbar_pos=(.05, .825, .025, .15)
-                       # ax=ax, cbar_ax=cbar_ax
+    g = sns.clustermap(df_plot,
+                       row_cluster=row_cluster,
+                       col_cluster=col_cluster,
+                       row_linkage=row_linkage if row_cluster else None,
+                       col_linkage=col_linkage if col_cluster else None,
+                       **use_clustermap_kws
                        )
     g.ax_heatmap.set_title(f'metric={metric}, linkage={method}',
                            fontsize=10)
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# packages live in src/ (not installed)
+sys.path.insert(0, str(Path(__file__).resolve().parents[1].joinpath('src')))
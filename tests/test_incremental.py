@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+import xarray as xr
+
+from expt.incremental import acquisition_runner, load_artifact, save_artifact
+from external.suite2p.synthetic import make_synthetic_suite2p
+
+
+@pytest.fixture
+def synthetic_acq(tmp_path):
+    return make_synthetic_suite2p(tmp_path, n_cells=40, n_frames=3000, n_trials=20, n_stim=5)
+
+
+def test_acquisition_runner_default_suffix(synthetic_acq):
+    runner = acquisition_runner(synthetic_acq.stat_file, data_vars=['Fc_zscore'],
+                                dtype='float32')
+
+    assert runner.run() == ['suite2p', 'trials', 'respvec', 'rdm']
+    assert runner.run() == []
+    assert not list(runner.out_dir.glob('.*.tmp'))
+
+    ds_trials = load_artifact(runner.steps['trials'].output_file)
+    assert ds_trials.indexes['trials'].names == ['stim', 'stim_occ', 'trial_idx']
+    assert ds_trials.attrs['trials.stim_list'] == synthetic_acq.stim_list
+    assert ds_trials['Fc_zscore'].dtype == np.float32
+
+    ds_rdm = load_artifact(runner.steps['rdm'].output_file)
+    assert ds_rdm['Fc_zscore'].sizes['trial_row'] == len(synthetic_acq.stim_list)
+
+
+def test_save_artifact_removes_tmp_file_on_error(tmp_path):
+    bad = xr.Dataset({'x': ('cells', np.array([{}, {}, {}], dtype=object))})
+    with pytest.raises(Exception):
+        save_artifact(bad, tmp_path.joinpath('bad.nc'))
+    assert not list(tmp_path.glob('.*.tmp'))
+    assert not tmp_path.joinpath('bad.nc').exists()
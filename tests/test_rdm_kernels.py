@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+from scipy.spatial.distance import cdist
+
+from xrsa.rdm import DISTANCE_KERNELS, batched_pairwise_distances, shared_precision_matrix
+
+
+def _cdist_stack(x, metric, **kwargs):
+    return np.stack([cdist(b, b, metric, **kwargs) for b in x])
+
+
+@pytest.fixture
+def x():
+    # offset from 0 so that centering/conditioning matters
+    return np.random.default_rng(0).normal(size=(3, 20, 8)) + 5
+
+
+@pytest.fixture
+def x_nan(x):
+    x = x.copy()
+    x[0, 4, 2] = np.nan
+    x[2, 7, :] = np.nan
+    return x
+
+
+def _reference(x, metric):
+    if metric == 'mahalanobis':
+        return _cdist_stack(x, metric, VI=shared_precision_matrix(x))
+    return _cdist_stack(x, metric)
+
+
+@pytest.mark.parametrize('metric', sorted(DISTANCE_KERNELS))
+def test_kernel_matches_cdist(x, metric):
+    dist = batched_pairwise_distances(x, metric)
+    assert dist.dtype == np.float64
+    np.testing.assert_allclose(dist, _reference(x, metric), atol=1e-10)
+
+
+@pytest.mark.parametrize('metric', sorted(DISTANCE_KERNELS))
+def test_kernel_matches_cdist_float32(x, metric):
+    dist = batched_pairwise_distances(x.astype(np.float32), metric)
+    assert dist.dtype == np.float32
+    rtol = 1e-3 if metric == 'mahalanobis' else 1e-4
+    np.testing.assert_allclose(dist, _reference(x.astype(np.float32), metric), rtol=rtol,
+                               atol=1e-4)
+
+
+@pytest.mark.parametrize('metric', sorted(DISTANCE_KERNELS))
+def test_kernel_nan_rows(x_nan, metric):
+    dist = batched_pairwise_distances(x_nan, metric)
+    ref = _reference(x_nan, metric)
+
+    # NaNs only reach the rows/columns of rows w/ NaNs, like cdist
+    np.testing.assert_array_equal(np.isnan(dist), np.isnan(ref))
+    np.testing.assert_allclose(dist[np.isfinite(ref)], ref[np.isfinite(ref)], atol=1e-10)
+
+
+def test_sklearn_fallback(x_nan):
+    # sklearn goes through pdist/squareform (zero diagonal), so compare off-diagonal only
+    off_diag = ~np.eye(x_nan.shape[1], dtype=bool)
+    dist = batched_pairwise_distances(x_nan, 'braycurtis')[:, off_diag]
+    ref = _cdist_stack(x_nan, 'braycurtis')[:, off_diag]
+    np.testing.assert_array_equal(np.isnan(dist), np.isnan(ref))
+    np.testing.assert_allclose(dist[np.isfinite(ref)], ref[np.isfinite(ref)], atol=1e-12)
+
+
+def test_n_threads(x):
+    pytest.importorskip('threadpoolctl')
+    np.testing.assert_allclose(batched_pairwise_distances(x, 'euclidean', n_threads=1),
+                               batched_pairwise_distances(x, 'euclidean'))